@@ -0,0 +1,378 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018 University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmark the pure-Python hot paths of ElastiCluster.
+
+Each benchmark is run on inputs of increasing size (number of nodes,
+or number of cluster templates for configuration loading), and the
+timings are printed as a JSON object on standard output.  Save the
+output of a release and pass it with ``--compare`` to a later run to
+see the ratio of new to old timings, e.g.::
+
+  python benchmarks/bench_core.py --label 1.3 > baseline.json
+  python benchmarks/bench_core.py --compare baseline.json
+
+Run with ``--help`` for the list of options.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+# stdlib imports
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+# 3rd party imports
+import yaml
+
+# ElastiCluster imports
+from elasticluster import log
+from elasticluster.cluster import Cluster, NodeNamingPolicy
+from elasticluster.conf import load_config_files
+from elasticluster.providers.ansible_provider import AnsibleSetupProvider
+from elasticluster.repository import (
+    JsonRepository,
+    MemRepository,
+    PickleRepository,
+    YamlRepository,
+)
+
+
+#: list of ``(name, sizes, function)`` triples, see `benchmark`:func:
+BENCHMARKS = []
+
+NODE_COUNTS = (10, 100, 1000, 10000)
+TEMPLATE_COUNTS = (10, 100, 500)
+
+
+def benchmark(name, sizes=NODE_COUNTS):
+    """
+    Register the decorated function as a benchmark.
+
+    The function is called once for each item in `sizes`, with the
+    size and a scratch directory as arguments; it must do any
+    preparation work and then return a pair *(run, ops)*, where *run*
+    is the function to time (called with no arguments) and *ops* is
+    the number of elementary operations that a call to *run*
+    performs.
+    """
+    def register(func):
+        BENCHMARKS.append((name, sizes, func))
+        return func
+    return register
+
+
+def make_cluster(size, name='bench'):
+    """
+    Return a `Cluster` with `size` nodes, as if it had been started.
+    """
+    cluster = Cluster(name, repository=MemRepository())
+    for index in range(size):
+        node = cluster.add_node(
+            ('frontend' if index == 0 else 'compute'),
+            'image-id', 'bench', 'flavor', 'default')
+        node.instance_id = 'i-{0:08x}'.format(index)
+        node.ips = ['10.{0}.{1}.{2}'.format(
+            (index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)]
+        node.preferred_ip = node.ips[0]
+    return cluster
+
+
+_CONFIG_COMMON = """
+[cloud/sim]
+provider = simulated
+boot_time = 0
+
+[login/bench]
+image_user = bench
+user_key_name = bench
+user_key_private = {key}
+user_key_public = {key}
+
+[setup/bench]
+provider = ansible
+frontend_groups = slurm_master
+compute_groups = slurm_worker
+"""
+
+_CONFIG_CLUSTER = """
+[cluster/bench{index}]
+cloud = sim
+login = bench
+setup = bench
+image_id = image-{index}
+flavor = flavor-{index}
+security_group = default
+frontend_nodes = 1
+compute_nodes = {index}
+"""
+
+
+@benchmark('conf.load_config_files', sizes=TEMPLATE_COUNTS)
+def bench_load_config_files(size, workdir):
+    key = os.path.join(workdir, 'id_rsa')
+    with open(key, 'w'):
+        pass
+    path = os.path.join(workdir, 'config')
+    with open(path, 'w') as config:
+        config.write(_CONFIG_COMMON.format(key=key))
+        for index in range(size):
+            config.write(_CONFIG_CLUSTER.format(index=index))
+    def run():
+        config = load_config_files([path])
+        assert len(config['cluster']) == size
+    return run, 1
+
+
+def _bench_repository(repo_class):
+    def save(size, workdir):
+        repo = repo_class(workdir)
+        cluster = make_cluster(size)
+        cluster.repository = repo
+        return (lambda: repo.save_or_update(cluster)), 1
+
+    def get(size, workdir):
+        repo = repo_class(workdir)
+        cluster = make_cluster(size)
+        cluster.repository = repo
+        repo.save_or_update(cluster)
+        return (lambda: repo.get(cluster.name)), 1
+
+    name = repo_class.__name__
+    benchmark(name + '.save_or_update')(save)
+    benchmark(name + '.get')(get)
+
+for _repo_class in PickleRepository, JsonRepository, YamlRepository:
+    _bench_repository(_repo_class)
+del _repo_class
+
+
+# YAML serialization as done by ElastiCluster up to 1.3, for comparison
+_OMIT = ('_cloud_provider', '_lock', '_naming_policy', '_nodes_by_name',
+         '_setup_provider', 'repository', 'storage_file')
+
+def _legacy_yaml_dump(cluster, fp):
+    state = json.loads(json.dumps(cluster.to_dict(omit=_OMIT), default=dict))
+    yaml.safe_dump(state, fp, default_flow_style=False, indent=4)
+
+def _legacy_yaml_load(fp):
+    return Cluster(**yaml.safe_load(fp))
+
+
+def _bench_yaml_dump(dump):
+    def setup(size, workdir):
+        cluster = make_cluster(size)
+        path = os.path.join(workdir, 'cluster.yaml')
+        def run():
+            with open(path, 'wb') as fp:
+                dump(cluster, fp)
+        return run, 1
+    return setup
+
+def _bench_yaml_load(load):
+    def setup(size, workdir):
+        path = os.path.join(workdir, 'cluster.yaml')
+        with open(path, 'wb') as fp:
+            YamlRepository.dump(make_cluster(size), fp)
+        def run():
+            with open(path, 'rb') as fp:
+                load(fp)
+        return run, 1
+    return setup
+
+benchmark('YamlRepository.dump')(_bench_yaml_dump(YamlRepository.dump))
+benchmark('YamlRepository.dump[legacy]')(_bench_yaml_dump(_legacy_yaml_dump))
+benchmark('YamlRepository.load')(
+    _bench_yaml_load(YamlRepository('.').load))
+benchmark('YamlRepository.load[legacy]')(_bench_yaml_load(_legacy_yaml_load))
+
+
+@benchmark('AnsibleSetupProvider._build_inventory')
+def bench_build_inventory(size, workdir):
+    provider = AnsibleSetupProvider(
+        groups={'frontend': ['slurm_master'], 'compute': ['slurm_worker']},
+        storage_path=workdir)
+    cluster = make_cluster(size)
+    # pylint: disable=protected-access
+    return (lambda: provider._build_inventory(cluster)), 1
+
+
+@benchmark('NodeNamingPolicy.new')
+def bench_naming_policy_new(size, workdir):
+    def run():
+        policy = NodeNamingPolicy()
+        for _ in range(size):
+            policy.new('compute')
+    return run, size
+
+
+@benchmark('NodeNamingPolicy.use')
+def bench_naming_policy_use(size, workdir):
+    names = ['compute{0:03d}'.format(index) for index in range(1, size + 1)]
+    def run():
+        policy = NodeNamingPolicy()
+        for name in names:
+            policy.use('compute', name)
+    return run, size
+
+
+@benchmark('Cluster.get_node_by_name')
+def bench_get_node_by_name(size, workdir):
+    cluster = make_cluster(size)
+    # look up at most 100 names, or this would grow quadratically
+    names = [node.name for node in cluster.get_all_nodes()][::max(1, size // 100)]
+    def run():
+        for name in names:
+            cluster.get_node_by_name(name)
+    return run, len(names)
+
+
+@benchmark('Cluster.get_all_nodes')
+def bench_get_all_nodes(size, workdir):
+    cluster = make_cluster(size)
+    return cluster.get_all_nodes, 1
+
+
+def run_benchmark(func, size, repeat, min_time):
+    """
+    Time `func` on input of the given `size` and return a result record.
+
+    The function returned by `func` is called in a loop until it has
+    run for at least `min_time` seconds, and the loop is repeated
+    `repeat` times; the best, median and worst average time per call
+    are reported.
+    """
+    workdir = tempfile.mkdtemp(prefix='elasticluster-bench.')
+    try:
+        run, ops = func(size, workdir)
+        # calibrate number of calls per loop
+        number = 1
+        while True:
+            start = default_timer()
+            for _ in range(number):
+                run()
+            elapsed = default_timer() - start
+            if elapsed >= min_time:
+                break
+            number *= 10
+        timings = [elapsed / number]
+        for _ in range(repeat - 1):
+            start = default_timer()
+            for _ in range(number):
+                run()
+            timings.append((default_timer() - start) / number)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    timings.sort()
+    return {
+        'size': size,
+        'ops': ops,
+        'number': number,
+        'repeat': repeat,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'max': timings[-1],
+        'per_op': timings[0] / ops,
+    }
+
+
+def compare(results, baseline_path):
+    """
+    Add to each record in `results` the ratio to the matching baseline timing.
+    """
+    with open(baseline_path, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    old = dict(((rec['name'], rec['size']), rec)
+               for rec in baseline['results'])
+    for rec in results:
+        prev = old.get((rec['name'], rec['size']))
+        if prev:
+            rec['baseline'] = prev['min']
+            rec['ratio'] = rec['min'] / prev['min'] if prev['min'] else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument(
+        '-k', '--select', metavar='PATTERN', action='append', default=[],
+        help=("Only run benchmarks whose name matches this shell pattern;"
+              " can be repeated."))
+    parser.add_argument(
+        '--max-size', type=int, default=None,
+        help="Skip inputs larger than this.")
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="Number of timing loops per benchmark.  Default: %(default)s")
+    parser.add_argument(
+        '--min-time', type=float, default=0.2,
+        help="Minimum duration of each timing loop.  Default: %(default)s")
+    parser.add_argument(
+        '--label', default=None,
+        help="Free-form label (e.g., release number) to record in the output.")
+    parser.add_argument(
+        '--compare', metavar='FILE', default=None,
+        help="Report the ratio of timings to those in this earlier output.")
+    parser.add_argument(
+        '-l', '--list', action='store_true',
+        help="List benchmark names and exit.")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _, _ in BENCHMARKS:
+            print(name)
+        return
+
+    logging.basicConfig()
+    log.setLevel(logging.ERROR)
+
+    results = []
+    for name, sizes, func in BENCHMARKS:
+        if args.select and not any(fnmatch.fnmatch(name, pattern)
+                                   for pattern in args.select):
+            continue
+        for size in sizes:
+            if args.max_size and size > args.max_size:
+                continue
+            rec = run_benchmark(func, size, args.repeat, args.min_time)
+            rec['name'] = name
+            results.append(rec)
+            sys.stderr.write('{name} [{size}]: {min:.6f}s\n'.format(**rec))
+
+    if args.compare:
+        compare(results, args.compare)
+    json.dump({
+        'label': args.label,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018 University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmark starting and stopping a cluster on the simulated cloud.
+
+A cluster of the requested size is started and then stopped using
+the ``simulated`` cloud provider (see module
+`elasticluster.providers.simulated`), so that the whole startup
+logic of ElastiCluster (API rate limiting, batching, SSH probes,
+checkpointing) runs for real, while VMs and SSH connections are
+faked.  Results are printed as a JSON object on standard output,
+e.g.::
+
+  python benchmarks/bench_start.py --nodes compute=1000 \\
+      --boot-time lognormal:3.4,0.3 --api-latency uniform:0.1,0.5
+
+Run with ``--help`` for the list of options.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+# stdlib imports
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# 3rd party imports
+from mock import patch
+
+# ElastiCluster imports
+from elasticluster import log
+from elasticluster.cluster import Node
+from elasticluster.conf import make_creator
+from elasticluster.exceptions import ClusterError
+from elasticluster.providers.simulated import connect_stub
+from elasticluster.utils import percentile
+
+
+_CONFIG = """
+[cloud/sim]
+provider = simulated
+{cloud}
+
+[login/sim]
+image_user = bench
+user_key_name = bench
+user_key_private = {key}
+user_key_public = {key}
+
+[setup/sim]
+provider = ansible
+{groups}
+
+[cluster/bench]
+cloud = sim
+login = sim
+setup = sim
+image_id = sim-image
+flavor = sim-flavor
+security_group = default
+bootstrap_max_concurrency = 0
+start_timeout = {start_timeout}
+straggler_factor = {straggler_factor}
+{nodes}
+"""
+
+
+def make_config(workdir, args):
+    """
+    Write a configuration file for the benchmark cluster and return its path.
+    """
+    key = os.path.join(workdir, 'id_rsa')
+    with open(key, 'w'):
+        pass
+    cloud = {
+        'api_latency': args.api_latency,
+        'boot_time': args.boot_time,
+        'ssh_delay': args.ssh_delay,
+        'stop_time': args.stop_time,
+        'failure_rate': args.failure_rate,
+        'boot_failure_rate': args.boot_failure_rate,
+        'quota': args.quota,
+        'throttle_rate': args.throttle_rate,
+        'max_instances_per_request': args.max_instances_per_request,
+        'api_rate_limit': args.api_rate_limit,
+        'api_burst': args.api_burst,
+        'metadata_cache_ttl': 0,
+    }
+    if args.seed is not None:
+        cloud['seed'] = args.seed
+    path = os.path.join(workdir, 'config')
+    with open(path, 'w') as config:
+        config.write(_CONFIG.format(
+            cloud='\n'.join('{0} = {1}'.format(k, v)
+                            for k, v in sorted(cloud.items())),
+            key=key,
+            groups='\n'.join('{0}_groups = {0}'.format(kind)
+                             for kind in args.nodes),
+            nodes='\n'.join('{0}_nodes = {1}'.format(kind, num)
+                            for kind, num in sorted(args.nodes.items())),
+            start_timeout=args.start_timeout,
+            straggler_factor=args.straggler_factor,
+        ))
+    return path
+
+
+def summarize(values):
+    """
+    Return a dictionary with the main statistics of sequence `values`.
+    """
+    if not values:
+        return None
+    return {
+        'min': min(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='elasticluster-bench.')
+    try:
+        creator = make_creator(make_config(workdir, args),
+                               storage_path=os.path.join(workdir, 'storage'))
+        cluster = creator.create_cluster('bench')
+        cluster.polling_interval = args.polling_interval
+        provider = cluster.cloud_provider
+
+        # record the time each node is first found reachable
+        reached = {}
+        reached_lock = threading.Lock()
+
+        def connect(node, keyfile=None, timeout=5):
+            ssh = connect_stub(node, keyfile, timeout)
+            if ssh:
+                with reached_lock:
+                    reached.setdefault(node.name, time.time())
+            return ssh
+
+        results = {
+            'nodes': sum(args.nodes.values()),
+            'params': dict((k, v) for k, v in vars(args).items()
+                           if k not in ('nodes', 'verbose')),
+        }
+
+        def phase(name, func):
+            calls_before = dict(provider.api_calls)
+            throttled_before = provider.throttled_calls
+            t0 = time.time()
+            error = None
+            try:
+                func()
+            except ClusterError as err:
+                error = str(err)
+            elapsed = time.time() - t0
+            results[name] = {
+                'wall_time': elapsed,
+                'error': error,
+                'api_calls': dict(
+                    (method, count - calls_before.get(method, 0))
+                    for method, count in provider.api_calls.items()
+                    if count > calls_before.get(method, 0)),
+                'throttled_calls': provider.throttled_calls - throttled_before,
+            }
+            return t0
+
+        with patch.object(Node, 'connect', connect):
+            t0 = phase('start', lambda: cluster.start(
+                max_concurrent_requests=args.max_concurrent_requests))
+            results['start']['ready_nodes'] = len(reached)
+            results['start']['time_to_ready'] = summarize(
+                [t - t0 for t in reached.values()])
+            phase('stop', lambda: cluster.stop(
+                force=True, wait=True,
+                max_concurrent_requests=args.max_concurrent_requests))
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_nodes(text):
+    nodes = {}
+    for item in text.split(','):
+        kind, _, num = item.partition('=')
+        nodes[kind.strip()] = int(num)
+    return nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument(
+        '--nodes', type=parse_nodes, default=parse_nodes('frontend=1,compute=100'),
+        metavar='KIND=NUM[,KIND=NUM...]',
+        help="Number of nodes of each kind. Default: %(default)s")
+    parser.add_argument('--api-latency', default='uniform:0.05,0.2',
+                        metavar='DIST', help="Default: %(default)s")
+    parser.add_argument('--boot-time', default='lognormal:2.3,0.3',
+                        metavar='DIST', help="Default: %(default)s")
+    parser.add_argument('--ssh-delay', default='uniform:0,2',
+                        metavar='DIST', help="Default: %(default)s")
+    parser.add_argument('--stop-time', default='uniform:1,5',
+                        metavar='DIST', help="Default: %(default)s")
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--boot-failure-rate', type=float, default=0)
+    parser.add_argument('--quota', type=int, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--max-instances-per-request', type=int, default=1)
+    parser.add_argument('--api-rate-limit', type=float, default=10)
+    parser.add_argument('--api-burst', type=int, default=20)
+    parser.add_argument('--max-concurrent-requests', type=int, default=0)
+    parser.add_argument('--polling-interval', type=float, default=10)
+    parser.add_argument('--start-timeout', type=int, default=600)
+    parser.add_argument('--straggler-factor', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    log.setLevel(max(logging.DEBUG, logging.WARNING - 10 * args.verbose))
+
+    json.dump(run(args), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
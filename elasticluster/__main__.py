@@ -17,6 +17,7 @@
 #
 
 # System imports
+import atexit
 import logging
 import os
 import shutil
@@ -48,10 +49,12 @@ from elasticluster.subcommands import (
     SshFrontend,
     Start,
     Stop,
+    Timeline,
 )
 from elasticluster.conf import Creator
 from elasticluster.exceptions import ConfigurationError
 from elasticluster.migration_tools import MigrationCommand
+from elasticluster.providers import call_stats
 
 
 __author__ = ', '.join([
@@ -86,6 +89,13 @@ class ElastiCluster(cli.app.CommandLineApp):
                              " all files matching"
                              " pattern `PATH.d/*.conf` are parsed."),
                        default=self.default_configuration_file)
+        self.add_param('--refresh-cache', action='store_true', default=False,
+                       help=("Discard cached information about clouds"
+                             " (e.g., image and flavor IDs) and look it"
+                             " up again."))
+        self.add_param('--stats', action='store_true', default=False,
+                       help=("Print statistics of calls to the cloud"
+                             " provider (count, errors, latency) on exit."))
         self.add_param('--version', action='store_true',
                        help="Print version information and exit.")
 
@@ -96,6 +106,7 @@ class ElastiCluster(cli.app.CommandLineApp):
                     Stop(self.params),
                     ListClusters(self.params),
                     ListNodes(self.params),
+                    Timeline(self.params),
                     ListTemplates(self.params),
                     SetupCluster(self.params),
                     ResizeCluster(self.params),
@@ -152,6 +163,17 @@ class ElastiCluster(cli.app.CommandLineApp):
                                  "%s\n" % (str(ex)))
                 sys.exit(1)
 
+        if self.params.stats:
+            atexit.register(self.print_stats)
+
+        if self.params.refresh_cache:
+            cache_dir = os.path.join(
+                self.params.storage, Creator.METADATA_CACHE_DIR)
+            if os.path.isdir(cache_dir):
+                log.debug("Discarding cloud metadata cache in `%s` ...",
+                          cache_dir)
+                shutil.rmtree(cache_dir, ignore_errors=True)
+
         self.check_config_or_copy_template()
 
         assert self.params.func, "No subcommand defined in `ElastiCluster.setup()"
@@ -162,6 +184,11 @@ class ElastiCluster(cli.app.CommandLineApp):
             sys.stderr.write('\n')
             sys.exit(1)
 
+    @staticmethod
+    def print_stats():
+        """Print statistics of cloud provider calls to STDERR."""
+        sys.stderr.write(call_stats.format())
+
     def check_config_or_copy_template(self):
         # If no configuration file was specified and default does not exists and the user did not create a config dir...
         if not os.path.isfile(self.params.config) and not os.path.isdir(self.params.config + '.d'):
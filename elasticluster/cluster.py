@@ -23,14 +23,12 @@ Riccardo Murri <riccardo.murri@gmail.com>
 
 # System imports
 from collections import defaultdict
-from copy import copy
 import itertools
-import operator
 import os
+import Queue
 import re
-import signal
 import socket
-import sys
+import threading
 import time
 from multiprocessing.dummy import Pool
 
@@ -44,18 +42,19 @@ from elasticluster.exceptions import (
     ClusterError,
     ClusterSizeError,
     ConfigurationError,
-    InstanceError,
     InstanceNotFoundError,
     NodeNotFound,
     TimeoutError,
 )
 from elasticluster.repository import MemRepository
 from elasticluster.utils import (
+    Backoff,
     Struct,
     get_num_processors,
+    get_retry_after,
     parse_ip_address_and_port,
-    sighandler,
-    timeout,
+    percentile,
+    wait_until,
 )
 
 SSH_PORT = 22
@@ -109,6 +108,22 @@ class Cluster(Struct):
         succeed within `start_timeout`, then the node is marked as
         "down".
 
+    :param int ssh_probe_max_concurrency: Maximum number of nodes
+        that are probed for SSH connectivity at the same time.
+
+    :param int bootstrap_max_concurrency: Maximum number of
+        concurrent runs of the setup provider's bootstrap step
+        during `start`:meth:; ``0`` disables the bootstrap step.
+
+    :param float straggler_factor: During `start`:meth:, replace
+        any node that has not become reachable after this many times
+        the median boot time of the other nodes with a new VM;
+        ``0`` disables straggler detection.
+
+    :param int overprovision: During `start`:meth:, request this
+        many more nodes of each kind than configured, and terminate
+        the slowest ones once enough nodes of that kind are reachable.
+
     :param repository: by default the
                        :py:class:`elasticluster.repository.MemRepository` is
                        used to store the cluster in memory. Provide another
@@ -121,7 +136,14 @@ class Cluster(Struct):
     :ivar nodes: dict [node_type] = [:py:class:`Node`] that represents all
                  nodes in this cluster
     """
-    polling_interval = 10  #: how often to ask the cloud provider for node state
+    polling_interval = 10  #: max seconds between polls of the node state
+    checkpoint_interval = 30  #: min seconds between saves of the cluster state
+
+    # defaults for clusters saved by older versions of ElastiCluster
+    ssh_probe_max_concurrency = 20
+    bootstrap_max_concurrency = 2
+    straggler_factor = 0
+    overprovision = 0
 
     def __init__(self, name, user_key_name='elasticluster-key',
                  user_key_public='~/.ssh/id_rsa.pub',
@@ -131,6 +153,10 @@ class Cluster(Struct):
                  repository=None,
                  start_timeout=600,
                  ssh_probe_timeout=5,
+                 ssh_probe_max_concurrency=20,
+                 bootstrap_max_concurrency=2,
+                 straggler_factor=0,
+                 overprovision=0,
                  ssh_proxy_command='',
                  thread_pool_max_size=10,
                  **extra):
@@ -139,6 +165,10 @@ class Cluster(Struct):
         self._cloud_provider = cloud_provider
         self._setup_provider = setup_provider
         self.ssh_probe_timeout = ssh_probe_timeout
+        self.ssh_probe_max_concurrency = ssh_probe_max_concurrency
+        self.bootstrap_max_concurrency = bootstrap_max_concurrency
+        self.straggler_factor = straggler_factor
+        self.overprovision = overprovision
         self.ssh_proxy_command = ssh_proxy_command
         self.start_timeout = start_timeout
         self.thread_pool_max_size = thread_pool_max_size
@@ -156,7 +186,15 @@ class Cluster(Struct):
         # this needs to exist before `add_node()` is called
         self._naming_policy = NodeNamingPolicy()
 
+        # nodes still starting after an "early quorum" `start()`
+        self._startup_pipeline = None
+        # serializes saving the cluster and changes to the node lists,
+        # which may happen in the startup pipeline thread, see `_save()`
+        self._lock = threading.RLock()
+
         self.nodes = {}
+        # node name -> `Node`, see `_get_node_index()`
+        self._nodes_by_name = {}
         if 'nodes' in extra:
             # Build the internal nodes. This is mostly useful when loading
             # the cluster from json files.
@@ -194,7 +232,7 @@ class Cluster(Struct):
     @cloud_provider.setter
     def cloud_provider(self, provider):
         self._cloud_provider = provider
-        for node in self.get_all_nodes():
+        for node in self.iter_nodes():
             node._cloud_provider = provider
 
     def to_dict(self, omit=()):
@@ -209,14 +247,18 @@ class Cluster(Struct):
         return result
 
     def __getstate__(self):
-        return self.to_dict(omit=('_cloud_provider', '_naming_policy',
-                                  '_setup_provider',))
+        return self.to_dict(omit=('_cloud_provider', '_lock', '_naming_policy',
+                                  '_nodes_by_name', '_setup_provider',
+                                  '_startup_pipeline',))
 
     def __setstate__(self, state):
         self.__dict__ = state
         self.__dict__['_setup_provider'] = None
         self.__dict__['_cloud_provider'] = None
         self.__dict__['_naming_policy'] = None
+        self.__dict__['_nodes_by_name'] = None
+        self.__dict__['_startup_pipeline'] = None
+        self.__dict__['_lock'] = threading.RLock()
 
     def __update_option(self, cfg, key, attr):
         oldvalue = getattr(self, attr)
@@ -230,8 +272,11 @@ class Cluster(Struct):
         keys = Struct.keys(self)
         for key in (
                 '_cloud_provider',
+                '_lock',
                 '_naming_policy',
+                '_nodes_by_name',
                 '_setup_provider',
+                '_startup_pipeline',
                 'known_hosts_file',
                 'repository',
         ):
@@ -331,7 +376,10 @@ class Cluster(Struct):
             self._naming_policy.use(kind, name)
         node = Node(name=name, **extra)
 
-        self.nodes[kind].append(node)
+        with self._lock:
+            self.nodes[kind].append(node)
+            if self._nodes_by_name is not None:
+                self._nodes_by_name[name] = node
         return node
 
     def add_nodes(self, kind, num, image_id, image_user, flavor,
@@ -376,31 +424,68 @@ class Cluster(Struct):
         if node.kind not in self.nodes:
             raise NodeNotFound("Unable to remove node %s: invalid node type `%s`.",
                                node.name, node.kind)
-        else:
-            try:
-                index = self.nodes[node.kind].index(node)
-                if self.nodes[node.kind][index]:
-                    del self.nodes[node.kind][index]
-                if stop:
-                    node.stop()
-                self._naming_policy.free(node.kind, node.name)
-                self.repository.save_or_update(self)
-                remaining_nodes = self.get_all_nodes()
-                self._gather_node_ip_addresses(
-                    remaining_nodes, self.start_timeout, self.ssh_probe_timeout,
-                    remake=True)
-            except ValueError:
-                raise NodeNotFound("Node %s not found in cluster" % node.name)
+        if not self._remove_nodes([node]):
+            raise NodeNotFound("Node %s not found in cluster" % node.name)
+        if stop:
+            node.stop()
+        self._naming_policy.free(node.kind, node.name)
+        self._save()
+        remaining_nodes = self.get_all_nodes()
+        self._gather_node_ip_addresses(
+            remaining_nodes, self.start_timeout, self.ssh_probe_timeout,
+            remake=True)
+
+    def _remove_nodes(self, nodes):
+        """
+        Remove `nodes` from the node lists and the name index.
 
-    def start(self, min_nodes=None, max_concurrent_requests=0):
+        Nodes are matched by identity, and the remaining nodes keep
+        their order; each list of nodes is only walked once, however
+        many nodes are removed from it.  Return number of nodes that
+        were actually removed.
+        """
+        to_remove = set(id(node) for node in nodes)
+        removed = 0
+        with self._lock:
+            for kind in set(node.kind for node in nodes):
+                kind_nodes = self.nodes.get(kind)
+                if not kind_nodes:
+                    continue
+                remaining = [node for node in kind_nodes
+                             if id(node) not in to_remove]
+                removed += len(kind_nodes) - len(remaining)
+                # update in place, as callers may hold a reference to the list
+                kind_nodes[:] = remaining
+            if self._nodes_by_name is not None:
+                for node in nodes:
+                    if self._nodes_by_name.get(node.name) is node:
+                        del self._nodes_by_name[node.name]
+        return removed
+
+    def _save(self):
+        """
+        Save the cluster to its repository.
+
+        After an "early quorum" `start`:meth:, the startup pipeline
+        thread saves the cluster and removes nodes from it while the
+        main thread configures it; saves and changes to the node
+        lists are therefore serialized by the cluster lock.
+        """
+        with self._lock:
+            self.repository.save_or_update(self)
+
+    def start(self, min_nodes=None, max_concurrent_requests=0,
+              bootstrap=True, early_quorum=False):
         """
         Starts up all the instances in the cloud.
 
-        To speed things up, all
-        instances are started in a seperate thread. To make sure
-        ElastiCluster is not stopped during creation of an instance, it will
-        overwrite the sigint handler. As soon as the last started instance
-        is returned and saved to the repository, sigint is executed as usual.
+        Nodes are processed independently of each other: each node
+        is probed via SSH as soon as the cloud provider reports it
+        running, and then "bootstrapped" by the setup provider as soon
+        as it answers SSH connections (see `NodeStartupPipeline`:class:).
+        If ElastiCluster is interrupted with Ctrl+C, it waits until all
+        pending start requests have returned, and saves the cluster
+        state before exiting.
 
         A VM instance is considered 'up and running' as soon as an SSH
         connection can be established. If the startup timeout is reached before
@@ -418,113 +503,135 @@ class Cluster(Struct):
           VMs; if 1 or less, start nodes one at a time (sequentially).
           The special value ``0`` means run 4 threads for each available
           processor.
+        :param bool bootstrap:
+          If ``False``, skip the setup provider bootstrap step.
+        :param bool early_quorum:
+          If ``True``, return as soon as the minimum number of nodes of
+          each kind is up and running; other nodes keep starting in
+          the background.  In this case, `setup`:meth: only configures
+          the nodes that are up at the time it is called, and
+          `setup_late_nodes`:meth: must be called afterwards to wait
+          for the remaining nodes and configure them.
         """
 
+        min_nodes = self._compute_min_nodes(min_nodes)
+        if self.overprovision > 0:
+            targets = self._add_spare_nodes(self.overprovision)
+        else:
+            targets = None
         nodes = self.get_all_nodes()
+        self._preflight(nodes)
 
         log.info(
             "Starting cluster nodes (timeout: %d seconds) ...",
             self.start_timeout)
-        if max_concurrent_requests == 0:
-            try:
-                max_concurrent_requests = 4 * get_num_processors()
-            except RuntimeError:
-                log.warning(
-                    "Cannot determine number of processors!"
-                    " will start nodes sequentially...")
-                max_concurrent_requests = 1
-        if max_concurrent_requests > 1:
-            nodes = self._start_nodes_parallel(nodes, max_concurrent_requests)
+        max_concurrent_requests = self._get_max_concurrent_requests(
+            max_concurrent_requests)
+
+        pipeline = NodeStartupPipeline(
+            self,
+            max_concurrent_requests=max_concurrent_requests,
+            max_concurrent_probes=self.ssh_probe_max_concurrency,
+            max_concurrent_bootstraps=(
+                self.bootstrap_max_concurrency if bootstrap else 0),
+            straggler_factor=self.straggler_factor,
+            targets=targets)
+        if early_quorum:
+            pipeline.run_in_background(nodes, self.start_timeout)
+            if pipeline.wait(lambda ready: self._has_quorum(ready, min_nodes)):
+                if not pipeline.done:
+                    log.info(
+                        "Minimum number of nodes is up and running;"
+                        " %d more nodes are still starting.",
+                        len(nodes) - len(pipeline.ready_nodes())
+                        - len(pipeline.released))
+                    self._startup_pipeline = pipeline
+                    return
+            not_ready_nodes = pipeline.not_ready
         else:
-            nodes = self._start_nodes_sequentially(nodes)
-
-        # checkpoint cluster state
-        self.repository.save_or_update(self)
-
-        not_started_nodes = self._check_starting_nodes(nodes, self.start_timeout)
-
-        # now that all nodes are up, checkpoint cluster state again
-        self.repository.save_or_update(self)
+            not_ready_nodes = pipeline.run(nodes, self.start_timeout)
 
-        # Try to connect to each node to gather IP addresses and SSH host keys
-        started_nodes = nodes - not_started_nodes
-        if not started_nodes:
-            raise ClusterSizeError("No nodes could be started!")
-        log.info(
-            "Checking SSH connection to nodes (timeout: %d seconds) ...",
-            self.start_timeout)
-        self._gather_node_ip_addresses(
-            started_nodes, self.start_timeout, self.ssh_probe_timeout)
         # It's possible that the node.connect() call updated the
         # `preferred_ip` attribute, so, let's save the cluster again.
-        self.repository.save_or_update(self)
+        self._save()
+
+        if nodes and len(not_ready_nodes) == len(nodes) - len(pipeline.released):
+            raise ClusterSizeError("No nodes could be started!")
 
         # A lot of things could go wrong when starting the cluster.
         # Check that the minimum number of nodes within each groups is
         # reachable. Raise `ClusterSizeError()` if not.
-        self._check_cluster_size(self._compute_min_nodes(min_nodes))
+        self._check_cluster_size(min_nodes)
 
-    def _start_nodes_sequentially(self, nodes):
+    @staticmethod
+    def _get_max_concurrent_requests(max_concurrent_requests):
         """
-        Start the nodes sequentially without forking.
+        Return the number of requests to the cloud API to run in parallel.
 
-        Return set of nodes that were actually started.
+        The special value ``0`` means 4 requests for each available
+        processor; values less than 1 mean: issue requests sequentially.
         """
-        log.debug("Note: will *not* issue parallel requests to cloud API.")
-        started_nodes = set()
-        for node in copy(nodes):
-            started = self._start_node(node)
-            if started:
-                started_nodes.add(node)
-            # checkpoint cluster state
-            self.repository.save_or_update(self)
-        return started_nodes
+        if max_concurrent_requests == 0:
+            try:
+                max_concurrent_requests = 4 * get_num_processors()
+            except RuntimeError:
+                log.warning(
+                    "Cannot determine number of processors!"
+                    " will issue requests sequentially...")
+                max_concurrent_requests = 1
+        if max_concurrent_requests <= 1:
+            log.debug("Note: will *not* issue parallel requests to cloud API.")
+            max_concurrent_requests = 1
+        return max_concurrent_requests
 
-    def _start_nodes_parallel(self, nodes, max_thread_pool_size):
+    def _add_spare_nodes(self, count):
         """
-        Start the nodes using a pool of multiprocessing threads for speed-up.
+        Add `count` more nodes of each kind that has nodes yet to start.
 
-        Return set of nodes that were actually started.
+        Spare nodes are copies of a not-yet-started node of the same
+        kind.  Return a dictionary mapping each such kind to the
+        number of nodes that were requested for it originally.
         """
-        # Create one thread for each node to start
-        thread_pool_size = min(len(nodes), max_thread_pool_size)
-        thread_pool = Pool(processes=thread_pool_size)
-        log.debug("Note: starting %d nodes concurrently.", thread_pool_size)
+        targets = {}
+        for kind, nodes in self.nodes.items():
+            pending = [node for node in nodes if not node.instance_id]
+            if not pending:
+                continue
+            targets[kind] = len(nodes)
+            model = pending[0]
+            for _ in range(count):
+                self.add_node(
+                    kind, model.image_id, model.image_user, model.flavor,
+                    model.security_group, image_userdata=model.image_userdata,
+                    **model.extra)
+        return targets
+
+    def _preflight(self, nodes):
+        """
+        Let the cloud provider check the parameters of nodes to start.
 
-        # pressing Ctrl+C flips this flag, which in turn stops the main loop
-        # down below
-        keep_running = True
+        One set of parameters is passed for each kind of node; nodes
+        that have been started already are not checked.
+        """
+        specs = {}
+        for node in nodes:
+            if not node.instance_id and node.kind not in specs:
+                specs[node.kind] = node.start_params()
+        if specs:
+            log.debug("Checking parameters of nodes to start ...")
+            self._cloud_provider.preflight(specs.values())
 
-        def sigint_handler(signal, frame):
-            """
-            Makes sure the cluster is saved, before the sigint results in
-            exiting during node startup.
-            """
-            log.error(
-                "Interrupted: will save cluster state and exit"
-                " after all nodes have started.")
-            keep_running = False
-
-        # intercept Ctrl+C
-        with sighandler(signal.SIGINT, sigint_handler):
-            result = thread_pool.map_async(self._start_node, nodes)
-            while not result.ready():
-                result.wait(1)
-                # check if Ctrl+C was pressed
-                if not keep_running:
-                    log.error("Aborting upon user interruption ...")
-                    # FIXME: `.close()` will keep the pool running until all
-                    # nodes have been started; should we use `.terminate()`
-                    # instead to interrupt node creation as soon as possible?
-                    thread_pool.close()
-                    thread_pool.join()
-                    self.repository.save_or_update(self)
-                    # FIXME: should raise an exception instead!
-                    sys.exit(1)
-
-            # keep only nodes that were successfully started
-            return set(node for node, ok
-                       in itertools.izip(nodes, result.get()) if ok)
+    @staticmethod
+    def _has_quorum(ready_nodes, min_nodes):
+        """
+        Return ``True`` if `ready_nodes` contains at least the number
+        of nodes of each kind given in the `min_nodes` dictionary.
+        """
+        count = defaultdict(int)
+        for node in ready_nodes:
+            count[node.kind] += 1
+        return all(count[kind] >= required
+                   for kind, required in min_nodes.iteritems())
 
     @staticmethod
     def _start_node(node):
@@ -541,8 +648,11 @@ class Cluster(Struct):
             log.info("Not starting node `%s` which is already up.", node.name)
             return True
         else:
+            node.timeline = {}
+            node.record_event('start_requested')
             try:
                 node.start()
+                node.record_event('started')
                 log.info("Node `%s` has been started.", node.name)
                 return True
             except Exception as err:
@@ -550,31 +660,71 @@ class Cluster(Struct):
                               node.name, err, err.__class__)
                 return False
 
-    def _check_starting_nodes(self, nodes, lapse):
+    def _start_nodes(self, nodes):
         """
-        Wait until all given nodes are alive, for max `lapse` seconds.
+        Start VMs for all the given `nodes` with a single request.
+
+        All nodes must have the same start parameters (see
+        `Node.start_params`:meth:).  Nodes that the cloud provider
+        could not start are left without an instance ID.
+
+        :return: bool -- True if all nodes were started, False otherwise
         """
-        with timeout(lapse, raise_timeout_error):
-            try:
-                while nodes:
-                    nodes = set(node for node in nodes
-                                if not node.is_alive())
-                    if nodes:
-                        log.debug("Waiting for %d more nodes to come up ...", len(nodes))
-                        time.sleep(self.polling_interval)
-            except TimeoutError:
-                log.error("Some nodes did not start correctly"
-                          " within the given %d-seconds timeout: %s",
-                          lapse, ', '.join(node.name for node in nodes))
-        # return list of not-yet-started nodes,
-        # so we can exclude them from coming rounds
-        return nodes
+        model = nodes[0]
+        log.info("Starting %d `%s` nodes from image `%s` with flavor %s ...",
+                 len(nodes), model.kind, model.image_id, model.flavor)
+        for node in nodes:
+            node.timeline = {}
+            node.record_event('start_requested')
+        try:
+            instance_ids = self._cloud_provider.start_instances(
+                len(nodes),
+                node_names=[("%s-%s" % (node.cluster_name, node.name))
+                            for node in nodes],
+                **model.start_params())
+        except Exception as err:
+            log.error("Could not start nodes %s: %s",
+                      ', '.join(node.name for node in nodes), err)
+            return False
+        for node, instance_id in itertools.izip(nodes, instance_ids):
+            if instance_id is not None:
+                node.instance_id = instance_id
+                node.record_event('started')
+                log.debug("Node `%s` has instance ID `%s`",
+                          node.name, instance_id)
+        return all(node.instance_id for node in nodes)
+
+    def _update_nodes_status(self, nodes):
+        """
+        Query the cloud provider for the state of all `nodes` at once.
 
-    def _gather_node_ip_addresses(self, nodes, lapse, ssh_timeout, remake=False):
+        The IP addresses of nodes that are running are updated as a
+        side effect.  Return the set of nodes that are running.
         """
-        Connect via SSH to each node.
+        nodes = [node for node in nodes if node.instance_id]
+        if not nodes:
+            return set()
+        status = self._cloud_provider.get_instances_status(
+            [node.instance_id for node in nodes])
+        running_nodes = set()
+        for node, (running, ips) in itertools.izip(nodes, status):
+            if running:
+                log.debug("node `%s` (instance id %s) is up.",
+                          node.name, node.instance_id)
+                node.record_event('running')
+                node.ips = list(ips or [])
+                running_nodes.add(node)
+            else:
+                log.debug("node `%s` (instance id `%s`) still building...",
+                          node.name, node.instance_id)
+        return running_nodes
 
-        Return set of nodes that could not be reached with `lapse` seconds.
+    def _load_known_hosts(self, remake=False):
+        """
+        Return path to the SSH "known hosts" file and its contents.
+
+        The path is ``None`` if the file cannot be opened.  If
+        `remake` is ``True``, any existing file is removed first.
         """
         # for convenience, we might set this to ``None`` if the file cannot
         # be opened -- but we do not want to forget the cluster-wide
@@ -596,33 +746,97 @@ class Cluster(Struct):
                         known_hosts_path, err)
             known_hosts_path = None
 
-        keys = paramiko.hostkeys.HostKeys(known_hosts_path)
+        return known_hosts_path, paramiko.hostkeys.HostKeys(known_hosts_path)
 
-        with timeout(lapse, raise_timeout_error):
-            try:
-                while nodes:
-                    for node in copy(nodes):
-                        ssh = node.connect(
-                            keyfile=known_hosts_path,
-                            timeout=ssh_timeout)
-                        if ssh:
-                            log.info("Connection to node `%s` successful,"
-                                     " using IP address %s to connect.",
-                                     node.name, node.connection_ip())
-                            # Add host keys to the keys object.
-                            for host, key in ssh.get_host_keys().items():
-                                for keytype, keydata in key.items():
-                                    keys.add(host, keytype, keydata)
-                            self._save_keys_to_known_hosts_file(keys)
-                            nodes.remove(node)
-                    if nodes:
-                        time.sleep(self.polling_interval)
-
-            except TimeoutError:
-                log.error(
-                    "Some nodes of the cluster were unreachable"
-                    " within the given %d-seconds timeout: %s",
-                    lapse, ', '.join(node.name for node in nodes))
+    @staticmethod
+    def _probe_node(node, keys, keys_lock, known_hosts_path, ssh_timeout):
+        """
+        Try to connect to `node` via SSH.
+
+        On success, add the node's SSH host keys to `keys` (holding
+        `keys_lock` while doing so) and return ``True``.
+        """
+        try:
+            ssh = node.connect(keyfile=known_hosts_path, timeout=ssh_timeout)
+        except Exception as err:
+            log.debug("Ignoring error connecting to node `%s`: %s",
+                      node.name, err)
+            return False
+        if not ssh:
+            return False
+        log.info("Connection to node `%s` successful,"
+                 " using IP address %s to connect.",
+                 node.name, node.connection_ip())
+        with keys_lock:
+            # Add host keys to the keys object.
+            for host, key in ssh.get_host_keys().items():
+                for keytype, keydata in key.items():
+                    keys.add(host, keytype, keydata)
+        ssh.close()
+        return True
+
+    def _gather_node_ip_addresses(self, nodes, lapse, ssh_timeout, remake=False):
+        """
+        Connect via SSH to each node.
+
+        Nodes are probed concurrently, using at most
+        `self.ssh_probe_max_concurrency` threads; nodes that cannot be
+        reached are probed again after a delay that grows exponentially
+        up to `self.polling_interval` seconds.
+
+        Return set of nodes that could not be reached with `lapse` seconds.
+        """
+        known_hosts_path, keys = self._load_known_hosts(remake)
+        # `HostKeys` is not thread-safe: all updates to `keys` (and
+        # to the set of reached nodes) must hold this lock
+        keys_lock = threading.Lock()
+        reached = set()
+
+        def probe(node):
+            if self._probe_node(node, keys, keys_lock,
+                                known_hosts_path, ssh_timeout):
+                with keys_lock:
+                    reached.add(node)
+
+        nodes = set(nodes)
+        if not nodes:
+            return nodes
+
+        thread_pool_size = max(1, min(len(nodes), self.ssh_probe_max_concurrency))
+        thread_pool = Pool(processes=thread_pool_size)
+        log.debug("Note: probing SSH on up to %d nodes concurrently.",
+                  thread_pool_size)
+
+        deadline = time.time() + lapse
+        backoff = Backoff(cap=self.polling_interval, deadline=deadline)
+        timed_out = False
+        try:
+            while nodes:
+                result = thread_pool.map_async(probe, list(nodes))
+                while not result.ready() and time.time() < deadline:
+                    result.wait(min(1, max(0, deadline - time.time())))
+                with keys_lock:
+                    nodes -= reached
+                    self._save_keys_to_known_hosts_file(keys)
+                if not result.ready():
+                    timed_out = True
+                    break
+                if nodes and not backoff.sleep():
+                    timed_out = True
+                    break
+        finally:
+            if timed_out:
+                # some probes may still be running: do not wait for them
+                thread_pool.terminate()
+            else:
+                thread_pool.close()
+                thread_pool.join()
+
+        if nodes:
+            log.error(
+                "Some nodes of the cluster were unreachable"
+                " within the given %d-seconds timeout: %s",
+                lapse, ', '.join(node.name for node in nodes))
 
         # return list of nodes
         return nodes
@@ -675,11 +889,31 @@ class Cluster(Struct):
 
         :return: list of :py:class:`Node`
         """
-        nodes = self.nodes.values()
-        if nodes:
-            return reduce(operator.add, nodes, list())
-        else:
-            return []
+        return list(self.iter_nodes())
+
+    def iter_nodes(self):
+        """
+        Iterate over all nodes in this cluster, one kind after the other.
+
+        Unlike `get_all_nodes`:meth:, no list is built; the node lists
+        must not be changed while iterating.
+        """
+        return itertools.chain.from_iterable(self.nodes.itervalues())
+
+    def _get_node_index(self):
+        """
+        Return dictionary mapping node names to `Node` objects.
+
+        The index is updated by `add_node`:meth: and `_remove_nodes`:meth:;
+        it is rebuilt after loading a pickled cluster, or if the number of
+        nodes shows that the node lists in `nodes` were modified directly.
+        """
+        index = self._nodes_by_name
+        if index is None or len(index) != sum(
+                len(nodes) for nodes in self.nodes.itervalues()):
+            index = dict((node.name, node) for node in self.iter_nodes())
+            self._nodes_by_name = index
+        return index
 
     def get_node_by_name(self, nodename):
         """Return the node corresponding with name `nodename`
@@ -687,24 +921,28 @@ class Cluster(Struct):
         :params nodename: Name of the node
         :type nodename: str
         """
-        nodes = dict((n.name, n) for n in self.get_all_nodes())
         try:
-            return nodes[nodename]
+            return self._get_node_index()[nodename]
         except KeyError:
             raise NodeNotFound(
                 "Node `{0}` not found in cluster `{1}`"
                 .format(nodename, self.name))
 
-    def stop(self, force=False, wait=False):
+    def stop(self, force=False, wait=False, max_concurrent_requests=0):
         """
         Terminate all VMs in this cluster and delete its repository.
 
         :param bool force:
           remove cluster from storage even if not all nodes could be stopped.
+        :param bool wait:
+          wait until the cloud provider reports all VMs as terminated.
+        :param int max_concurrent_requests:
+          Issue at most this number of requests to terminate VMs;
+          see `start`:meth: for the meaning of special values.
         """
         log.debug("Stopping cluster `%s` ...", self.name)
 
-        failed = self._stop_all_nodes(wait)
+        failed = self._stop_all_nodes(wait, max_concurrent_requests)
 
         if failed:
             if force:
@@ -714,7 +952,7 @@ class Cluster(Struct):
                     " However, as requested, data about the cluster"
                     " has been removed from local storage.")
             else:
-                self.repository.save_or_update(self)
+                self._save()
                 log.warning(
                     "Not all cluster nodes have been terminated."
                     " Fix errors above and re-run `elasticluster stop %s`",
@@ -728,38 +966,109 @@ class Cluster(Struct):
         if os.path.exists(self.known_hosts_file):
             os.remove(self.known_hosts_file)
 
-    def _stop_all_nodes(self, wait=False):
+    def _stop_all_nodes(self, wait=False, max_concurrent_requests=0):
         """
         Terminate all cluster nodes. Return number of failures.
+
+        Termination requests are issued concurrently, at most
+        `max_concurrent_requests` at a time.  If `wait` is true, poll
+        the cloud provider until none of the terminated VMs is
+        reported as running any more.
         """
-        failed = 0
-        for node in self.get_all_nodes():
+        nodes = []
+        not_started = []
+        for node in self.iter_nodes():
             if not node.instance_id:
                 log.warning(
                     "Node `%s` has no instance ID."
                     " Assuming it did not start correctly,"
                     " so removing it anyway from the cluster.", node.name)
-                self.nodes[node.kind].remove(node)
+                not_started.append(node)
                 continue
-            # try and stop node
-            try:
-                # wait and pause for and recheck.
-                node.stop(wait)
+            nodes.append(node)
+        self._remove_nodes(not_started)
+        if not nodes:
+            return 0
+
+        max_concurrent_requests = self._get_max_concurrent_requests(
+            max_concurrent_requests)
+        pool = Pool(processes=min(len(nodes), max_concurrent_requests))
+        failed = 0
+        terminated = []
+        # stopped nodes are removed from the cluster in batches, at
+        # each checkpoint, to avoid walking the node list every time
+        stopped = []
+        next_checkpoint = time.time() + self.checkpoint_interval
+        try:
+            for node, instance_id, err in pool.imap_unordered(
+                    self._stop_node, nodes):
+                if err is None:
+                    stopped.append(node)
+                    terminated.append(instance_id)
+                    log.debug(
+                        "Removed node `%s` from cluster `%s`",
+                        node.name, self.name)
+                elif isinstance(err, InstanceNotFoundError):
+                    log.info(
+                        "Node `%s` (instance ID `%s`) was not found;"
+                        " assuming it has already been terminated.",
+                        node.name, instance_id)
+                else:
+                    failed += 1
+                    log.error(
+                        "Could not stop node `%s` (instance ID `%s`): %s %s",
+                        node.name, instance_id, err, err.__class__)
+                if time.time() >= next_checkpoint:
+                    self._remove_nodes(stopped)
+                    stopped = []
+                    self._save()
+                    next_checkpoint = time.time() + self.checkpoint_interval
+        finally:
+            self._remove_nodes(stopped)
+            pool.close()
+            pool.join()
+
+        if wait and terminated:
+            self._wait_until_terminated(terminated)
+        return failed
 
-                self.nodes[node.kind].remove(node)
-                log.debug(
-                    "Removed node `%s` from cluster `%s`", node.name, self.name)
-            except InstanceNotFoundError as err:
-                log.info(
-                    "Node `%s` (instance ID `%s`) was not found;"
-                    " assuming it has already been terminated.",
-                    node.name, node.instance_id)
+    @staticmethod
+    def _stop_node(node):
+        """
+        Terminate the VM of the given node.
+
+        Return a triple *(node, instance ID, exception)*; the latter is
+        ``None`` if the request to terminate the VM succeeded.
+        """
+        instance_id = node.instance_id
+        try:
+            node.stop()
+            return (node, instance_id, None)
+        except Exception as err:
+            return (node, instance_id, err)
+
+    def _wait_until_terminated(self, instance_ids):
+        """
+        Poll the cloud provider until all given VMs are no longer running.
+        """
+        log.info("Waiting for %d VMs to terminate ...", len(instance_ids))
+        backoff = Backoff(cap=self.polling_interval)
+        while instance_ids:
+            hint = None
+            try:
+                status = self._cloud_provider.get_instances_status(instance_ids)
             except Exception as err:
-                failed += 1
-                log.error(
-                    "Could not stop node `%s` (instance ID `%s`): %s %s",
-                    node.name, node.instance_id, err, err.__class__)
-        return failed
+                log.debug("Ignoring error while querying"
+                          " the state of VMs: %s", err)
+                hint = get_retry_after(err)
+            else:
+                instance_ids = [
+                    instance_id
+                    for instance_id, (running, _) in zip(instance_ids, status)
+                    if running]
+            if instance_ids:
+                log.debug("%d VMs still running ...", len(instance_ids))
+                backoff.sleep(hint)
 
 
     def get_ssh_to_node(self, ssh_to=None):
@@ -841,7 +1150,7 @@ class Cluster(Struct):
                            " cluster has no nodes!")
 
 
-    def setup(self, extra_args=tuple()):
+    def setup(self, extra_args=tuple(), nodes=None):
         """
         Configure the cluster nodes.
 
@@ -853,19 +1162,42 @@ class Cluster(Struct):
           List of additional command-line arguments
           that are appended to each invocation of the setup program.
 
+        :param list nodes:
+          Only configure these nodes.  By default, all nodes are
+          configured, except those that are still starting after an
+          "early quorum" `start`:meth: (see `setup_late_nodes`:meth:).
+
         :return: bool - True on success, False otherwise
         """
+        pipeline = None
+        if nodes is None and self._startup_pipeline is not None:
+            pipeline = self._startup_pipeline
+            nodes = pipeline.ready_nodes()
+            pipeline.configured.update(nodes)
         try:
             # setup the cluster using the setup provider
-            ret = self._setup_provider.setup_cluster(self, extra_args)
+            if nodes is None:
+                ret = self._setup_provider.setup_cluster(self, extra_args)
+            else:
+                # only pass `nodes` when needed, so that setup
+                # providers predating this argument keep working
+                ret = self._setup_provider.setup_cluster(
+                    self, extra_args, nodes=nodes)
         except Exception as err:
             log.error(
                 "The cluster hosts are up and running,"
                 " but %s failed to set the cluster up: %s",
                 self._setup_provider.HUMAN_READABLE_NAME, err)
             ret = False
-
-        if not ret:
+        if pipeline is not None:
+            pipeline.setup_ok = bool(ret)
+
+        if ret:
+            now = time.time()
+            for node in (self.get_all_nodes() if nodes is None else nodes):
+                node.record_event('configured', now)
+            self._save()
+        else:
             log.warning(
                 "Cluster `%s` not yet configured. Please, re-run "
                 "`elasticluster setup %s` and/or check your configuration",
@@ -873,26 +1205,638 @@ class Cluster(Struct):
 
         return ret
 
+    def setup_late_nodes(self, extra_args=tuple()):
+        """
+        Wait for nodes still starting after an "early quorum" start,
+        then configure them.
+
+        If any node came up after the previous call to `setup`:meth:,
+        the whole cluster is configured again: nodes configured
+        earlier (e.g., the batch system server) need to learn about
+        the late ones, so it is not enough to configure only these.
+        Nothing is done if `start`:meth: was not called with
+        ``early_quorum=True``, or if it had to wait for all nodes anyway.
+
+        :param list extra_args:
+          List of additional command-line arguments
+          that are appended to each invocation of the setup program.
+
+        :return: bool - True if the last configuration of the cluster
+                 succeeded (i.e., the one done by this method, if any
+                 node started late), False otherwise
+        """
+        pipeline = self._startup_pipeline
+        if pipeline is None:
+            return True
+        pipeline.wait()
+        self._startup_pipeline = None
+        self._save()
+
+        late_nodes = [node for node in pipeline.ready_nodes()
+                      if node not in pipeline.configured]
+        if not late_nodes:
+            # `setup` already configured the whole cluster
+            return pipeline.setup_ok is not False
+        log.info("Nodes %s started late: configuring the whole cluster again ...",
+                 ', '.join(sorted(node.name for node in late_nodes)))
+        return self.setup(extra_args)
+
     def update(self):
         """Update all connection information of the nodes of this cluster.
         It occurs for example public ip's are not available imediatly,
         therefore calling this method might help.
+
+        The state of all nodes is fetched from the cloud provider
+        with a single batched query; nodes whose preferred IP address
+        needs to be determined anew are then connected to concurrently,
+        using at most `ssh_probe_max_concurrency` threads.
+        """
+        nodes = self.get_all_nodes()
+        try:
+            self._update_nodes_status(nodes)
+        except Exception as ex:
+            log.warning("Ignoring error updating information on nodes"
+                        " of cluster %s: %s", self.name, ex)
+        # If we previously did not have a preferred_ip or the
+        # preferred_ip is not in the current list, then try to connect
+        # to one of the node ips and update the preferred_ip.
+        stale_nodes = [
+            node for node in nodes
+            if node.ips and not (node.preferred_ip
+                                 and node.preferred_ip in node.ips)
+        ]
+        if stale_nodes:
+            pool = Pool(processes=min(len(stale_nodes),
+                                      self.ssh_probe_max_concurrency))
+            try:
+                pool.map(self._connect_node, stale_nodes)
+            finally:
+                pool.close()
+                pool.join()
+        self._save()
+
+    @staticmethod
+    def _connect_node(node):
+        """
+        Connect to `node` via SSH, updating its preferred IP address.
+        """
+        ssh = node.connect()
+        if ssh:
+            ssh.close()
+
+
+class NodeStartupPipeline(object):
+    """
+    Start cluster nodes and bring each one to a usable state.
+
+    Each node goes through the following stages:
+
+    1. a request to start the VM is sent to the cloud provider
+       (nodes of the same kind are started with a single request,
+       if the cloud provider supports it);
+    2. the cloud provider is polled until it reports the VM as running
+       (nodes in this stage are all polled with a single request);
+    3. an SSH connection to the node is attempted, until it succeeds;
+    4. the setup provider performs the "bootstrap" step on the node
+       (see `AbstractSetupProvider.bootstrap_nodes`:meth:).
+
+    Each node moves on to the next stage as soon as it is done with the
+    previous one, regardless of the state of other nodes; thus the
+    total time taken is that of the slowest node, instead of the sum
+    of the slowest times in each stage.  Stages 1, 3, and 4 run on
+    separate pools of worker threads, of configurable size; nodes
+    waiting for a free bootstrap worker are batched together.
+
+    Boot times (from the start request returning to the node being
+    reachable via SSH) are recorded in `boot_times`.  If
+    `straggler_factor` is positive, nodes that take longer than that
+    many times the median boot time are terminated and started anew
+    (at most once per node), keeping their name and kind.  If
+    `targets` is given, nodes of each kind listed in it are
+    terminated and removed from the cluster as soon as the target
+    number of nodes of that kind is reachable.
+
+    :param cluster: cluster the nodes belong to
+    :type cluster: :py:class:`Cluster`
+    :param int max_concurrent_requests: size of the thread pool
+      issuing start requests to the cloud provider
+    :param int max_concurrent_probes: size of the thread pool
+      probing nodes via SSH
+    :param int max_concurrent_bootstraps: maximum number of
+      concurrent bootstrap runs; if ``0``, skip the bootstrap stage
+    :param float straggler_factor: replace nodes that take longer than
+      this many times the median boot time; ``0`` disables replacement
+    :param dict targets: map node kind to number of nodes needed
+    """
+
+    straggler_min_samples = 3  #: boot times needed to detect stragglers
+
+    def __init__(self, cluster, max_concurrent_requests=1,
+                 max_concurrent_probes=1, max_concurrent_bootstraps=1,
+                 straggler_factor=0, targets=None):
+        self.cluster = cluster
+        self.max_concurrent_requests = max(1, max_concurrent_requests)
+        self.max_concurrent_probes = max(1, max_concurrent_probes)
+        self.max_concurrent_bootstraps = max_concurrent_bootstraps
+
+        # worker threads report back through this queue
+        self._events = Queue.Queue()
+
+        # per-stage book-keeping
+        self._starting = set()
+        self._booting = set()
+        self._probing = set()
+        self._probe_retry = {}  # node -> time of next SSH probe
+        self._probe_backoff = {}  # node -> `Backoff` for SSH probes
+        self._bootstrap_queue = []
+        self._bootstrapping = 0
+        self.ready = set()
+        self.failed = set()
+
+        # nodes that have already been configured by `Cluster.setup`,
+        # and outcome of the last such configuration (``None`` if
+        # `Cluster.setup` has not been called yet)
+        self.configured = set()
+        self.setup_ok = None
+
+        # straggler replacement and over-provisioning
+        self.straggler_factor = straggler_factor
+        self.targets = targets or {}
+        self.boot_times = {}  # node -> seconds to become reachable
+        self._started_at = {}
+        self._replaced = set()
+        self._reachable = defaultdict(set)  # kind -> reachable nodes
+        self._releasing = set()
+        self.released = set()
+
+        self._known_hosts_path = None
+        self._keys = None
+        self._keys_lock = threading.Lock()
+
+        # worker pools, created by `run`
+        self._start_pool = None
+        self._probe_pool = None
+        self._bootstrap_pool = None
+
+        # protects `ready` and `done`, and signals changes to them
+        self._cond = threading.Condition()
+        self._abort = False
+        self._thread = None
+        # exception raised by `run` in the background thread
+        self._error = None
+        self.done = False
+        self.not_ready = set()
+
+    def run(self, nodes, lapse):
+        """
+        Drive `nodes` through all the stages, for max `lapse` seconds.
+
+        Return set of nodes that did not complete all the stages.
+        """
+        nodes = set(nodes)
+        if not nodes:
+            self._finish(nodes)
+            return nodes
+
+        cluster = self.cluster
+        try:
+            self._known_hosts_path, self._keys = cluster._load_known_hosts()
+
+            self._start_pool = Pool(
+                processes=min(len(nodes), self.max_concurrent_requests))
+            self._probe_pool = Pool(
+                processes=min(len(nodes), self.max_concurrent_probes))
+            if self.max_concurrent_bootstraps > 0:
+                self._bootstrap_pool = Pool(
+                    processes=self.max_concurrent_bootstraps)
+            log.debug(
+                "Note: starting up to %d nodes concurrently,"
+                " probing up to %d nodes concurrently via SSH.",
+                min(len(nodes), self.max_concurrent_requests),
+                min(len(nodes), self.max_concurrent_probes))
+
+            for batch in self._make_start_batches(nodes):
+                self._starting.update(batch)
+                if len(batch) == 1:
+                    self._submit(self._start_pool, 'start',
+                                 cluster._start_node, batch[0])
+                else:
+                    self._submit(self._start_pool, 'start_batch',
+                                 cluster._start_nodes, batch)
+
+            interrupted = False
+            try:
+                self._loop(lapse)
+            except KeyboardInterrupt:
+                interrupted = True
+            if interrupted or self._abort:
+                log.error(
+                    "Interrupted: will save cluster state and exit"
+                    " after all start requests have returned.")
+                self._shutdown()
+                cluster._save()
+                if interrupted:
+                    raise KeyboardInterrupt()
+                return nodes - self.ready - self.released
+
+            self._shutdown()
+            not_ready = nodes - self.ready - self.released
+            if not_ready:
+                log.error(
+                    "Some nodes of the cluster did not start correctly"
+                    " within the given %d-seconds timeout: %s",
+                    lapse, ', '.join(sorted(node.name for node in not_ready)))
+            return not_ready
+        finally:
+            # make sure worker threads are stopped and waiting
+            # threads are woken up, whatever happened
+            self._shutdown()
+            self._finish(nodes - self.ready - self.released)
+
+    def _loop(self, lapse):
+        """
+        Handle events and move nodes through the stages until all
+        nodes are done, `lapse` seconds have passed, or the pipeline
+        is aborted.
+        """
+        cluster = self.cluster
+        deadline = time.time() + lapse
+        next_poll = time.time()
+        poll_backoff = Backoff(cap=cluster.polling_interval)
+        while self._in_progress() and not self._abort:
+            now = time.time()
+            if now >= deadline:
+                break
+            if self._booting and now >= next_poll:
+                hint = self._poll_booting_nodes()
+                next_poll = now + poll_backoff.next_delay(hint)
+            if self.straggler_factor > 0:
+                self._replace_stragglers(now)
+            self._schedule_probes(now)
+            self._schedule_bootstraps()
+
+            # wait for some worker to report back, or until
+            # it's time for the next poll
+            wakeup = min([deadline, next_poll] + self._probe_retry.values())
+            changed = self._process_events(
+                timeout=min(1, max(0, wakeup - time.time())))
+            if changed:
+                # checkpoint cluster state
+                cluster._save()
+
+    def run_in_background(self, nodes, lapse):
+        """
+        Like `run`:meth:, but in a separate thread.
+
+        Use `wait`:meth: to wait for (part of) the nodes to be ready;
+        errors raised by `run`:meth: are raised again there.
+        """
+        self._thread = threading.Thread(
+            target=self._run_in_thread, args=(nodes, lapse),
+            name='NodeStartupPipeline')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_in_thread(self, nodes, lapse):
+        try:
+            self.run(nodes, lapse)
+        except Exception as err:
+            log.debug("Error starting cluster nodes: %s", err, exc_info=True)
+            # raised again by `wait`, which joins this thread first
+            self._error = err
+
+    def wait(self, until=None):
+        """
+        Wait until all nodes are done, or `until(ready_nodes)` is true.
+
+        Return ``True`` if `until` was satisfied (or if it's
+        ``None``), ``False`` if all nodes were done without satisfying
+        it.  If the pipeline stopped because of an error, raise it.
+
+        If interrupted by Ctrl+C, stop the pipeline, wait for its
+        thread to save the cluster state, then re-raise the exception.
+        """
+        try:
+            with self._cond:
+                while not self.done:
+                    if until is not None and until(self.ready):
+                        return True
+                    self._cond.wait(1)
+            if self._thread is not None:
+                # ensure `_error` is set if `run` failed
+                self._thread.join()
+            if self._error is not None:
+                raise self._error
+            return (until is None or until(self.ready))
+        except KeyboardInterrupt:
+            self._abort = True
+            if self._thread is not None:
+                self._thread.join()
+            raise
+
+    def ready_nodes(self):
+        """
+        Return set of nodes that have completed all the stages so far.
+        """
+        with self._cond:
+            return set(self.ready)
+
+    def _finish(self, not_ready):
+        with self._cond:
+            self.not_ready = not_ready
+            self.done = True
+            self._cond.notify_all()
+
+    def _in_progress(self):
+        return (self._starting or self._booting or self._probing
+                or self._probe_retry or self._bootstrap_queue
+                or self._bootstrapping or self._releasing)
+
+    def _submit(self, pool, stage, func, arg):
+        """
+        Run `func(arg)` on `pool` and report the outcome as an event.
         """
-        for node in self.get_all_nodes():
+        def work():
             try:
-                node.update_ips()
+                ok = func(arg)
+            except Exception as err:
+                log.debug("Error in stage `%s`: %s", stage, err)
+                ok = False
+            self._events.put((stage, arg, ok))
+        pool.apply_async(work)
+
+    def _make_start_batches(self, nodes):
+        """
+        Group `nodes` into batches that can be started with one request.
 
-                # If we previously did not have a preferred_ip or the
-                # preferred_ip is not in the current list, then try to connect
-                # to one of the node ips and update the preferred_ip.
-                if node.ips and \
-                        not (node.preferred_ip and \
-                                         node.preferred_ip in node.ips):
-                    node.connect()
-            except InstanceError as ex:
-                log.warning("Ignoring error updating information on node %s: %s",
-                            node, ex)
-        self.repository.save_or_update(self)
+        Nodes of the same kind and with the same start parameters are
+        grouped together, up to the cloud provider's
+        `max_instances_per_request` nodes per batch.  Nodes that
+        have an instance ID already are in batches of their own.
+        """
+        try:
+            batch_size = int(
+                self.cluster._cloud_provider.max_instances_per_request)
+        except (AttributeError, TypeError, ValueError):
+            batch_size = 1
+        batches = []
+        groups = defaultdict(list)  # kind -> list of (params, nodes)
+        for node in sorted(nodes, key=(lambda node: node.name)):
+            if batch_size <= 1 or node.instance_id:
+                batches.append([node])
+                continue
+            params = node.start_params()
+            for group_params, group in groups[node.kind]:
+                if group_params == params and len(group) < batch_size:
+                    group.append(node)
+                    break
+            else:
+                group = [node]
+                groups[node.kind].append((params, group))
+                batches.append(group)
+        return batches
+
+    def _started(self, node, now):
+        self._started_at[node] = now
+        if self._is_surplus(node):
+            self._release(node)
+        else:
+            self._booting.add(node)
+
+    def _poll_booting_nodes(self):
+        """
+        Move nodes that are running to the SSH probe stage.
+
+        If the cloud provider cannot be queried, return the delay
+        it suggests before trying again (if any).
+        """
+        try:
+            running_nodes = self.cluster._update_nodes_status(self._booting)
+        except Exception as err:
+            log.debug("Ignoring error while querying"
+                      " the state of cluster nodes: %s", err)
+            return get_retry_after(err)
+        for node in running_nodes:
+            self._booting.discard(node)
+            self._probing.add(node)
+            self._submit(self._probe_pool, 'probe', self._probe, node)
+        if self._booting:
+            log.debug("Waiting for %d more nodes to come up ...",
+                      len(self._booting))
+
+    def _probe(self, node):
+        return self.cluster._probe_node(
+            node, self._keys, self._keys_lock,
+            self._known_hosts_path, self.cluster.ssh_probe_timeout)
+
+    def _schedule_probes(self, now):
+        for node, when in self._probe_retry.items():
+            if when <= now:
+                del self._probe_retry[node]
+                self._probing.add(node)
+                self._submit(self._probe_pool, 'probe', self._probe, node)
+
+    def _replace_node(self, node):
+        node.stop()
+        node.ips = []
+        node.preferred_ip = None
+        return self.cluster._start_node(node)
+
+    def _replace_stragglers(self, now):
+        """
+        Start a new VM for nodes that are much slower than the others.
+        """
+        if len(self.boot_times) < self.straggler_min_samples:
+            return
+        times = self.boot_times.values()
+        median = percentile(times, 50)
+        for node in list(self._booting) + list(self._probe_retry):
+            if node in self._replaced:
+                continue
+            elapsed = now - self._started_at[node]
+            if elapsed <= self.straggler_factor * median:
+                continue
+            log.warning(
+                "Node `%s` is not reachable after %.0f seconds, more than"
+                " %g times the median boot time of %.0f seconds"
+                " (90th percentile: %.0f seconds): replacing it ...",
+                node.name, elapsed, self.straggler_factor,
+                median, percentile(times, 90))
+            self._booting.discard(node)
+            self._probe_retry.pop(node, None)
+            self._probe_backoff.pop(node, None)
+            self._replaced.add(node)
+            self._starting.add(node)
+            self._submit(self._start_pool, 'replace',
+                         self._replace_node, node)
+
+    def _is_surplus(self, node):
+        kind = node.kind
+        return (kind in self.targets
+                and node not in self._reachable[kind]
+                and len(self._reachable[kind]) >= self.targets[kind])
+
+    def _release(self, node):
+        """
+        Terminate a node that is no longer needed.
+        """
+        self._booting.discard(node)
+        self._probe_retry.pop(node, None)
+        self._releasing.add(node)
+        self._submit(self._start_pool, 'release', self._stop_node, node)
+
+    def _remove_failed(self, node):
+        """
+        Remove a node that could not be started and is no longer needed.
+
+        No VM was started for the node, so there is nothing to terminate.
+        """
+        log.info("Node `%s` could not be started but is not needed any more:"
+                 " removing it from the cluster.", node.name)
+        self.failed.discard(node)
+        self._forget(node)
+
+    def _forget(self, node):
+        """
+        Remove `node` from the cluster and mark it as released.
+        """
+        with self.cluster._lock:
+            self.cluster._remove_nodes([node])
+            self.cluster._naming_policy.free(node.kind, node.name)
+        self.released.add(node)
+
+    @staticmethod
+    def _stop_node(node):
+        node.stop()
+        return True
+
+    def _bootstrap(self, nodes):
+        return self.cluster._setup_provider.bootstrap_nodes(self.cluster, nodes)
+
+    def _schedule_bootstraps(self):
+        if (self._bootstrap_queue
+                and self._bootstrapping < self.max_concurrent_bootstraps):
+            batch = self._bootstrap_queue
+            self._bootstrap_queue = []
+            self._bootstrapping += 1
+            log.debug("Bootstrapping nodes %s ...",
+                      ', '.join(node.name for node in batch))
+            self._submit(self._bootstrap_pool, 'bootstrap',
+                         self._bootstrap, batch)
+
+    def _process_events(self, timeout):
+        """
+        Handle all outcomes reported by workers.
+
+        Wait at most `timeout` seconds for the first one to arrive.
+        Return ``True`` if any node changed state.
+        """
+        try:
+            events = [self._events.get(timeout=timeout)]
+        except Queue.Empty:
+            return False
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except Queue.Empty:
+                break
+
+        now = time.time()
+        for stage, arg, ok in events:
+            if stage in ('start', 'replace'):
+                node = arg
+                self._starting.discard(node)
+                if ok or (stage == 'replace' and node.instance_id):
+                    # if terminating a straggler failed, keep waiting for it
+                    self._started(node, now)
+                else:
+                    self.failed.add(node)
+                    if self._is_surplus(node):
+                        self._remove_failed(node)
+            elif stage == 'start_batch':
+                for node in arg:
+                    if node.instance_id:
+                        self._starting.discard(node)
+                        self._started(node, now)
+                    else:
+                        # try again with a request for this node only
+                        self._submit(self._start_pool, 'start',
+                                     self.cluster._start_node, node)
+            elif stage == 'probe':
+                node = arg
+                self._probing.discard(node)
+                if self._is_surplus(node):
+                    self._release(node)
+                elif ok:
+                    if node in self._started_at:
+                        self.boot_times[node] = now - self._started_at[node]
+                    with self._keys_lock:
+                        self.cluster._save_keys_to_known_hosts_file(self._keys)
+                    if self._bootstrap_pool:
+                        self._bootstrap_queue.append(node)
+                    else:
+                        self._mark_ready([node])
+                    kind = node.kind
+                    self._reachable[kind].add(node)
+                    if (kind in self.targets
+                            and len(self._reachable[kind]) >= self.targets[kind]):
+                        for other in (list(self._booting)
+                                      + list(self._probe_retry)):
+                            if other.kind == kind:
+                                self._release(other)
+                        for other in list(self.failed):
+                            if other.kind == kind:
+                                self._remove_failed(other)
+                else:
+                    if node not in self._probe_backoff:
+                        self._probe_backoff[node] = Backoff(
+                            cap=self.cluster.polling_interval)
+                    self._probe_retry[node] = (
+                        now + self._probe_backoff[node].next_delay())
+            elif stage == 'release':
+                node = arg
+                self._releasing.discard(node)
+                if ok:
+                    log.info("Node `%s` is not needed any more:"
+                             " removing it from the cluster.", node.name)
+                    self._forget(node)
+                else:
+                    log.warning("Could not terminate spare node `%s`.",
+                                node.name)
+            elif stage == 'bootstrap':
+                nodes = arg
+                self._bootstrapping -= 1
+                if ok:
+                    for node in nodes:
+                        node.record_event('bootstrapped', now)
+                else:
+                    # not fatal: the setup step will try again
+                    log.warning(
+                        "Could not bootstrap nodes %s;"
+                        " continuing anyway.",
+                        ', '.join(node.name for node in nodes))
+                self._mark_ready(nodes)
+        return True
+
+    def _mark_ready(self, nodes):
+        with self._cond:
+            self.ready.update(nodes)
+            self._cond.notify_all()
+
+    def _shutdown(self):
+        # wait for pending start requests to return, so that their
+        # instance IDs are recorded and can be saved
+        if self._start_pool is not None:
+            self._start_pool.close()
+            self._start_pool.join()
+            self._start_pool = None
+        # do not wait for SSH probes or bootstrap runs
+        if self._probe_pool is not None:
+            self._probe_pool.terminate()
+            self._probe_pool = None
+        if self._bootstrap_pool is not None:
+            self._bootstrap_pool.terminate()
+            self._bootstrap_pool = None
 
 
 class NodeNamingPolicy(object):
@@ -1074,7 +2018,7 @@ class NodeNamingPolicy(object):
             pass
 
 
-class Node(Struct):
+class Node(object):
     """The node represents an instance in a cluster. It holds all
     information to connect to the nodes also manages the cloud instance. It
     provides the basic functionality to interact with the cloud instance,
@@ -1111,8 +2055,57 @@ class Node(Struct):
     :ivar preferred_ip: IP address used to connect to the node.
 
     :ivar ips: list of all the IPs defined for this node.
+
+    :ivar timeline: dict mapping each lifecycle event in
+                    `TIMELINE_EVENTS` to the time (in seconds since the
+                    epoch) it happened; see `record_event`:meth:.
+
+    :ivar extra: dict holding any other (cloud-specific) parameter
+                 passed to the constructor.
+
+    Clusters can have many thousands of nodes, so the attributes
+    listed in `ATTRIBUTES` are stored in ``__slots__``; other
+    parameters go into `extra`.  Like `Struct` objects, nodes can be
+    used as dictionaries, whose keys are the names in `ATTRIBUTES`.
+
+    Setting any of these attributes gives the node a new `_revision`
+    number, which repositories use to save only the nodes that
+    changed; therefore, attributes holding lists or dictionaries
+    must be replaced, not modified in place.
     """
 
+    #: names of the attributes saved with a node (and the keys of
+    #: the node when seen as a dictionary)
+    ATTRIBUTES = (
+        'cluster_name',
+        'extra',
+        'flavor',
+        'image_id',
+        'image_user',
+        'image_userdata',
+        'instance_id',
+        'ips',
+        'kind',
+        'name',
+        'preferred_ip',
+        'security_group',
+        'ssh_proxy_command',
+        'timeline',
+        'user_key_name',
+        'user_key_private',
+        'user_key_public',
+    )
+
+    # any other attribute set on a node (e.g., by test code) goes into
+    # `__dict__`, which Python only allocates on first use
+    __slots__ = ATTRIBUTES + ('_cloud_provider', '_revision', '__dict__')
+
+    _KEYS = frozenset(ATTRIBUTES)
+
+    # source of `_revision` numbers, shared by all nodes so that two
+    # node objects never have the same revision
+    _revisions = itertools.count(1)
+
     def __init__(self, name, cluster_name, kind, cloud_provider, user_key_public,
                  user_key_private, user_key_name, image_user, security_group,
                  image_id, flavor, image_userdata=None, ssh_proxy_command='',
@@ -1133,6 +2126,7 @@ class Node(Struct):
         self.instance_id = extra.pop('instance_id', None)
         self.preferred_ip = extra.pop('preferred_ip', None)
         self.ips = extra.pop('ips', [])
+        self.timeline = extra.pop('timeline', None) or {}
         # Remove extra arguments, if defined
         for key in extra.keys():
             if hasattr(self, key):
@@ -1141,10 +2135,114 @@ class Node(Struct):
         self.extra.update(extra.pop('extra', {}))
         self.extra.update(extra)
 
+    def __getstate__(self):
+        return dict(self)
+
     def __setstate__(self, state):
-        self.__dict__.update(state)
+        # states saved by older versions of ElastiCluster may lack
+        # some attributes, or have a few more
+        state = dict(state)
         if 'image_id' not in state and 'image' in state:
             state['image_id'] = state['image']
+        if 'ips' not in state and 'ip_public' in state:
+            state['ips'] = [state['ip_public'], state.get('ip_private')]
+        for attr in self.ATTRIBUTES:
+            setattr(self, attr, state.get(attr))
+        self._cloud_provider = state.get('_cloud_provider')
+        if self.extra is None:
+            self.extra = {}
+        if self.ips is None:
+            self.ips = []
+        if self.timeline is None:
+            self.timeline = {}
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._KEYS:
+            # let repositories know this node must be saved again
+            object.__setattr__(self, '_revision', next(self._revisions))
+
+    # dictionary-like interface
+
+    def keys(self):
+        """Only expose some of the attributes when using as a dictionary"""
+        return list(self.ATTRIBUTES)
+
+    def __iter__(self):
+        return iter(self.ATTRIBUTES)
+
+    def __len__(self):
+        return len(self.ATTRIBUTES)
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def __getitem__(self, key):
+        if key not in self._KEYS and key != '_cloud_provider':
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._KEYS and key != '_cloud_provider':
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key in self._KEYS:
+            return getattr(self, key)
+        return default
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.ATTRIBUTES]
+
+    def iteritems(self):
+        for key in self.ATTRIBUTES:
+            yield (key, getattr(self, key))
+
+    def update(self, other):
+        """Set attributes from the (key, value) pairs in dictionary `other`."""
+        for key, value in other.items():
+            self[key] = value
+
+    # nodes compare like dictionaries, as `Struct` objects do
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return NotImplemented
+        return self is other or self.items() == other.items()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = object.__hash__
+
+    #: lifecycle events recorded in `timeline`, in the order they happen
+    TIMELINE_EVENTS = (
+        'start_requested',  # request to start the VM about to be sent
+        'started',          # cloud provider returned the VM instance ID
+        'running',          # cloud provider first reported the VM running
+        'reachable',        # first successful SSH connection
+        'bootstrapped',     # setup provider bootstrap step done
+        'configured',       # setup provider configured the node
+    )
+
+    def record_event(self, event, when=None):
+        """
+        Record the time (default: now) of lifecycle `event` in `timeline`.
+
+        Only the first occurrence of each event is recorded; the
+        timeline is reset whenever a new VM is started for this node.
+
+        Events are recorded by several threads while the cluster is
+        being saved, so `timeline` is replaced by an updated copy
+        instead of being modified in place.
+        """
+        if event not in self.timeline:
+            timeline = dict(self.timeline)
+            timeline[event] = (time.time() if when is None else when)
+            self.timeline = timeline
 
     def start(self):
         """
@@ -1166,6 +2264,27 @@ class Node(Struct):
             **self.extra)
         log.debug("Node `%s` has instance ID `%s`", self.name, self.instance_id)
 
+    def start_params(self):
+        """
+        Return the parameters used to start this node's VM.
+
+        The returned dictionary maps the keyword arguments of the
+        cloud provider's `start_instance` method (except
+        ``node_name``) to their values for this node.
+        """
+        params = dict(self.extra)
+        params.update(
+            key_name=self.user_key_name,
+            public_key_path=self.user_key_public,
+            private_key_path=self.user_key_private,
+            security_group=self.security_group,
+            flavor=self.flavor,
+            image_id=self.image_id,
+            image_userdata=self.image_userdata,
+            username=self.image_user,
+        )
+        return params
+
     def stop(self, wait=False):
         """
         Terminate the VM instance launched on the cloud for this specific node.
@@ -1176,8 +2295,7 @@ class Node(Struct):
 
             self._cloud_provider.stop_instance(self.instance_id)
             if wait:
-                while self.is_alive():
-                    time.sleep(1)
+                wait_until(lambda: not self.is_alive(), cap=10)
             # When an instance is terminated, the EC2 cloud provider will
             # basically return it as "running" state. Setting the
             # `instance_id` attribute to None will force `is_alive()`
@@ -1205,6 +2323,7 @@ class Node(Struct):
         if running:
             log.debug("node `%s` (instance id %s) is up.",
                       self.name, self.instance_id)
+            self.record_event('running')
             self.update_ips()
         else:
             log.debug("node `%s` (instance id `%s`) still building...",
@@ -1278,6 +2397,7 @@ class Node(Struct):
                 if ip != self.preferred_ip:
                     self.preferred_ip = ip
                 # Connection successful.
+                self.record_event('reachable')
                 return ssh
             except socket.error as ex:
                 log.debug(
@@ -1364,9 +2484,3 @@ IPs:    %s
 instance id:   %s
 instance flavor: %s""" % (self.name, self.preferred_ip, ips,
                           self.instance_id, self.flavor)
-
-    def keys(self):
-        """Only expose some of the attributes when using as a dictionary"""
-        keys = Struct.keys(self)
-        keys.remove('_cloud_provider')
-        return keys
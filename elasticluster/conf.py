@@ -37,6 +37,7 @@ from __future__ import (print_function, division, absolute_import)
 # stdlib imports
 from collections import defaultdict
 from ConfigParser import SafeConfigParser
+import hashlib
 import os
 from os.path import expanduser, expandvars
 import re
@@ -52,10 +53,11 @@ from schema import Schema, SchemaError, Optional, Or, Regex, Use
 # ElastiCluster imports
 from elasticluster import log
 from elasticluster.exceptions import ConfigurationError
+from elasticluster.providers import instrument_calls, limit_api_calls
 from elasticluster.providers.ansible_provider import AnsibleSetupProvider
 from elasticluster.cluster import Cluster, NodeNamingPolicy
 from elasticluster.repository import MultiDiskRepository
-from elasticluster.utils import environment
+from elasticluster.utils import DiskCache, environment
 from elasticluster.validate import (
     alert,
     boolean,
@@ -63,6 +65,7 @@ from elasticluster.validate import (
     existing_file,
     hostname,
     nonempty_str,
+    nonnegative_float,
     nonnegative_int,
     nova_api_version,
     positive_int,
@@ -93,7 +96,8 @@ KEY_RENAMES = [
 
 SCHEMA = {
     'cloud': {
-        'provider': Or('azure', 'ec2_boto', 'google', 'openstack', 'libcloud'),
+        'provider': Or('azure', 'ec2_boto', 'google', 'openstack', 'libcloud',
+                       'simulated'),
         # allow other keys w/out restrictions; each cloud provider has its own
         # set of keys, which are handled separately
         str: str,
@@ -122,9 +126,13 @@ SCHEMA = {
                 Optional(str): str,
             },
         },
+        Optional("bootstrap_max_concurrency", default=2): nonnegative_int,
+        Optional("overprovision", default=0): nonnegative_int,
+        Optional("ssh_probe_max_concurrency", default=20): positive_int,
         Optional("ssh_probe_timeout", default=5): positive_int,
         Optional("ssh_proxy_command", default=''): str,
         Optional("start_timeout", default=600): positive_int,
+        Optional("straggler_factor", default=0): nonnegative_float,
         # only on Google Cloud
         Optional("accelerator_count", default=0): nonnegative_int,
         Optional("accelerator_type"): nonempty_str,
@@ -156,7 +164,8 @@ SCHEMA = {
     },
     'storage': {
         Optional('storage_path', default=os.path.expanduser("~/.elasticluster/storage")): str,
-        Optional('storage_type'): ['yaml', 'json', 'pickle'],
+        Optional('storage_type'): Or('yaml', 'json', 'pickle', 'sqlite'),
+        Optional('storage_journal', default=False): boolean,
     },
 }
 
@@ -226,8 +235,42 @@ CLOUD_PROVIDER_SCHEMAS = {
         "provider": 'libcloud',
         'driver_name': nonempty_str,
         Optional(str): str,
-    }
+    },
+
+    'simulated': {
+        "provider": 'simulated',
+        Optional("api_latency", default='0'): nonempty_str,
+        Optional("boot_time", default='uniform:20,60'): nonempty_str,
+        Optional("ssh_delay", default='0'): nonempty_str,
+        Optional("stop_time", default='0'): nonempty_str,
+        Optional("failure_rate", default=0): nonnegative_float,
+        Optional("boot_failure_rate", default=0): nonnegative_float,
+        Optional("quota", default=0): nonnegative_int,
+        Optional("throttle_rate", default=0): nonnegative_float,
+        Optional("throttle_burst", default=10): positive_int,
+        Optional("max_instances_per_request", default=1): positive_int,
+        Optional("ssh_address"): nonempty_str,
+        Optional("seed"): nonnegative_int,
+    },
+}
+
+
+# rate limiting of cloud API calls, common to all cloud providers
+# (see `elasticluster.providers.limit_api_calls`)
+CLOUD_API_LIMITS_SCHEMA = {
+    Optional("api_rate_limit", default=10): nonnegative_float,
+    Optional("api_burst", default=20): positive_int,
+    Optional("api_max_retries", default=5): nonnegative_int,
+}
+# persistent caching of cloud metadata, common to all cloud providers
+# (see `elasticluster.providers.AbstractCloudProvider._get_metadata`)
+CLOUD_METADATA_CACHE_SCHEMA = {
+    Optional("metadata_cache_ttl", default=3600): nonnegative_int,
 }
+for _schema in CLOUD_PROVIDER_SCHEMAS.itervalues():
+    _schema.update(CLOUD_API_LIMITS_SCHEMA)
+    _schema.update(CLOUD_METADATA_CACHE_SCHEMA)
+del _schema
 
 
 CLOUD_PROVIDERS = {
@@ -237,6 +280,7 @@ CLOUD_PROVIDERS = {
     'google':    ('elasticluster.providers.gce',            'GoogleCloudProvider'),
     'azure':     ('elasticluster.providers.azure_provider', 'AzureCloudProvider'),
     'libcloud': ('elasticluster.providers.libcloud_provider', 'LibCloudProvider'),
+    'simulated': ('elasticluster.providers.simulated',      'SimulatedCloudProvider'),
 }
 
 
@@ -313,8 +357,11 @@ def make_creator(configfiles, storage_path=None):
         raise ValueError('Empty list of config files')
 
     config = load_config_files(configfiles)
+    storage = config.get('storage', {})
 
-    return Creator(config, storage_path=storage_path)
+    return Creator(config, storage_path=storage_path,
+                   storage_type=storage.get('storage_type'),
+                   storage_journal=storage.get('storage_journal'))
 
 
 def _expand_config_file_list(paths, ignore_nonexistent=True,
@@ -728,6 +775,13 @@ def _validate_and_convert(cfgtree, evict_on_error=True):
         if section not in cfgtree:
             continue
         stanzas = cfgtree[section]
+        if section == 'storage':
+            # there is only one, unnamed, `[storage]` section
+            try:
+                objtree[section] = Schema(model).validate(stanzas)
+            except SchemaError as err:
+                log.error("In section `%s`: %s", section, err)
+            continue
         objtree[section] = {}
         for name, properties in stanzas.iteritems():
             log.debug("Checking section `%s/%s` ...", section, name)
@@ -864,14 +918,21 @@ class Creator(object):
 
     :param dict cluster_conf: see description above
     :param str storage_path: path to store data
+    :param bool storage_journal: save changes to clusters incrementally
+      to a journal file (see `repository.DiskRepository`:class:)
 
     :raises MultipleInvalid: configuration validation
     """
 
     DEFAULT_STORAGE_PATH = os.path.expanduser("~/.elasticluster/storage")
     DEFAULT_STORAGE_TYPE = 'yaml'
+    DEFAULT_STORAGE_JOURNAL = False
 
-    def __init__(self, conf, storage_path=None, storage_type=None):
+    # subdirectory of the storage path holding cloud metadata caches
+    METADATA_CACHE_DIR = 'cache'
+
+    def __init__(self, conf, storage_path=None, storage_type=None,
+                 storage_journal=None):
         self.cluster_conf = conf['cluster']
 
         self.storage_path = (
@@ -879,6 +940,9 @@ class Creator(object):
             else self.DEFAULT_STORAGE_PATH)
 
         self.storage_type = storage_type or self.DEFAULT_STORAGE_TYPE
+        self.storage_journal = (self.DEFAULT_STORAGE_JOURNAL
+                                if storage_journal is None
+                                else storage_journal)
 
 
     def load_cluster(self, cluster_name):
@@ -926,12 +990,24 @@ class Creator(object):
 
         provider_conf = cloud_conf.copy()
         provider_conf.pop('provider')
+        api_limits = dict(
+            (key, provider_conf.pop(key))
+            for key in ('api_rate_limit', 'api_burst', 'api_max_retries')
+            if key in provider_conf)
+        metadata_cache_ttl = provider_conf.pop('metadata_cache_ttl', 0)
 
         # use a single keyword args dictionary for instanciating
         # provider, so we can detect missing arguments in case of error
         provider_conf['storage_path'] = self.storage_path
         try:
-            return ctor(**provider_conf)
+            cloud_provider = ctor(**provider_conf)
+            if metadata_cache_ttl > 0:
+                cloud_provider.metadata_cache = DiskCache(
+                    self._metadata_cache_path(cloud_conf), metadata_cache_ttl)
+            # instrument first, so that the time spent waiting for
+            # the rate limiter is not counted as latency of the call
+            return limit_api_calls(
+                instrument_calls(cloud_provider, provider), **api_limits)
         except TypeError:
             # check that required parameters are given, and try to
             # give a sensible error message if not; if we do not
@@ -959,6 +1035,18 @@ class Creator(object):
 
 
 
+    def _metadata_cache_path(self, cloud_conf):
+        """
+        Return path to the cloud metadata cache file for `cloud_conf`.
+
+        Cloud sections that differ in any key (e.g., credentials
+        or region) get different cache files.
+        """
+        digest = hashlib.sha1(repr(sorted(cloud_conf.items()))).hexdigest()
+        return os.path.join(
+            self.storage_path, self.METADATA_CACHE_DIR,
+            '{0}-{1}.json'.format(cloud_conf['provider'], digest))
+
     def create_cluster(self, template, name=None, cloud=None, setup=None):
         """
         Creates a ``Cluster``:class: instance by inspecting the configuration
@@ -1108,4 +1196,5 @@ class Creator(object):
 
     def create_repository(self):
         return MultiDiskRepository(self.storage_path,
-                                   self.storage_type)
+                                   self.storage_type,
+                                   journal=self.storage_journal)
@@ -19,6 +19,13 @@ __author__ = 'Nicolas Baer <nicolas.baer@uzh.ch>'
 
 # stdlib imports
 from abc import ABCMeta, abstractmethod
+import inspect
+import threading
+import time
+
+# ElastiCluster imports
+from elasticluster import log
+from elasticluster.utils import Backoff, Histogram, TokenBucket, get_retry_after
 
 
 class AbstractCloudProvider:
@@ -60,6 +67,50 @@ class AbstractCloudProvider:
         """
         pass
 
+    #: max number of VMs that `start_instances`:meth: can start with a
+    #: single request to the cloud API
+    max_instances_per_request = 1
+
+    def start_instances(self, count, key_name, public_key_path,
+                        private_key_path, security_group, flavor, image_id,
+                        image_userdata, username=None, node_names=None,
+                        **kwargs):
+        """
+        Start `count` identical instances on the cloud.
+
+        Cloud providers whose API can create many instances with a
+        single request should override this method, and set the
+        `max_instances_per_request` class attribute accordingly; the
+        default implementation just calls `start_instance`:meth: once
+        for each instance.
+
+        Parameters are the same as for `start_instance`:meth:, except
+        that a list of `count` node names is given in `node_names`.
+
+        Not all instances might be started, e.g., if the cloud quota is
+        exhausted midway; errors are only raised if no instance could
+        be started at all.
+
+        :return: list of `count` items; the *i*-th one is the instance
+                 ID of the VM named ``node_names[i]``, or ``None`` if
+                 that VM could not be started.
+        """
+        if node_names is None:
+            node_names = [None] * count
+        instance_ids = []
+        for node_name in node_names:
+            try:
+                instance_ids.append(self.start_instance(
+                    key_name, public_key_path, private_key_path,
+                    security_group, flavor, image_id, image_userdata,
+                    username=username, node_name=node_name, **kwargs))
+            except Exception as err:
+                if not instance_ids:
+                    raise
+                log.error("Could not start VM `%s`: %s", node_name, err)
+                instance_ids.append(None)
+        return instance_ids
+
     @abstractmethod
     def stop_instance(self, instance_id):
         """Stops the instance gracefully.
@@ -88,6 +139,360 @@ class AbstractCloudProvider:
         """
         pass
 
+    def preflight(self, node_specs):
+        """
+        Check, once for a whole cluster, that VMs can be started.
+
+        This is called by `Cluster.start` before any VM is started.
+        Each item in `node_specs` is a dictionary holding the keyword
+        arguments that `start_instance`:meth: will be called with
+        (except ``node_name``), one for each kind of node to start.
+
+        Cloud providers should check and, if needed, create the
+        resources that are shared by all VMs (e.g., keypairs and
+        security groups) here, and cache any information (e.g.,
+        image, flavor and network IDs) that `start_instance`:meth:
+        would otherwise need to look up on every call.  Since checks
+        will have been done already, concurrent calls to
+        `start_instance`:meth: should then need no locking.
+
+        The default implementation does nothing.
+
+        :raise: `KeypairError`, `SecurityGroupError`, `ImageError`,
+          `FlavorError` or `SubnetError` (from module
+          `elasticluster.exceptions`) if VMs cannot be started
+          with the given parameters.
+        """
+        pass
+
+    def _retry_throttled(self, func, *args, **kwargs):
+        """
+        Return ``func(*args, **kwargs)``.
+
+        `start_instance`:meth: and `start_instances`:meth: usually
+        issue several requests to the cloud API, so they are never
+        retried as a whole (see `NON_RETRYABLE_METHODS`); they should
+        instead pass here the single request that creates the VMs.
+        `limit_api_calls`:func: replaces this method with one that
+        retries the request if it is throttled.
+        """
+        return func(*args, **kwargs)
+
+    #: persistent cache of cloud metadata (a `DiskCache` instance, see
+    #: module `elasticluster.utils`), shared by all ElastiCluster
+    #: invocations using the same cloud section; set by
+    #: `Creator.create_cloud_provider` unless caching is disabled
+    metadata_cache = None
+
+    def _get_metadata(self, key, load, check=None):
+        """
+        Return the result of `load()`, cached in `metadata_cache`.
+
+        Cloud providers should use this for information that changes
+        rarely and is costly to get, e.g., the IDs of images, flavors
+        or networks.  The value returned by `load` must be
+        serializable to JSON; `check` can be used to reject a cached
+        value as stale (see `DiskCache.get`).
+        """
+        if self.metadata_cache is None:
+            return load()
+        return self.metadata_cache.get(key, load, check)
+
+    def get_instances_status(self, instance_ids):
+        """
+        Return running state and IP addresses of many instances at once.
+
+        Cloud providers that can query the state of several instances
+        with a single API call should override this method; the
+        default implementation just calls :meth:`is_instance_running`
+        and :meth:`get_ips` on each instance in turn.
+
+        Errors in querying an instance are logged and the instance is
+        reported as not running.
+
+        :param list instance_ids: instance identifiers
+
+        :return: list of ``(running, ips)`` pairs, one for each item
+                 in `instance_ids` and in the same order; `ips` is
+                 ``None`` if the instance is not running.
+        """
+        result = []
+        for instance_id in instance_ids:
+            try:
+                if self.is_instance_running(instance_id):
+                    result.append((True, self.get_ips(instance_id)))
+                    continue
+            except Exception as err:
+                log.debug("Ignoring error while looking for VM id %s: %s",
+                          instance_id, err)
+            result.append((False, None))
+        return result
+
+
+#: cloud provider methods that issue requests to the cloud API
+API_METHODS = (
+    'get_instances_status',
+    'get_ips',
+    'is_instance_running',
+    'preflight',
+    'start_instance',
+    'start_instances',
+    'stop_instance',
+)
+
+#: API methods that must not be retried as a whole when throttled,
+#: since a throttled request may follow others that did take effect
+#: (e.g., tagging VMs that have just been created)
+NON_RETRYABLE_METHODS = (
+    'start_instance',
+    'start_instances',
+)
+
+# error codes and messages used by cloud APIs to signal throttling
+_THROTTLING_ERRORS = (
+    'OverLimit',
+    'RequestLimitExceeded',
+    'Throttling',
+    'TooManyRequests',
+    'rateLimitExceeded',
+)
+
+
+def is_throttling_error(err):
+    """
+    Return ``True`` if exception `err` signals that the cloud API
+    rejected a request because too many were issued.
+
+    A request rejected this way has had no effect, so it is safe
+    to retry it; this does not hold for a method that issues
+    several requests, if only a later one is throttled.
+    """
+    if get_retry_after(err) is not None:
+        return True
+    for status in (getattr(err, 'status', None),
+                   getattr(err, 'http_status', None),
+                   getattr(getattr(err, 'resp', None), 'status', None)):
+        if status == 429:
+            return True
+    text = '{0} {1}'.format(getattr(err, 'error_code', ''), err)
+    return any(code in text for code in _THROTTLING_ERRORS)
+
+
+def limit_api_calls(provider, api_rate_limit=10, api_burst=20,
+                    api_max_retries=5):
+    """
+    Limit the rate of calls to `provider`'s cloud API methods.
+
+    Each method listed in `API_METHODS` is replaced, on the
+    `provider` instance, by a wrapper that takes a token from a
+    bucket shared by all threads (refilled at `api_rate_limit` tokens
+    per second, up to `api_burst` tokens) before calling the original
+    method.  Calls that fail with a throttling error (see
+    `is_throttling_error`:func:) are retried up to `api_max_retries`
+    times, with exponential backoff; while a call waits for a retry,
+    all other calls through the same provider are held back as well.
+
+    Methods listed in `NON_RETRYABLE_METHODS` are not retried;
+    instead, the requests they pass to the provider's
+    `_retry_throttled` method are.
+
+    If `api_rate_limit` is 0, only retry throttled calls.
+
+    Return `provider`.
+    """
+    bucket = (TokenBucket(api_rate_limit, api_burst)
+              if api_rate_limit > 0 else None)
+
+    def retry(name, func, args, kwargs):
+        backoff = Backoff()
+        retries = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                if retries >= api_max_retries or not is_throttling_error(err):
+                    raise
+                retries += 1
+                delay = backoff.next_delay(get_retry_after(err))
+                log.debug(
+                    "Call to `%s` throttled by the cloud provider (%s);"
+                    " retrying in %.1f seconds (%d of %d) ...",
+                    name, err, delay, retries, api_max_retries)
+                if bucket:
+                    bucket.pause(delay)
+                time.sleep(delay)
+                if bucket:
+                    bucket.acquire()
+
+    def limited(name, method):
+        def wrapper(*args, **kwargs):
+            if bucket:
+                bucket.acquire()
+            if name in NON_RETRYABLE_METHODS:
+                return method(*args, **kwargs)
+            return retry(name, method, args, kwargs)
+        return wrapper
+
+    def retry_throttled(func, *args, **kwargs):
+        # the first attempt is covered by the token taken by the
+        # enclosing `start_instance(s)` call
+        return retry(getattr(func, '__name__', repr(func)), func, args, kwargs)
+
+    for name in API_METHODS:
+        method = getattr(provider, name, None)
+        if callable(method):
+            setattr(provider, name, limited(name, method))
+    provider._retry_throttled = retry_throttled
+    return provider
+
+
+class CallStats(object):
+    """
+    Record count, errors and latency of calls to cloud provider methods.
+
+    Statistics are kept separately for each ``(provider, method)``
+    pair; the latency of calls is recorded in a `Histogram`:class:.
+    Instances can be shared among threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (provider, method) -> [errors, throttled, latency histogram]
+        self._stats = {}
+
+    def record(self, provider, method, elapsed, error=None):
+        """
+        Record a call to `method` of `provider` that took `elapsed` seconds.
+
+        If the call raised an exception, pass it as `error`.
+        """
+        key = (provider, method)
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = [0, 0, Histogram()]
+            stats = self._stats[key]
+            if error is not None:
+                stats[0] += 1
+                if is_throttling_error(error):
+                    stats[1] += 1
+            stats[2].add(elapsed)
+
+    def clear(self):
+        """Forget all recorded calls."""
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self, pcts=(50, 90, 99)):
+        """
+        Return list of statistics, one item per provider and method.
+
+        Each item is a dictionary with keys ``provider``, ``method``,
+        ``calls``, ``errors``, ``throttled``, ``mean``, ``max``, a
+        ``p<N>`` key for each percentile *N* in `pcts`, and
+        ``histogram``: a list of ``(upper bound, count)`` pairs for
+        the non-empty latency buckets (the upper bound of the last
+        bucket is ``None``).
+        """
+        result = []
+        with self._lock:
+            for (provider, method), (errors, throttled, hist) in sorted(
+                    self._stats.items()):
+                stats = {
+                    'provider': provider,
+                    'method': method,
+                    'calls': hist.count,
+                    'errors': errors,
+                    'throttled': throttled,
+                    'mean': hist.mean,
+                    'max': hist.max,
+                    'histogram': [
+                        (bound, count) for bound, count
+                        in zip(hist.bounds + (None,), hist.counts) if count],
+                }
+                for pct in pcts:
+                    stats['p{0}'.format(pct)] = hist.percentile(pct)
+                result.append(stats)
+        return result
+
+    def format(self):
+        """
+        Return a human-readable table of the recorded statistics.
+
+        Latency percentiles are upper bounds, see `Histogram.percentile`.
+        """
+        summary = self.summary()
+        if not summary:
+            return "No calls to cloud provider methods were recorded.\n"
+        lines = ["{0:<12} {1:<30} {2:>6} {3:>6} {4:>9} {5:>9} {6:>9} {7:>9} {8:>9}"
+                 .format('PROVIDER', 'METHOD', 'CALLS', 'ERRORS',
+                         'MEAN', 'P50', 'P90', 'P99', 'MAX')]
+        for stats in summary:
+            lines.append(
+                "{provider:<12} {method:<30} {calls:>6d} {errors:>6d}"
+                " {mean:>8.3f}s {p50:>8.3f}s {p90:>8.3f}s {p99:>8.3f}s"
+                " {max:>8.3f}s".format(**stats))
+        return '\n'.join(lines) + '\n'
+
+
+#: statistics of calls to the cloud providers created in this process
+call_stats = CallStats()
+
+
+def _instrumented_methods(cls):
+    """
+    Return names of the methods of `cls` that `instrument_calls` wraps.
+    """
+    names = set(API_METHODS)
+    for klass in inspect.getmro(cls):
+        for name, value in vars(klass).items():
+            if (name.startswith('_') and not name.endswith('__')
+                    and callable(value)
+                    and not isinstance(value, (type, staticmethod, classmethod))):
+                names.add(name)
+    return sorted(names)
+
+
+def instrument_calls(provider, name=None, stats=None):
+    """
+    Record statistics of calls to `provider`'s methods into `stats`.
+
+    All methods listed in `API_METHODS`, and all the private helper
+    methods (i.e., whose name starts with ``_``) of `provider` are
+    replaced, on the `provider` instance, by a wrapper that records
+    each call's duration and outcome into `CallStats`:class:
+    instance `stats` (by default, the global `call_stats`) under
+    provider name `name` (by default, the class name of `provider`).
+    Static and class methods are not instrumented.
+
+    Since calls to helper methods are usually nested within calls to
+    API methods, their time is counted in both.
+
+    Return `provider`.
+    """
+    if name is None:
+        name = provider.__class__.__name__
+    if stats is None:
+        stats = call_stats
+
+    def instrumented(method_name, method):
+        def wrapper(*args, **kwargs):
+            error = None
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            except Exception as err:
+                error = err
+                raise
+            finally:
+                stats.record(name, method_name, time.time() - start, error)
+        return wrapper
+
+    for method_name in _instrumented_methods(provider.__class__):
+        method = getattr(provider, method_name, None)
+        if callable(method):
+            setattr(provider, method_name, instrumented(method_name, method))
+    return provider
+
 
 class AbstractSetupProvider:
     """
@@ -99,7 +504,7 @@ class AbstractSetupProvider:
     HUMAN_READABLE_NAME = 'setup provider'
 
     @abstractmethod
-    def setup_cluster(self, cluster, extra_args=tuple()):
+    def setup_cluster(self, cluster, extra_args=tuple(), nodes=None):
         """
         Configure all nodes of a cluster.
 
@@ -113,12 +518,36 @@ class AbstractSetupProvider:
           List of additional command-line arguments
           that are appended to each invocation of the setup program.
 
+        :param list nodes:
+          If not ``None``, only configure these nodes; the rest of the
+          cluster is assumed to be configured already.
+
         :return: `True` if the cluster is correctly configured, even
                   if the method didn't actually do anything. `False` if the
                   cluster is not configured.
         """
         pass
 
+    def bootstrap_nodes(self, cluster, nodes):
+        """
+        Perform minimal preparation of freshly-started nodes.
+
+        This is called by `Cluster.start` on batches of nodes, as soon
+        as they can be reached via SSH and possibly while other nodes
+        are still booting; several calls may run concurrently.  It
+        must be idempotent, as `setup_cluster` will later run on the
+        same nodes.
+
+        The default implementation does nothing.
+
+        :param cluster: cluster the nodes belong to
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        :param list nodes: nodes to prepare
+
+        :return: `True` on success, `False` otherwise.
+        """
+        return True
+
     @abstractmethod
     def cleanup(self):
         """Cleanup any temporary file or directory created during setup.
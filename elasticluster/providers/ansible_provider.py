@@ -28,7 +28,11 @@ import re
 import tempfile
 import shlex
 import shutil
-from subprocess import call
+try:
+    # stdlib's `subprocess` is not safe to use from multiple threads
+    from subprocess32 import call
+except ImportError:
+    from subprocess import call
 import sys
 import re
 from warnings import warn
@@ -142,7 +146,7 @@ class AnsibleSetupProvider(AbstractSetupProvider):
             self._storage_path_tmp = True
 
 
-    def setup_cluster(self, cluster, extra_args=tuple()):
+    def setup_cluster(self, cluster, extra_args=tuple(), nodes=None):
         """
         Configure the cluster by running an Ansible playbook.
 
@@ -157,13 +161,19 @@ class AnsibleSetupProvider(AbstractSetupProvider):
           List of additional command-line arguments
           that are appended to each invocation of the setup program.
 
+        :param list nodes:
+          If given, only run the playbook on these nodes, which are
+          the only ones listed in the inventory: facts are gathered
+          for every host in the inventory, so it cannot list nodes
+          that are still starting.
+
         :return: ``True`` on success, ``False`` otherwise. Please note, if nothing
                  has to be configured, then ``True`` is returned.
 
         :raises: `ConfigurationError` if the playbook can not be found
                  or is corrupt.
         """
-        inventory_path = self._build_inventory(cluster)
+        inventory_path = self._build_inventory(cluster, nodes)
         if inventory_path is None:
             # no inventory file has been created: this can only happen
             # if no nodes have been started nor can be reached
@@ -172,6 +182,124 @@ class AnsibleSetupProvider(AbstractSetupProvider):
                 "inventory file `{inventory_path}` does not exist"
                 .format(inventory_path=inventory_path))
 
+        cmd, ansible_env = self._make_ansible_command(
+            cluster, self._playbook_path, inventory_path, extra_args)
+        if nodes is None:
+            nodes = cluster.get_all_nodes()
+
+        with temporary_dir():
+            # adjust execution environment, for the part that needs a
+            # the current directory path
+            cmd += [
+                '-e', 'elasticluster_output_dir={0}'.format(os.getcwd())
+            ]
+            # run it!
+            cmdline = ' '.join(cmd)
+            elasticluster.log.debug(
+                "Running Ansible command `%s` ...", cmdline)
+            rc = call(cmd, env=ansible_env, bufsize=1, close_fds=True)
+            # check outcome
+            ok = False  # pessimistic default
+            if rc != 0:
+                elasticluster.log.error(
+                    "Command `%s` failed with exit code %d.", cmdline, rc)
+            else:
+                # even if Ansible exited with return code 0, the
+                # playbook might still have failed -- so explicitly
+                # check for a "done" report showing that each node run
+                # the playbook until the very last task
+                cluster_hosts = set(node.name for node in nodes)
+                done_hosts = set()
+                for node_name in cluster_hosts:
+                    try:
+                        with open(node_name + '.log') as stream:
+                            status = stream.read().strip()
+                        if status == 'done':
+                            done_hosts.add(node_name)
+                    except (OSError, IOError):
+                        # no status file for host, do not add it to
+                        # `done_hosts`
+                        pass
+                if done_hosts == cluster_hosts:
+                    # success!
+                    ok = True
+                elif len(done_hosts) == 0:
+                    # total failure
+                    elasticluster.log.error(
+                        "No host reported successfully running the setup playbook!")
+                else:
+                    # partial failure
+                    elasticluster.log.error(
+                        "The following nodes did not report"
+                        " successful termination of the setup playbook:"
+                        " %s", (', '.join(cluster_hosts - done_hosts)))
+        if ok:
+            elasticluster.log.info("Cluster correctly configured.")
+            return True
+        else:
+            elasticluster.log.warning(
+                "The cluster has likely *not* been configured correctly."
+                " You may need to re-run `elasticluster setup`.")
+            return False
+
+    def bootstrap_nodes(self, cluster, nodes):
+        """
+        Run the "Prepare VM for running Ansible" play on the given nodes.
+
+        The play (in file ``bootstrap.yml`` of ElastiCluster's
+        playbook directory) only ensures that Python is installed,
+        so that the full setup playbook can later run.
+
+        This method is safe to call concurrently from several threads;
+        each invocation uses a separate inventory file, listing only
+        `nodes`.
+
+        :param cluster: cluster the nodes belong to
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        :param list nodes: nodes to bootstrap
+
+        :return: ``True`` if the play ran successfully on all `nodes`.
+        """
+        playbook_path = os.path.join(
+            resource_filename('elasticluster', 'share/playbooks'),
+            'bootstrap.yml')
+        fd, inventory_path = tempfile.mkstemp(
+            prefix=(cluster.name + '.'), suffix='.bootstrap.inventory',
+            dir=self._storage_path)
+        os.close(fd)
+        try:
+            if self._build_inventory(cluster, nodes, inventory_path) is None:
+                return False
+            cmd, ansible_env = self._make_ansible_command(
+                cluster, playbook_path, inventory_path)
+            # one unreachable node should not abort the others
+            ansible_env['ANSIBLE_ANY_ERRORS_FATAL'] = 'no'
+            cmdline = ' '.join(cmd)
+            elasticluster.log.debug(
+                "Running Ansible command `%s` ...", cmdline)
+            rc = call(cmd, env=ansible_env, bufsize=1, close_fds=True)
+            if rc != 0:
+                elasticluster.log.warning(
+                    "Command `%s` failed with exit code %d.", cmdline, rc)
+            return (rc == 0)
+        finally:
+            os.remove(inventory_path)
+
+    def _make_ansible_command(self, cluster, playbook_path, inventory_path,
+                              extra_args=tuple()):
+        """
+        Return command-line and environment for running `ansible-playbook`.
+
+        :param cluster: cluster to configure
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        :param str playbook_path: path to the playbook to run
+        :param str inventory_path: path to the Ansible inventory file
+        :param list extra_args:
+          List of additional command-line arguments
+          that are appended to the `ansible-playbook` command-line.
+
+        :return: pair `(cmd, env)`
+        """
         # build list of directories to search for roles/include files
         ansible_roles_dirs = [
             # include Ansible default first ...
@@ -181,7 +309,7 @@ class AnsibleSetupProvider(AbstractSetupProvider):
                 # ... then ElastiCluster's built-in defaults
                 resource_filename('elasticluster', 'share/playbooks'),
                 # ... then wherever the playbook is
-                os.path.dirname(self._playbook_path),
+                os.path.dirname(playbook_path),
         ]:
             for path in [
                     root_path,
@@ -254,13 +382,13 @@ class AnsibleSetupProvider(AbstractSetupProvider):
             for var, value in sorted(ansible_env.items()):
                 elasticluster.log.debug("- %s=%r", var, value)
 
-        elasticluster.log.debug("Using playbook file %s.", self._playbook_path)
+        elasticluster.log.debug("Using playbook file %s.", playbook_path)
 
         # build `ansible-playbook` command-line
         cmd = shlex.split(self.extra_conf.get('ansible_command', 'ansible-playbook'))
         cmd += [
             ('--private-key=' + cluster.user_key_private),
-            os.path.realpath(self._playbook_path),
+            os.path.realpath(playbook_path),
             ('--inventory=' + inventory_path),
         ]
 
@@ -295,72 +423,24 @@ class AnsibleSetupProvider(AbstractSetupProvider):
                 arg = os.path.abspath(arg)
             cmd.append(arg)
 
-        with temporary_dir():
-            # adjust execution environment, for the part that needs a
-            # the current directory path
-            cmd += [
-                '-e', 'elasticluster_output_dir={0}'.format(os.getcwd())
-            ]
-            # run it!
-            cmdline = ' '.join(cmd)
-            elasticluster.log.debug(
-                "Running Ansible command `%s` ...", cmdline)
-            rc = call(cmd, env=ansible_env, bufsize=1, close_fds=True)
-            # check outcome
-            ok = False  # pessimistic default
-            if rc != 0:
-                elasticluster.log.error(
-                    "Command `%s` failed with exit code %d.", cmdline, rc)
-            else:
-                # even if Ansible exited with return code 0, the
-                # playbook might still have failed -- so explicitly
-                # check for a "done" report showing that each node run
-                # the playbook until the very last task
-                cluster_hosts = set(node.name
-                                    for node in cluster.get_all_nodes())
-                done_hosts = set()
-                for node_name in cluster_hosts:
-                    try:
-                        with open(node_name + '.log') as stream:
-                            status = stream.read().strip()
-                        if status == 'done':
-                            done_hosts.add(node_name)
-                    except (OSError, IOError):
-                        # no status file for host, do not add it to
-                        # `done_hosts`
-                        pass
-                if done_hosts == cluster_hosts:
-                    # success!
-                    ok = True
-                elif len(done_hosts) == 0:
-                    # total failure
-                    elasticluster.log.error(
-                        "No host reported successfully running the setup playbook!")
-                else:
-                    # partial failure
-                    elasticluster.log.error(
-                        "The following nodes did not report"
-                        " successful termination of the setup playbook:"
-                        " %s", (', '.join(cluster_hosts - done_hosts)))
-        if ok:
-            elasticluster.log.info("Cluster correctly configured.")
-            return True
-        else:
-            elasticluster.log.warning(
-                "The cluster has likely *not* been configured correctly."
-                " You may need to re-run `elasticluster setup`.")
-            return False
+        return cmd, ansible_env
 
-    def _build_inventory(self, cluster):
+    def _build_inventory(self, cluster, nodes=None, inventory_path=None):
         """
         Builds the inventory for the given cluster and returns its path
 
         :param cluster: cluster to build inventory for
         :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        :param list nodes: only list these nodes in the inventory;
+                           by default, all nodes in the cluster are listed
+        :param str inventory_path: write the inventory to this file,
+                                   instead of the default location
         """
         inventory_data = defaultdict(list)
 
-        for node in cluster.get_all_nodes():
+        if nodes is None:
+            nodes = cluster.get_all_nodes()
+        for node in nodes:
             if node.preferred_ip is None:
                 log.warning(
                     "Ignoring node `{0}`: No IP address."
@@ -399,8 +479,9 @@ class AnsibleSetupProvider(AbstractSetupProvider):
             elasticluster.log.warning(
                 "Writing inventory file to tmp dir `%s`", self._storage_path)
 
-        inventory_path = os.path.join(
-            self._storage_path, (cluster.name + '.inventory'))
+        if inventory_path is None:
+            inventory_path = os.path.join(
+                self._storage_path, (cluster.name + '.inventory'))
         log.debug("Writing Ansible inventory to file `%s` ...", inventory_path)
         with open(inventory_path, 'w+') as inventory_file:
             for section, hosts in inventory_data.items():
@@ -23,6 +23,7 @@ __author__ = ', '.join([
 ])
 
 # System imports
+import copy
 import hashlib
 import json
 import os
@@ -97,6 +98,60 @@ Copyright (c) 2015 Microsoft Corporation
 """
 
 
+def _make_multi_vm_template(template):
+    """
+    Turn the single-VM `template` into one that starts many VMs at once.
+
+    Parameters ``vmName`` and ``storageAccountName`` are replaced by
+    arrays ``vmNames`` and ``storageAccountNames``, and a copy loop
+    over them is added to all resources depending on the VM name.
+    """
+    template = copy.deepcopy(template)
+    params = template['parameters']
+    params['vmNames'] = dict(params.pop('vmName'), type='array')
+    params['storageAccountNames'] = dict(
+        params.pop('storageAccountName'), type='array')
+
+    vm_name = "parameters('vmNames')[copyIndex()]"
+    replacements = [
+        # variables derived from the VM name are inlined
+        ("variables('dnsLabelPrefix')", vm_name),
+        ("variables('osDiskName')", "concat(%s, '-disk')" % vm_name),
+        ("variables('nicName')", "concat(%s, '-nic')" % vm_name),
+        ("variables('publicIPAddressName')",
+         "concat(%s, '-public-ip')" % vm_name),
+        ("parameters('vmName')", vm_name),
+        ("parameters('storageAccountName')",
+         "parameters('storageAccountNames')[copyIndex()]"),
+    ]
+    for name in 'dnsLabelPrefix', 'osDiskName', 'nicName', 'publicIPAddressName':
+        del template['variables'][name]
+
+    resources = []
+    for resource in template['resources']:
+        text = json.dumps(resource)
+        for old, new in replacements:
+            text = text.replace(old, new)
+        if 'copyIndex()' not in text:
+            # shared resource, e.g., the virtual network
+            resources.append(resource)
+            continue
+        resource = json.loads(text)
+        resource['copy'] = {
+            'name': resource['type'].split('/')[-1] + 'Loop',
+            'count': "[length(parameters('vmNames'))]",
+        }
+        resources.append(resource)
+    template['resources'] = resources
+    return template
+
+
+_VM_TEMPLATE_MULTI = _make_multi_vm_template(_VM_TEMPLATE)
+"""
+Template description for starting many VMs with a single deployment.
+"""
+
+
 class AzureCloudProvider(AbstractCloudProvider):
     """
     Use the Azure Python SDK to connect to the Azure clouds and
@@ -111,6 +166,11 @@ class AzureCloudProvider(AbstractCloudProvider):
     Lock used for node startup.
     """
 
+    max_instances_per_request = 100
+    """
+    Max number of VMs to start with a single template deployment.
+    """
+
     def __init__(self, subscription_id, tenant_id, client_id, secret, location, **extra):
         self.subscription_id = subscription_id
         self.tenant_id = tenant_id
@@ -185,6 +245,84 @@ class AzureCloudProvider(AbstractCloudProvider):
 
         :return: tuple[str, str] -- resource group and node name of the started VM
         """
+        cluster_name, parameters = self._prepare_deployment(
+            node_name, public_key_path, security_group, flavor, image_id,
+            image_userdata, username)
+        parameters['storageAccountName'] = {
+            'value': self._make_storage_account_name(cluster_name, node_name)
+        }
+        parameters['vmName'] = { 'value': node_name }
+
+        log.debug(
+            "Deploying `%s` VM template to Azure ...",
+            parameters['vmName']['value'])
+        oper = self._retry_throttled(
+            self._resource_client.deployments.create_or_update,
+            cluster_name, node_name, {
+                'mode':       DeploymentMode.incremental,
+                'template':   _VM_TEMPLATE,
+                'parameters': parameters,
+            })
+        oper.wait()
+
+        # the `instance_id` is a composite type since we need both the
+        # resource group name and the vm name to uniquely identify a VM
+        return (cluster_name, node_name)
+
+    def start_instances(self, count, key_name, public_key_path,
+                        private_key_path, security_group, flavor, image_id,
+                        image_userdata, username='root', node_names=None,
+                        **extra):
+        """
+        Start `count` identical VMs with a single template deployment.
+
+        The deployed template (see `_VM_TEMPLATE_MULTI`) uses copy
+        loops to create one set of per-VM resources for each name in
+        `node_names`; network resources are shared as usual.  The
+        deployment either creates all VMs or fails.
+
+        Azure VMs cannot be started without a name, so `node_names`
+        must list `count` names; `ValueError` is raised otherwise.
+
+        See `start_instance`:meth: for the meaning of parameters, and
+        `AbstractCloudProvider.start_instances`:meth: for the return
+        value.
+        """
+        if not node_names or len(node_names) != count or None in node_names:
+            raise ValueError(
+                "Azure VMs must be named: {0} node names are needed,"
+                " got {1!r} instead.".format(count, node_names))
+        cluster_name, parameters = self._prepare_deployment(
+            node_names[0], public_key_path, security_group, flavor, image_id,
+            image_userdata, username)
+        parameters['storageAccountNames'] = {
+            'value': [self._make_storage_account_name(cluster_name, node_name)
+                      for node_name in node_names]
+        }
+        parameters['vmNames'] = { 'value': list(node_names) }
+
+        log.debug("Deploying template for %d VMs `%s` to Azure ...",
+                  count, '`, `'.join(node_names))
+        oper = self._retry_throttled(
+            self._resource_client.deployments.create_or_update,
+            cluster_name, node_names[0] + '-multi', {
+                'mode':       DeploymentMode.incremental,
+                'template':   _VM_TEMPLATE_MULTI,
+                'parameters': parameters,
+            })
+        oper.wait()
+
+        return [(cluster_name, node_name) for node_name in node_names]
+
+    def _prepare_deployment(self, node_name, public_key_path, security_group,
+                            flavor, image_id, image_userdata, username):
+        """
+        Return resource group name and deployment parameters for new VMs.
+
+        The resource group is created if it does not exist yet.  The
+        per-VM parameters (VM and storage account names) are left to
+        the caller.
+        """
         self._init_az_api()
 
         # Warn of unsupported parameters, if set.  We do not warn
@@ -231,29 +369,11 @@ class AzureCloudProvider(AbstractCloudProvider):
                 'value': security_group,
             },
             'sshKeyData':     { 'value': public_key },
-            'storageAccountName': {
-                'value': self._make_storage_account_name(
-                    cluster_name, node_name)
-            },
             'subnetName':     { 'value': cluster_name },
-            'vmName':         { 'value': node_name },
             'vmSize':         { 'value': flavor },
         }
 
-        log.debug(
-            "Deploying `%s` VM template to Azure ...",
-            parameters['vmName']['value'])
-        oper = self._resource_client.deployments.create_or_update(
-            cluster_name, node_name, {
-                'mode':       DeploymentMode.incremental,
-                'template':   _VM_TEMPLATE,
-                'parameters': parameters,
-            })
-        oper.wait()
-
-        # the `instance_id` is a composite type since we need both the
-        # resource group name and the vm name to uniquely identify a VM
-        return (cluster_name, node_name)
+        return cluster_name, parameters
 
     @staticmethod
     def _split_image_id(image_id):
@@ -357,6 +477,37 @@ class AzureCloudProvider(AbstractCloudProvider):
         # == 'ProvisioningState/suceeded'`?
         return vm.provisioning_state == u'Succeeded'
 
+    def get_instances_status(self, instance_ids):
+        """
+        Return running state and IP addresses of the given instances.
+
+        VMs and public IP addresses are listed with one API call per
+        resource group (i.e., per cluster); see
+        :meth:`AbstractCloudProvider.get_instances_status` for a
+        description of the return value.
+        """
+        self._init_az_api()
+        vms = {}
+        ips = {}
+        for cluster_name in set(cluster_name for cluster_name, _ in instance_ids):
+            for vm in self._compute_client.virtual_machines.list(cluster_name):
+                vms[cluster_name, vm.name] = vm
+            for ip in self._network_client.public_ip_addresses.list(cluster_name):
+                ips[cluster_name, ip.name] = ip
+        result = []
+        for cluster_name, node_name in instance_ids:
+            vm = vms.get((cluster_name, node_name))
+            if vm is None or vm.provisioning_state != u'Succeeded':
+                result.append((False, None))
+                continue
+            # XXX: keep in sync with contents of `_VM_TEMPLATE`
+            ip = ips.get((cluster_name, node_name + '-public-ip'))
+            if ip and ip.provisioning_state == 'Succeeded' and ip.ip_address:
+                result.append((True, [ip.ip_address]))
+            else:
+                result.append((True, []))
+        return result
+
     def _get_vm(self, instance_id, force_reload=True):
         """
         Return details on the VM with the given name.
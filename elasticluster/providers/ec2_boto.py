@@ -39,6 +39,7 @@ from paramiko.ssh_exception import SSHException
 # Elasticluster imports
 from elasticluster import log
 from elasticluster.providers import AbstractCloudProvider
+from elasticluster.utils import Backoff
 from elasticluster.exceptions import VpcError, SecurityGroupError, \
     SubnetError, KeypairError, ImageError, InstanceError, InstanceNotFoundError, ClusterError
 
@@ -67,10 +68,14 @@ class BotoCloudProvider(AbstractCloudProvider):
     """
     __node_start_lock = threading.Lock()  # lock used for node startup
 
-    # interval (in seconds) for polling the cloud provider,
+    # max interval (in seconds) for polling the cloud provider,
     # e.g., when requesting spot instances
     POLL_INTERVAL = 10
 
+    # EC2 has no fixed limit, but large requests are more likely
+    # to fail for lack of capacity
+    max_instances_per_request = 100
+
     def __init__(self, ec2_url, ec2_region, ec2_access_key=None,
                  ec2_secret_key=None, vpc=None, storage_path=None,
                  request_floating_ip=False, instance_profile=None,
@@ -111,6 +116,9 @@ class BotoCloudProvider(AbstractCloudProvider):
         self._cached_instances = []
         self._images = None
 
+        # results of `_prepare_start()`
+        self._start_params_cache = {}
+
     def _connect(self):
         """
         Connect to the EC2 cloud provider.
@@ -163,18 +171,19 @@ class BotoCloudProvider(AbstractCloudProvider):
         )
         log.debug("VPC connection has been successful.")
 
-        for vpc in vpc_connection.get_all_vpcs():
-            matches = [vpc.id]
-            if 'Name' in vpc.tags:
-                matches.append(vpc.tags['Name'])
-            if vpc_name in matches:
-                vpc_id = vpc.id
-                if vpc_name != vpc_id:
-                    # then `vpc_name` is the VPC name
-                    log.debug("VPC `%s` has ID `%s`", vpc_name, vpc_id)
-                break
-        else:
+        def lookup():
+            for vpc in vpc_connection.get_all_vpcs():
+                matches = [vpc.id]
+                if 'Name' in vpc.tags:
+                    matches.append(vpc.tags['Name'])
+                if vpc_name in matches:
+                    vpc_id = vpc.id
+                    if vpc_name != vpc_id:
+                        # then `vpc_name` is the VPC name
+                        log.debug("VPC `%s` has ID `%s`", vpc_name, vpc_id)
+                    return vpc_id
             raise VpcError('Cannot find VPC `{0}`.'.format(vpc_name))
+        vpc_id = self._get_metadata('vpc:' + vpc_name, lookup)
 
         return (vpc_connection, vpc_id)
 
@@ -193,10 +202,8 @@ class BotoCloudProvider(AbstractCloudProvider):
         The following tasks are done to start an instance:
 
         * establish a connection to the cloud web service
-        * check ssh keypair and upload it if it does not yet exist. This is
-          a locked process, since this function might be called in multiple
-          threads and we only want the key to be stored once.
-        * check if the security group exists
+        * check ssh keypair, security group and subnets (unless already
+          done by `preflight`:meth:, see `_prepare_start`:meth:)
         * run the instance with the given properties
 
         :param str key_name: name of the ssh key to connect
@@ -222,33 +229,10 @@ class BotoCloudProvider(AbstractCloudProvider):
         """
         connection = self._connect()
 
-        log.debug("Checking keypair `%s`.", key_name)
-        # the `_check_keypair` method has to be called within a lock,
-        # since it will upload the key if it does not exist and if this
-        # happens for every node at the same time ec2 will throw an error
-        # message (see issue #79)
-        with BotoCloudProvider.__node_start_lock:
-            self._check_keypair(key_name, public_key_path, private_key_path)
-
-        log.debug("Checking security group `%s`.", security_group)
-        security_group_id = self._check_security_group(security_group)
-        # image_id = self._find_image_id(image_id)
-
-        if network_ids:
-            interfaces = []
-            for subnet in network_ids.split(','):
-                subnet_id = self._check_subnet(subnet)
-
-                interfaces.append(
-                    boto.ec2.networkinterface.NetworkInterfaceSpecification(
-                        subnet_id=subnet_id, groups=[security_group_id],
-                        associate_public_ip_address=self.request_floating_ip))
-            interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(*interfaces)
-
-            security_groups = []
-        else:
-            interfaces = None
-            security_groups = [security_group]
+        security_groups, interfaces, bdm = self._get_run_args(
+            key_name, public_key_path, private_key_path, security_group,
+            network_ids, boot_disk_device, boot_disk_size, boot_disk_type,
+            boot_disk_iops)
 
         # get defaults for `price` and `timeout` from class instance
         if price is None:
@@ -256,25 +240,12 @@ class BotoCloudProvider(AbstractCloudProvider):
         if timeout is None:
             timeout = self.timeout
 
-        if boot_disk_size:
-            dev_root = boto.ec2.blockdevicemapping.BlockDeviceType()
-            dev_root.size = int(boot_disk_size)
-            dev_root.delete_on_termination = True
-            if boot_disk_type:
-                dev_root.volume_type = boot_disk_type
-            if boot_disk_iops:
-                dev_root.iops = int(boot_disk_iops)
-            bdm = boto.ec2.blockdevicemapping.BlockDeviceMapping()
-            dev_name = boot_disk_device if boot_disk_device else "/dev/sda1"
-            bdm[dev_name] = dev_root
-        else:
-            bdm = None
-
         try:
             #start spot instance if bid is specified
             if price:
                 log.info("Requesting spot instance with price `%s` ...", price)
-                request = connection.request_spot_instances(
+                request = self._retry_throttled(
+                                connection.request_spot_instances,
                                 price,image_id, key_name=key_name, security_groups=security_groups,
                                 instance_type=flavor, user_data=image_userdata,
                                 network_interfaces=interfaces,
@@ -284,18 +255,22 @@ class BotoCloudProvider(AbstractCloudProvider):
 
                 # wait until spot request is fullfilled (will wait
                 # forever if no timeout is given)
-                start_time = time.time()
                 timeout = (float(timeout) if timeout else 0)
                 log.info("Waiting for spot instance (will time out in %d seconds) ...", timeout)
+                backoff = Backoff(
+                    cap=self.POLL_INTERVAL,
+                    deadline=(time.time() + timeout if timeout else None))
                 while  request.status.code != 'fulfilled':
-                    if timeout and time.time()-start_time > timeout:
+                    if not backoff.sleep():
                         request.cancel()
                         raise RuntimeError('spot instance timed out')
-                    time.sleep(self.POLL_INTERVAL)
                     # update request status
-                    request=connection.get_all_spot_instance_requests(request_ids=request.id)[-1]
+                    request=self._retry_throttled(
+                        connection.get_all_spot_instance_requests,
+                        request_ids=request.id)[-1]
             else:
-                reservation = connection.run_instances(
+                reservation = self._retry_throttled(
+                    connection.run_instances,
                     image_id, key_name=key_name, security_groups=security_groups,
                     instance_type=flavor, user_data=image_userdata,
                     network_interfaces=interfaces,
@@ -304,21 +279,199 @@ class BotoCloudProvider(AbstractCloudProvider):
                     instance_profile_name=self._instance_profile)
         except Exception as ex:
             log.error("Error starting instance: %s", ex)
-            if "TooManyInstances" in ex:
+            if "TooManyInstances" in str(ex):
                 raise ClusterError(ex)
             else:
                 raise InstanceError(ex)
         if price:
-            vm  = connection.get_only_instances(instance_ids=[request.instance_id])[-1]
+            try:
+                vm = self._retry_throttled(
+                    connection.get_only_instances,
+                    instance_ids=[request.instance_id])[-1]
+            except Exception as err:
+                # the VM is running anyway, do not lose track of it
+                log.warning("Could not look up spot instance %s: %s",
+                            request.instance_id, err)
+                return request.instance_id
         else:
             vm = reservation.instances[-1]
-        vm.add_tag("Name", node_name)
 
         # cache instance object locally for faster access later on
         self._instances[vm.id] = vm
+        self._set_instance_name(vm, node_name)
 
         return vm.id
 
+    def start_instances(self, count, key_name, public_key_path,
+                        private_key_path, security_group, flavor, image_id,
+                        image_userdata, username=None, node_names=None,
+                        network_ids=None, price=None, timeout=None,
+                        boot_disk_device=None, boot_disk_size=None,
+                        boot_disk_type=None, boot_disk_iops=None,
+                        placement_group=None, **kwargs):
+        """
+        Start `count` identical instances with a single `run_instances` call.
+
+        EC2 is asked for at least one and at most `count` instances,
+        so that a partial quota still gets as many instances as
+        possible.  Spot instances are requested one by one, as in
+        `start_instance`:meth:.
+
+        See `AbstractCloudProvider.start_instances`:meth: for the
+        meaning of parameters and return value.
+        """
+        if price is None:
+            price = self.price
+        if price:
+            return AbstractCloudProvider.start_instances(
+                self, count, key_name, public_key_path, private_key_path,
+                security_group, flavor, image_id, image_userdata,
+                username=username, node_names=node_names,
+                network_ids=network_ids, price=price, timeout=timeout,
+                boot_disk_device=boot_disk_device,
+                boot_disk_size=boot_disk_size,
+                boot_disk_type=boot_disk_type,
+                boot_disk_iops=boot_disk_iops,
+                placement_group=placement_group, **kwargs)
+
+        connection = self._connect()
+
+        security_groups, interfaces, bdm = self._get_run_args(
+            key_name, public_key_path, private_key_path, security_group,
+            network_ids, boot_disk_device, boot_disk_size, boot_disk_type,
+            boot_disk_iops)
+
+        try:
+            reservation = self._retry_throttled(
+                connection.run_instances,
+                image_id, min_count=1, max_count=count,
+                key_name=key_name, security_groups=security_groups,
+                instance_type=flavor, user_data=image_userdata,
+                network_interfaces=interfaces,
+                placement_group=placement_group,
+                block_device_map=bdm,
+                instance_profile_name=self._instance_profile)
+        except Exception as ex:
+            log.error("Error starting instances: %s", ex)
+            if "TooManyInstances" in str(ex):
+                raise ClusterError(ex)
+            else:
+                raise InstanceError(ex)
+
+        if node_names is None:
+            node_names = [None] * count
+        instance_ids = [None] * count
+        for index, vm in enumerate(reservation.instances[:count]):
+            # cache instance object locally for faster access later on
+            self._instances[vm.id] = vm
+            instance_ids[index] = vm.id
+        # VMs have been created at this point: errors in naming them
+        # must not make the caller forget their IDs
+        for index, vm in enumerate(reservation.instances[:count]):
+            if node_names[index]:
+                self._set_instance_name(vm, node_names[index])
+        if len(reservation.instances) < count:
+            log.warning("Only %d out of %d requested instances were started.",
+                        len(reservation.instances), count)
+        return instance_ids
+
+    def _set_instance_name(self, vm, node_name):
+        """
+        Tag `vm` with name `node_name`; errors are logged and ignored.
+        """
+        try:
+            self._retry_throttled(vm.add_tag, "Name", node_name)
+        except Exception as err:
+            log.warning("Could not set name of VM %s to `%s`: %s",
+                        vm.id, node_name, err)
+
+    def _get_run_args(self, key_name, public_key_path, private_key_path,
+                      security_group, network_ids, boot_disk_device,
+                      boot_disk_size, boot_disk_type, boot_disk_iops):
+        """
+        Return security groups, network interfaces and block device
+        mapping to pass to `run_instances` or `request_spot_instances`.
+        """
+        security_group_id, subnet_ids = self._prepare_start(
+            key_name, public_key_path, private_key_path,
+            security_group, network_ids)
+
+        if network_ids:
+            interfaces = []
+            for subnet_id in subnet_ids:
+                interfaces.append(
+                    boto.ec2.networkinterface.NetworkInterfaceSpecification(
+                        subnet_id=subnet_id, groups=[security_group_id],
+                        associate_public_ip_address=self.request_floating_ip))
+            interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(*interfaces)
+
+            security_groups = []
+        else:
+            interfaces = None
+            security_groups = [security_group]
+
+        if boot_disk_size:
+            dev_root = boto.ec2.blockdevicemapping.BlockDeviceType()
+            dev_root.size = int(boot_disk_size)
+            dev_root.delete_on_termination = True
+            if boot_disk_type:
+                dev_root.volume_type = boot_disk_type
+            if boot_disk_iops:
+                dev_root.iops = int(boot_disk_iops)
+            bdm = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+            dev_name = boot_disk_device if boot_disk_device else "/dev/sda1"
+            bdm[dev_name] = dev_root
+        else:
+            bdm = None
+
+        return security_groups, interfaces, bdm
+
+    def preflight(self, node_specs):
+        """
+        Check keypairs, security groups and subnets of all nodes to start.
+
+        See `AbstractCloudProvider.preflight`:meth: for the meaning of
+        `node_specs`.
+        """
+        for spec in node_specs:
+            self._prepare_start(
+                spec['key_name'], spec['public_key_path'],
+                spec['private_key_path'], spec['security_group'],
+                spec.get('network_ids'))
+
+    def _prepare_start(self, key_name, public_key_path, private_key_path,
+                       security_group, network_ids):
+        """
+        Check the resources needed to start a VM, creating them if needed.
+
+        Return a pair *(security group ID, list of subnet IDs)*.  The
+        result is cached, so checks are only done once for each set
+        of parameters; only the first call for each set needs to
+        acquire a lock.
+        """
+        cache_key = (key_name, security_group, network_ids)
+        try:
+            return self._start_params_cache[cache_key]
+        except KeyError:
+            pass
+        # keypair checks must be done within a lock, since
+        # `_check_keypair` will upload the key if it does not exist
+        # and if this happens for every node at the same time ec2
+        # will throw an error message (see issue #79)
+        with BotoCloudProvider.__node_start_lock:
+            if cache_key not in self._start_params_cache:
+                log.debug("Checking keypair `%s`.", key_name)
+                self._check_keypair(key_name, public_key_path, private_key_path)
+                log.debug("Checking security group `%s`.", security_group)
+                security_group_id = self._check_security_group(security_group)
+                subnet_ids = []
+                if network_ids:
+                    for subnet in network_ids.split(','):
+                        subnet_ids.append(self._check_subnet(subnet))
+                self._start_params_cache[cache_key] = (
+                    security_group_id, subnet_ids)
+            return self._start_params_cache[cache_key]
+
     def stop_instance(self, instance_id):
         """Stops the instance gracefully.
 
@@ -373,6 +526,42 @@ class BotoCloudProvider(AbstractCloudProvider):
         else:
             return False
 
+    def get_instances_status(self, instance_ids):
+        """
+        Return running state and IP addresses of the given instances.
+
+        Instances are looked up with one API call for every
+        `max_instances_per_request` of them, since EC2 limits the
+        number of values in a filter; see
+        :meth:`AbstractCloudProvider.get_instances_status` for a
+        description of the return value.
+        """
+        instance_ids = list(instance_ids)
+        connection = self._connect()
+        vms = {}
+        chunk_size = self.max_instances_per_request
+        for start in range(0, len(instance_ids), chunk_size):
+            for vm in connection.get_only_instances(filters={
+                    'instance-id': instance_ids[start:start + chunk_size]}):
+                vms[vm.id] = vm
+        # refresh local cache
+        self._instances.update(vms)
+
+        result = []
+        for instance_id in instance_ids:
+            vm = vms.get(instance_id)
+            if vm is None or vm.state != 'running':
+                result.append((False, None))
+            elif self.request_floating_ip:
+                # a public IP address might need to be allocated,
+                # which is handled by the single-instance methods
+                running = self.is_instance_running(instance_id)
+                result.append((running, self.get_ips(instance_id) if running else None))
+            else:
+                result.append((True, list(set(
+                    ip for ip in (vm.private_ip_address, vm.ip_address) if ip))))
+        return result
+
     def _allocate_address(self, instance):
         """Allocates a free public ip address to the given instance
 
@@ -557,23 +746,25 @@ class BotoCloudProvider(AbstractCloudProvider):
         if self._vpc:
             filters = {'vpc-id': self._vpc_id}
 
-        security_groups = connection.get_all_security_groups(filters=filters)
-
-        matching_groups = [
-            group
-            for group
-             in security_groups
-             if name in [group.name, group.id]
-        ]
-        if len(matching_groups) == 0:
-            raise SecurityGroupError(
-                "the specified security group %s does not exist" % name)
-        elif len(matching_groups) == 1:
-            return matching_groups[0].id
-        elif self._vpc and len(matching_groups) > 1:
-            raise SecurityGroupError(
-                "the specified security group name %s matches "
-                "more than one security group" % name)
+        def lookup():
+            security_groups = connection.get_all_security_groups(filters=filters)
+
+            matching_groups = [
+                group
+                for group
+                 in security_groups
+                 if name in [group.name, group.id]
+            ]
+            if len(matching_groups) == 0:
+                raise SecurityGroupError(
+                    "the specified security group %s does not exist" % name)
+            elif len(matching_groups) == 1:
+                return matching_groups[0].id
+            elif self._vpc and len(matching_groups) > 1:
+                raise SecurityGroupError(
+                    "the specified security group name %s matches "
+                    "more than one security group" % name)
+        return self._get_metadata('security_group:' + name, lookup)
 
     def _check_subnet(self, name):
         """Checks if the subnet exists.
@@ -582,26 +773,28 @@ class BotoCloudProvider(AbstractCloudProvider):
         :return: str - subnet id of the subnet
         :raises: `SubnetError` if group does not exist
         """
-        # Subnets only exist in VPCs, so we don't need to worry about
-        # the EC2 Classic case here.
-        subnets = self._vpc_connection.get_all_subnets(
-            filters={'vpcId': self._vpc_id})
-
-        matching_subnets = [
-            subnet
-            for subnet
-             in subnets
-             if name in [subnet.tags.get('Name'), subnet.id]
-        ]
-        if len(matching_subnets) == 0:
-            raise SubnetError(
-                "the specified subnet %s does not exist" % name)
-        elif len(matching_subnets) == 1:
-            return matching_subnets[0].id
-        else:
-            raise SubnetError(
-                "the specified subnet name %s matches more than "
-                "one subnet" % name)
+        def lookup():
+            # Subnets only exist in VPCs, so we don't need to worry about
+            # the EC2 Classic case here.
+            subnets = self._vpc_connection.get_all_subnets(
+                filters={'vpcId': self._vpc_id})
+
+            matching_subnets = [
+                subnet
+                for subnet
+                 in subnets
+                 if name in [subnet.tags.get('Name'), subnet.id]
+            ]
+            if len(matching_subnets) == 0:
+                raise SubnetError(
+                    "the specified subnet %s does not exist" % name)
+            elif len(matching_subnets) == 1:
+                return matching_subnets[0].id
+            else:
+                raise SubnetError(
+                    "the specified subnet name %s matches more than "
+                    "one subnet" % name)
+        return self._get_metadata('subnet:' + name, lookup)
 
     def _find_image_id(self, image_id):
         """Finds an image id to a given id or name.
@@ -609,21 +802,17 @@ class BotoCloudProvider(AbstractCloudProvider):
         :param str image_id: name or id of image
         :return: str - identifier of image
         """
-        if not self._images:
-            connection = self._connect()
-            self._images = connection.get_all_images()
-
-        image_id_cloud = None
-        for i in self._images:
-            if i.id == image_id or i.name == image_id:
-                image_id_cloud = i.id
-                break
-
-        if image_id_cloud:
-            return image_id_cloud
-        else:
+        def lookup():
+            if not self._images:
+                connection = self._connect()
+                self._images = connection.get_all_images()
+
+            for i in self._images:
+                if i.id == image_id or i.name == image_id:
+                    return i.id
             raise ImageError(
                 "Could not find given image id `%s`" % image_id)
+        return self._get_metadata('image:' + image_id, lookup)
 
     def __getstate__(self):
         d = self.__dict__.copy()
@@ -635,3 +824,4 @@ class BotoCloudProvider(AbstractCloudProvider):
         self.__dict__ = state
         self._ec2_connection = None
         self._vpc_connection = None
+        self._start_params_cache = {}
@@ -29,9 +29,8 @@ import collections
 import copy
 import httplib2
 import os
-import random
+import re
 import threading
-import time
 import types
 import uuid
 
@@ -46,6 +45,7 @@ from oauth2client.tools import argparser
 # Elasticluster imports
 from elasticluster import log
 from elasticluster.providers import AbstractCloudProvider
+from elasticluster.utils import Backoff
 from elasticluster.exceptions import ImageError, InstanceError, InstanceNotFoundError, CloudProviderError
 
 
@@ -87,6 +87,9 @@ class GoogleCloudProvider(AbstractCloudProvider):
     """
     __gce_lock = threading.Lock()
 
+    # max number of instances in a `bulkInsert` request
+    max_instances_per_request = 1000
+
     def __init__(self,
                  gce_client_id,
                  gce_client_secret,
@@ -183,11 +186,12 @@ class GoogleCloudProvider(AbstractCloudProvider):
 
         gce = self._connect()
 
+        # poll quickly at first, then back off up to `wait` seconds
+        backoff = Backoff(cap=wait)
         status = response['status']
         while status != 'DONE' and response:
-            # wait a random amount of time (up to `wait` seconds)
             if wait:
-                time.sleep(1 + random.randrange(wait))
+                backoff.sleep()
 
             operation_id = response['name']
 
@@ -302,6 +306,99 @@ class GoogleCloudProvider(AbstractCloudProvider):
 
         :return: str - instance id of the started instance
         """
+        if node_name:
+            instance_id = self._make_instance_name(node_name)
+        else:
+            instance_id = 'elasticluster-%s' % uuid.uuid4()
+        instance = self._make_instance_body(
+            instance_id, public_key_path, flavor, image_id, image_userdata,
+            username, boot_disk_type, boot_disk_size, tags, scheduling,
+            accelerator_count, accelerator_type, allow_project_ssh_keys,
+            min_cpu_platform)
+
+        # create the instance
+        gce = self._connect()
+        request = gce.instances().insert(
+            project=self._project_id, body=instance, zone=self._zone)
+        try:
+            response = self._retry_throttled(self._execute_request, request)
+            response = self._wait_until_done(response)
+            self._check_response(response)
+            return instance_id
+        except (HttpError, CloudProviderError) as e:
+            log.error("Error creating instance `%s`" % e)
+            raise InstanceError("Error creating instance `%s`" % e)
+
+    def start_instances(self, count, key_name, public_key_path,
+                        private_key_path, security_group, flavor, image_id,
+                        image_userdata, username=None, node_names=None,
+                        boot_disk_type='pd-standard',
+                        boot_disk_size=10,
+                        tags=None,
+                        scheduling=None,
+                        accelerator_count=0,
+                        accelerator_type='default',
+                        allow_project_ssh_keys=True,
+                        min_cpu_platform=None,
+                        **kwargs):
+        """
+        Start `count` identical instances with a single `bulkInsert` request.
+
+        The request either creates all instances or none of them.
+        See `start_instance`:meth: for the GCE-specific parameters,
+        and `AbstractCloudProvider.start_instances`:meth: for the
+        meaning of the other parameters and of the return value.
+        """
+        if node_names is None:
+            node_names = ['elasticluster-%s' % uuid.uuid4()
+                          for _ in range(count)]
+        instance_ids = [self._make_instance_name(name) for name in node_names]
+
+        properties = self._make_instance_body(
+            None, public_key_path, flavor, image_id, image_userdata,
+            username, boot_disk_type, boot_disk_size, tags, scheduling,
+            accelerator_count, accelerator_type, allow_project_ssh_keys,
+            min_cpu_platform)
+        # instance properties take resource names, not URLs
+        properties['machineType'] = flavor
+        properties['disks'][0]['initializeParams']['diskType'] = boot_disk_type
+        for accelerator in properties.get('guestAccelerators', []):
+            accelerator['acceleratorType'] = (
+                accelerator['acceleratorType'].split('/')[-1])
+
+        gce = self._connect()
+        request = gce.instances().bulkInsert(
+            project=self._project_id, zone=self._zone, body={
+                'count': count,
+                'instanceProperties': properties,
+                'perInstanceProperties': dict(
+                    (instance_id, {}) for instance_id in instance_ids),
+            })
+        try:
+            response = self._retry_throttled(self._execute_request, request)
+            response = self._wait_until_done(response)
+            self._check_response(response)
+            return instance_ids
+        except (HttpError, CloudProviderError) as e:
+            log.error("Error creating instances `%s`" % e)
+            raise InstanceError("Error creating instances `%s`" % e)
+
+    @staticmethod
+    def _make_instance_name(node_name):
+        # GCE doesn't allow "_"
+        return node_name.lower().replace('_', '-')
+
+    def _make_instance_body(self, instance_id, public_key_path, flavor,
+                            image_id, image_userdata, username,
+                            boot_disk_type, boot_disk_size, tags, scheduling,
+                            accelerator_count, accelerator_type,
+                            allow_project_ssh_keys, min_cpu_platform):
+        """
+        Return the description of a VM to pass to the GCE API.
+
+        If `instance_id` is ``None``, the VM and disk names are left
+        out, as needed for the ``instanceProperties`` of a bulk insert.
+        """
         # construct URLs
         project_url = '%s%s' % (GCE_URL, self._project_id)
         machine_type_url = '%s/zones/%s/machineTypes/%s' \
@@ -364,13 +461,7 @@ class GoogleCloudProvider(AbstractCloudProvider):
             })
 
         # construct the request body
-        if node_name:
-            instance_id = node_name.lower().replace('_', '-')  # GCE doesn't allow "_"
-        else:
-            instance_id = 'elasticluster-%s' % uuid.uuid4()
-
         instance = {
-            'name': instance_id,
             'machineType': machine_type_url,
             'tags': {
               'items': tags,
@@ -381,7 +472,6 @@ class GoogleCloudProvider(AbstractCloudProvider):
                 'boot': 'true',
                 'type': 'PERSISTENT',
                 'initializeParams' : {
-                    'diskName': "%s-disk" % instance_id,
                     'diskType': boot_disk_type_url,
                     'diskSizeGb': boot_disk_size_gb,
                     'sourceImage': image_url,
@@ -404,6 +494,11 @@ class GoogleCloudProvider(AbstractCloudProvider):
             }
         }
 
+        if instance_id is not None:
+            instance['name'] = instance_id
+            instance['disks'][0]['initializeParams']['diskName'] = (
+                "%s-disk" % instance_id)
+
         if min_cpu_platform is not None:
             instance['minCpuPlatform'] = min_cpu_platform
 
@@ -427,7 +522,7 @@ class GoogleCloudProvider(AbstractCloudProvider):
             log.debug(
                 "VM instance `%s`:"
                 " Requesting %d accelerator%s of type '%s'",
-                instance_id, accelerator_count,
+                instance_id or '(bulk)', accelerator_count,
                 ('s' if accelerator_count > 1 else ''),
                 accelerator_type_url)
             instance['guestAccelerators'] = [
@@ -441,18 +536,7 @@ class GoogleCloudProvider(AbstractCloudProvider):
             instance['scheduling']['onHostMaintenance'] = 'TERMINATE'
             instance['scheduling']['automaticRestart'] = True
 
-        # create the instance
-        gce = self._connect()
-        request = gce.instances().insert(
-            project=self._project_id, body=instance, zone=self._zone)
-        try:
-            response = self._execute_request(request)
-            response = self._wait_until_done(response)
-            self._check_response(response)
-            return instance_id
-        except (HttpError, CloudProviderError) as e:
-            log.error("Error creating instance `%s`" % e)
-            raise InstanceError("Error creating instance `%s`" % e)
+        return instance
 
     def stop_instance(self, instance_id):
         """Stops the instance gracefully.
@@ -494,19 +578,23 @@ class GoogleCloudProvider(AbstractCloudProvider):
         """
         gce = self._connect()
 
+        items = []
         try:
-            request = gce.instances().list(
+            instances = gce.instances()
+            request = instances.list(
                 project=self._project_id, filter=filter, zone=self._zone)
-            response = self._execute_request(request)
-            self._check_response(response)
+            # results come in pages of (by default) 500 instances
+            while request is not None:
+                response = self._execute_request(request)
+                self._check_response(response)
+                if not response:
+                    break
+                items.extend(response.get('items', []))
+                request = instances.list_next(request, response)
         except (HttpError, CloudProviderError) as e:
             raise InstanceError("could not retrieve all instances on the "
-                                "cloud: ``" % e)
-
-        if response and 'items' in response:
-            return response['items']
-        else:
-            return list()
+                                "cloud: `%s`" % e)
+        return items
 
     def get_ips(self, instance_id):
         """Retrieves the ip addresses (public) from the cloud
@@ -564,6 +652,38 @@ class GoogleCloudProvider(AbstractCloudProvider):
                 return True
         return False
 
+    def get_instances_status(self, instance_ids):
+        """
+        Return running state and IP addresses of the given instances.
+
+        All instances are looked up with a single (paged) listing,
+        restricted to the names starting with the common prefix of
+        `instance_ids`; see
+        :meth:`AbstractCloudProvider.get_instances_status` for a
+        description of the return value.
+        """
+        prefix = os.path.commonprefix(list(instance_ids))
+        if prefix:
+            filter = ('name eq "%s.*"' % re.escape(prefix))
+        else:
+            filter = None
+        items = dict((item['name'], item)
+                     for item in self.list_instances(filter=filter))
+        result = []
+        for instance_id in instance_ids:
+            item = items.get(instance_id)
+            ip_public = None
+            if item and item['status'] == 'RUNNING':
+                interfaces = item.get('networkInterfaces', [])
+                if interfaces and 'accessConfigs' in interfaces[0]:
+                    ip_public = interfaces[0]['accessConfigs'][0].get('natIP')
+            if ip_public:
+                result.append((True, [ip_public]))
+            else:
+                # not running, or public IP address not yet assigned
+                result.append((False, None))
+        return result
+
     def _check_response(self, response):
         """Checks the response from GCE for error messages.
 
@@ -15,12 +15,13 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import json
 import os
 from tempfile import NamedTemporaryFile
 
 import paramiko
 from paramiko import SSHException
-from libcloud.compute.base import NodeAuthSSHKey, NodeAuthPassword
+from libcloud.compute.base import NodeAuthSSHKey, NodeAuthPassword, NodeSize
 from libcloud.compute.providers import get_driver
 from libcloud.compute.types import NodeState, Provider
 
@@ -144,26 +145,41 @@ class LibCloudProvider(AbstractCloudProvider):
         else:
             options['auth'] = NodeAuthPassword(options.get('image_user_password'))
 
-        node = self.driver.create_node(**options)
+        node = self._retry_throttled(self.driver.create_node, **options)
         if node:
             return node.id
         return None
 
     def _get_flavor_by_name(self, name):
-        flavors = [
-            flavor for flavor in self.driver.list_sizes()
-            if (flavor.name == name or flavor.id == name)
-        ]
-        if flavors:
-            flavor = flavors[0]
-            if len(flavors) > 1:
-                log.warn(
-                    "%d flavors with name '%s' found!"
-                    " using first returned one: %s",
-                    len(flavors), flavor)
-            return flavor
-        else:
-            raise FlavorError("Cannot find flavor `%s`" % name)
+        def lookup():
+            flavors = [
+                flavor for flavor in self.driver.list_sizes()
+                if (flavor.name == name or flavor.id == name)
+            ]
+            if flavors:
+                flavor = flavors[0]
+                if len(flavors) > 1:
+                    log.warn(
+                        "%d flavors with name '%s' found!"
+                        " using first returned one: %s",
+                        len(flavors), flavor)
+                attrs = dict((attr, getattr(flavor, attr))
+                             for attr in self._FLAVOR_ATTRS)
+                # some drivers need `extra`, e.g., GCE's `selfLink`
+                try:
+                    json.dumps(flavor.extra)
+                    attrs['extra'] = flavor.extra
+                except (TypeError, ValueError):
+                    pass
+                return attrs
+            else:
+                raise FlavorError("Cannot find flavor `%s`" % name)
+        # rebuild the `NodeSize` object from its cached attributes
+        return NodeSize(driver=self.driver,
+                        **self._get_metadata('flavor:' + name, lookup))
+
+    _FLAVOR_ATTRS = ('id', 'name', 'ram', 'disk', 'bandwidth', 'price')
+    """Attributes of a libcloud `NodeSize` to keep in the metadata cache."""
 
     def is_instance_running(self, instance_id):
         instance = self.__get_instance(instance_id)
@@ -171,6 +187,24 @@ class LibCloudProvider(AbstractCloudProvider):
             return False
         return instance.state == NodeState.RUNNING
 
+    def get_instances_status(self, instance_ids):
+        """
+        Return running state and IP addresses of the given instances.
+
+        All instances are looked up with a single `list_nodes()` call;
+        see :meth:`AbstractCloudProvider.get_instances_status` for a
+        description of the return value.
+        """
+        instances = dict((node.id, node) for node in self.driver.list_nodes())
+        result = []
+        for instance_id in instance_ids:
+            instance = instances.get(instance_id)
+            if instance and instance.state == NodeState.RUNNING:
+                result.append((True, instance.public_ips + instance.private_ips))
+            else:
+                result.append((False, None))
+        return result
+
     def stop_instance(self, instance_id):
         instance = self.__get_instance(instance_id)
         if not instance:
@@ -27,9 +27,9 @@ __author__ = ', '.join([
 
 # System imports
 import os
+import re
 import threading
 from warnings import warn
-from time import sleep
 
 # External modules
 
@@ -79,7 +79,7 @@ from paramiko.ssh_exception import SSHException
 
 # Elasticluster imports
 from elasticluster import log
-from elasticluster.utils import memoize
+from elasticluster.utils import memoize, wait_until
 from elasticluster.providers import AbstractCloudProvider
 from elasticluster.exceptions import (
     ConfigurationError,
@@ -105,6 +105,27 @@ value *must* be provided.
 """
 
 
+_NOVA_MULTI_CREATE_SUFFIX = re.compile(r'-([0-9]+)$')
+
+
+def _launch_order(vm):
+    """
+    Sort key for servers created by a single multi-instance request.
+
+    The ``launch_index`` attribute is only visible to cloud admins;
+    otherwise, use the numeric suffix that Nova appends to the name
+    of each server (by default, ``NAME-1``, ``NAME-2``, ...).  If
+    neither is available, all keys compare equal and the order of
+    the server list is kept.
+    """
+    index = getattr(vm, 'OS-EXT-SRV-ATTR:launch_index', None)
+    if index is not None:
+        return int(index)
+    match = _NOVA_MULTI_CREATE_SUFFIX.search(vm.name or '')
+    if match:
+        return int(match.group(1))
+    return 0
+
 
 class OpenStackCloudProvider(AbstractCloudProvider):
     """
@@ -136,6 +157,11 @@ class OpenStackCloudProvider(AbstractCloudProvider):
     Lock used for node startup.
     """
 
+    max_instances_per_request = 50
+    """
+    Max number of servers to request with a single Nova API call.
+    """
+
     def __init__(self, username, password, project_name, auth_url,
                  user_domain_name="default", project_domain_name="default",
                  region_name=None, storage_path=None,
@@ -188,6 +214,7 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         self.request_floating_ip = request_floating_ip
         self._instances = {}
         self._cached_instances = {}
+        self._start_params_cache = {}  # results of `_prepare_start()`
 
     @staticmethod
     def _get_os_config_value(thing, value, varnames, default=_NO_DEFAULT):
@@ -398,10 +425,8 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         The following tasks are done to start an instance:
 
         * establish a connection to the cloud web service
-        * check ssh keypair and upload it if it does not yet exist. This is
-          a locked process, since this function might be called in multiple
-          threads and we only want the key to be stored once.
-        * check if the security group exists
+        * check ssh keypair, security groups, image and flavor (unless
+          already done by `preflight`:meth:, see `_prepare_start`:meth:)
         * run the instance with the given properties
 
         :param str key_name: name of the ssh key to connect
@@ -420,31 +445,13 @@ class OpenStackCloudProvider(AbstractCloudProvider):
 
         vm_start_args = {}
 
-        log.debug("Checking keypair `%s` ...", key_name)
-        with OpenStackCloudProvider.__node_start_lock:
-            self._check_keypair(key_name, public_key_path, private_key_path)
+        security_groups, flavor = self._prepare_start(
+            key_name, public_key_path, private_key_path,
+            security_group, flavor, image_id)
         vm_start_args['key_name'] = key_name
-
-        security_groups = [sg.strip() for sg in security_group.split(',')]
-        self._check_security_groups(security_groups)
         vm_start_args['security_groups'] = security_groups
-
-
-        # Check if the image id is present.
-        if image_id not in [img.id for img in self._get_images()]:
-            raise ImageError(
-                    "No image found with ID `{0}` in project `{1}` of cloud {2}"
-                    .format(image_id, self._os_tenant_name, self._os_auth_url))
         vm_start_args['userdata'] = image_userdata
 
-        # Check if the flavor exists
-        flavors = [fl for fl in self._get_flavors() if fl.name == flavor]
-        if not flavors:
-            raise FlavorError(
-                "No flavor found with name `{0}` in project `{1}` of cloud {2}"
-                .format(flavor, self._os_tenant_name, self._os_auth_url))
-        flavor = flavors[0]
-
         network_ids = [net_id.strip()
                        for net_id in kwargs.pop('network_ids', '').split(',')]
         if network_ids:
@@ -479,13 +486,10 @@ class OpenStackCloudProvider(AbstractCloudProvider):
                 volume_type=kwargs.pop('boot_disk_type'))
 
             # wait for volume to come up
-            volume_available = False
-            while not volume_available:
-                for v in self._get_volumes():
-                    if v.name == volume_name and v.status == 'available':
-                        volume_available = True
-                        break
-                sleep(1)  # FIXME: hard-coded waiting time
+            wait_until(
+                lambda: any(v.name == volume_name and v.status == 'available'
+                            for v in self._get_volumes()),
+                cap=10)
 
             # ok, use volume as VM disk
             vm_start_args['block_device_mapping'] = {
@@ -499,10 +503,103 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         # due to some `nova_client.servers.create()` implementation weirdness,
         # the first three args need to be spelt out explicitly and cannot be
         # conflated into `**vm_start_args`
-        vm = self.nova_client.servers.create(node_name, image_id, flavor, **vm_start_args)
+        vm = self._retry_throttled(
+            self.nova_client.servers.create,
+            node_name, image_id, flavor, **vm_start_args)
+        self._instances[vm.id] = vm
 
         # allocate and attach a floating IP, if requested
         if self.request_floating_ip:
+            self._request_floating_ip(vm, network_ids)
+
+        return vm.id
+
+    def start_instances(self, count, key_name, public_key_path,
+                        private_key_path, security_group, flavor, image_id,
+                        image_userdata, username=None, node_names=None,
+                        **kwargs):
+        """
+        Start `count` identical instances with a single Nova request.
+
+        Nova is asked for at least one and at most `count` servers;
+        since it names them after a common prefix, each server is
+        then renamed after the corresponding node.  Nodes booting from
+        a volume are started one by one, as in `start_instance`:meth:,
+        since each needs its own volume.
+
+        See `AbstractCloudProvider.start_instances`:meth: for the
+        meaning of parameters and return value.
+        """
+        if 'boot_disk_size' in kwargs:
+            return AbstractCloudProvider.start_instances(
+                self, count, key_name, public_key_path, private_key_path,
+                security_group, flavor, image_id, image_userdata,
+                username=username, node_names=node_names, **kwargs)
+
+        self._init_os_api()
+
+        security_groups, flavor = self._prepare_start(
+            key_name, public_key_path, private_key_path,
+            security_group, flavor, image_id)
+
+        network_ids = [net_id.strip()
+                       for net_id in kwargs.pop('network_ids', '').split(',')]
+        if network_ids:
+            nics = [{'net-id': net_id, 'v4-fixed-ip': ''}
+                    for net_id in network_ids ]
+        else:
+            nics = None
+
+        if node_names is None:
+            node_names = [None] * count
+        reservation = self._retry_throttled(
+            self.nova_client.servers.create,
+            node_names[0], image_id, flavor,
+            key_name=key_name, security_groups=security_groups,
+            userdata=image_userdata, nics=nics,
+            min_count=1, max_count=count, return_reservation_id=True)
+        try:
+            vms = self._retry_throttled(
+                self.nova_client.servers.list,
+                search_opts={'reservation_id': reservation.reservation_id})
+        except Exception as err:
+            log.error("Could not list the VMs started with reservation ID %s;"
+                      " they are not part of the cluster and must be"
+                      " deleted manually: %s",
+                      reservation.reservation_id, err)
+            raise
+        vms.sort(key=_launch_order)
+
+        instance_ids = [None] * count
+        for index, vm in enumerate(vms[:count]):
+            self._instances[vm.id] = vm
+            instance_ids[index] = vm.id
+        # VMs have been created at this point: errors in renaming them
+        # or attaching IPs must not make the caller forget their IDs
+        for index, vm in enumerate(vms[:count]):
+            node_name = node_names[index]
+            if node_name and vm.name != node_name:
+                try:
+                    self._retry_throttled(
+                        self.nova_client.servers.update, vm, name=node_name)
+                except Exception as err:
+                    log.warning("Could not rename VM %s to `%s`: %s",
+                                vm.id, node_name, err)
+            if self.request_floating_ip:
+                self._request_floating_ip(vm, network_ids)
+        if len(vms) < count:
+            log.warning("Only %d out of %d requested instances were started.",
+                        len(vms), count)
+        return instance_ids
+
+    def _request_floating_ip(self, vm, network_ids):
+        """
+        Allocate and attach a floating IP to `vm`, unless it has one already.
+
+        Errors are logged and otherwise ignored, so that the VM is
+        not lost track of; it might then be unreachable via SSH.
+        """
+        try:
             # We need to list the floating IPs for this instance
             try:
                 # python-novaclient <8.0.0
@@ -513,10 +610,71 @@ class OpenStackCloudProvider(AbstractCloudProvider):
             # allocate new floating IP if none given
             if not floating_ips:
                 self._allocate_address(vm, network_ids)
+        except Exception as err:
+            log.error("Could not attach a floating IP to VM %s: %s",
+                      vm.id, err)
 
-        self._instances[vm.id] = vm
+    def preflight(self, node_specs):
+        """
+        Check keypairs, security groups, images and flavors of nodes to start.
 
-        return vm.id
+        See `AbstractCloudProvider.preflight`:meth: for the meaning of
+        `node_specs`.
+        """
+        for spec in node_specs:
+            self._prepare_start(
+                spec['key_name'], spec['public_key_path'],
+                spec['private_key_path'], spec['security_group'],
+                spec['flavor'], spec['image_id'])
+
+    def _prepare_start(self, key_name, public_key_path, private_key_path,
+                       security_group, flavor, image_id):
+        """
+        Check the resources needed to start a VM, creating them if needed.
+
+        Return a pair *(list of security group names, flavor ID)*.
+        The result is cached, so checks are only done once for each
+        set of parameters; only the first call for each set needs to
+        acquire a lock.
+        """
+        cache_key = (key_name, security_group, flavor, image_id)
+        try:
+            return self._start_params_cache[cache_key]
+        except KeyError:
+            pass
+        with OpenStackCloudProvider.__node_start_lock:
+            if cache_key not in self._start_params_cache:
+                self._init_os_api()
+
+                log.debug("Checking keypair `%s` ...", key_name)
+                self._check_keypair(key_name, public_key_path, private_key_path)
+
+                security_groups = [sg.strip() for sg in security_group.split(',')]
+                self._check_security_groups(security_groups)
+
+                # Check if the image id is present.
+                image_ids = self._get_metadata(
+                    'image_ids',
+                    lambda: [img.id for img in self._get_images()],
+                    check=(lambda image_ids: image_id in image_ids))
+                if image_id not in image_ids:
+                    raise ImageError(
+                        "No image found with ID `{0}` in project `{1}` of cloud {2}"
+                        .format(image_id, self._os_tenant_name, self._os_auth_url))
+
+                # Check if the flavor exists
+                flavor_ids = self._get_metadata(
+                    'flavor_ids',
+                    lambda: dict((fl.name, fl.id) for fl in self._get_flavors()),
+                    check=(lambda flavor_ids: flavor in flavor_ids))
+                if flavor not in flavor_ids:
+                    raise FlavorError(
+                        "No flavor found with name `{0}` in project `{1}` of cloud {2}"
+                        .format(flavor, self._os_tenant_name, self._os_auth_url))
+
+                self._start_params_cache[cache_key] = (
+                    security_groups, flavor_ids[flavor])
+            return self._start_params_cache[cache_key]
 
     def stop_instance(self, instance_id):
         """Stops the instance gracefully.
@@ -550,6 +708,39 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         instance = self._load_instance(instance_id, force_reload=True)
         return instance.status == 'ACTIVE'
 
+    def get_instances_status(self, instance_ids):
+        """
+        Return running state and IP addresses of the given instances.
+
+        All instances are looked up by listing the project's servers
+        (all pages of them); instances that are still missing from the
+        list are then queried one by one.  See
+        :meth:`AbstractCloudProvider.get_instances_status` for a
+        description of the return value.
+        """
+        self._init_os_api()
+        vms = dict((vm.id, vm) for vm in self.nova_client.servers.list(limit=-1))
+        # refresh caches
+        self._cached_instances = vms
+        result = []
+        for instance_id in instance_ids:
+            vm = vms.get(instance_id)
+            if vm is None:
+                # the server list might be stale or truncated
+                try:
+                    vm = self.nova_client.servers.get(instance_id)
+                except NotFound:
+                    pass
+                else:
+                    self._cached_instances[instance_id] = vm
+            if vm is not None:
+                self._instances[instance_id] = vm
+            if vm is not None and vm.status == 'ACTIVE':
+                result.append((True, sum(vm.networks.values(), [])))
+            else:
+                result.append((False, None))
+        return result
+
     # Protected methods
 
     def _check_keypair(self, name, public_key_path, private_key_path):
@@ -630,13 +821,17 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         """
         self._init_os_api()
         log.debug("Checking existence of security group(s) %s ...", names)
-        try:
-            # python-novaclient < 8.0.0
-            security_groups = self.nova_client.security_groups.list()
-            existing = set(sg.name for sg in security_groups)
-        except AttributeError:
-            security_groups = self.neutron_client.list_security_groups()['security_groups']
-            existing = set(sg[u'name'] for sg in security_groups)
+        def lookup():
+            try:
+                # python-novaclient < 8.0.0
+                security_groups = self.nova_client.security_groups.list()
+                return [sg.name for sg in security_groups]
+            except AttributeError:
+                security_groups = self.neutron_client.list_security_groups()['security_groups']
+                return [sg[u'name'] for sg in security_groups]
+        existing = set(self._get_metadata(
+            'security_groups', lookup,
+            check=(lambda existing: set(names).issubset(existing))))
 
         # TODO: We should be able to create the security group if it
         # doesn't exist and at least add a rule to accept ssh access.
@@ -720,7 +915,7 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         if instance_id not in self._cached_instances:
             # Refresh the cache, just in case
             self._cached_instances = dict(
-                (vm.id, vm) for vm in self.nova_client.servers.list())
+                (vm.id, vm) for vm in self.nova_client.servers.list(limit=-1))
 
         if instance_id in self._cached_instances:
             inst = self._cached_instances[instance_id]
@@ -829,6 +1024,7 @@ class OpenStackCloudProvider(AbstractCloudProvider):
         self._volume_api_version = state.get('volume_api_version', DEFAULT_VOLUME_API_VERSION),
         self._instances = {}
         self._cached_instances = {}
+        self._start_params_cache = {}
         # these will be initialized later by `_init_os_api()`
         self.nova_client = None
         self.neutron_client = None
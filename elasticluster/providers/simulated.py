@@ -0,0 +1,345 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018 University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+In-process simulation of a cloud.
+
+No VM is ever started: instances only exist in the memory of the
+ElastiCluster process, and their behavior (API latency, boot time,
+failures, quota and throttling) is drawn from configurable random
+distributions.  This is meant for testing and benchmarking the
+cluster startup logic at scale, without spending money on a real
+cloud.
+"""
+
+# stdlib imports
+from collections import defaultdict
+import random
+import threading
+import time
+
+# ElastiCluster imports
+from elasticluster import log
+from elasticluster.exceptions import ConfigurationError, InstanceNotFoundError
+from elasticluster.providers import AbstractCloudProvider
+from elasticluster.utils import TokenBucket
+
+
+class SimulatedCloudError(Exception):
+    """
+    Error returned by the simulated cloud API.
+
+    Attributes mimic those set by real cloud client libraries, so that,
+    e.g., throttling errors are recognized as such by
+    `elasticluster.providers.is_throttling_error`.
+    """
+
+    def __init__(self, msg, error_code, http_status, retry_after=None):
+        super(SimulatedCloudError, self).__init__(msg)
+        self.error_code = error_code
+        self.http_status = http_status
+        if retry_after is not None:
+            self.retry_after = retry_after
+
+
+def make_distribution(spec, rng=random):
+    """
+    Return a function that samples the random distribution described by `spec`.
+
+    The specification is a string ``NAME:ARG,ARG...``; distributions
+    and their arguments are:
+
+    * ``constant:VALUE``
+    * ``uniform:LOW,HIGH``
+    * ``normal:MEAN,STDDEV`` (negative samples are clipped to 0)
+    * ``lognormal:MU,SIGMA`` (parameters of the underlying normal)
+    * ``exponential:MEAN``
+
+    A plain number is short for ``constant:VALUE``::
+
+      >>> make_distribution('2.5')()
+      2.5
+      >>> 10 <= make_distribution('uniform:10,20')() <= 20
+      True
+
+    :raise ConfigurationError: if `spec` cannot be parsed.
+    """
+    name, _, args = str(spec).partition(':')
+    name = name.strip()
+    try:
+        if not args:
+            args, name = name, 'constant'
+        params = [float(arg) for arg in args.split(',')]
+    except ValueError:
+        raise ConfigurationError(
+            "Invalid distribution `{0}`: arguments must be numbers"
+            .format(spec))
+    factories = {
+        'constant': (1, lambda value: (lambda: value)),
+        'uniform': (2, lambda lo, hi: (lambda: rng.uniform(lo, hi))),
+        'normal': (2, lambda mu, sigma: (
+            lambda: max(0.0, rng.normalvariate(mu, sigma)))),
+        'lognormal': (2, lambda mu, sigma: (
+            lambda: rng.lognormvariate(mu, sigma))),
+        'exponential': (1, lambda mean: (
+            lambda: rng.expovariate(1.0 / mean) if mean > 0 else 0.0)),
+    }
+    if name not in factories:
+        raise ConfigurationError(
+            "Unknown distribution `{0}` in `{1}`; valid names are: {2}"
+            .format(name, spec, ', '.join(sorted(factories))))
+    nargs, factory = factories[name]
+    if len(params) != nargs:
+        raise ConfigurationError(
+            "Distribution `{0}` takes {1} argument(s), got `{2}`"
+            .format(name, nargs, spec))
+    return factory(*params)
+
+
+class SimulatedCloudProvider(AbstractCloudProvider):
+    """
+    Cloud provider simulating VMs in memory.
+
+    Time-valued parameters are distribution specifications, as
+    understood by `make_distribution`:func:, and are in seconds.
+
+    :param str api_latency: time taken by each API call
+    :param str boot_time: time from a start request until the VM is
+        reported running
+    :param str ssh_delay: time from the VM running until it accepts
+        SSH connections
+    :param str stop_time: time from a stop request until the VM is
+        no longer reported running
+    :param float failure_rate: probability that a request to start a
+        VM fails
+    :param float boot_failure_rate: probability that a VM is created
+        but never finishes booting
+    :param int quota: max number of VMs that can exist at the same
+        time; ``0`` means no limit
+    :param float throttle_rate: max sustained rate of API calls per
+        second; calls in excess are rejected with a "request limit
+        exceeded" error.  ``0`` means no limit.
+    :param int throttle_burst: number of calls that can exceed
+        `throttle_rate` in a short burst
+    :param int max_instances_per_request: max number of VMs started
+        by a single call to `start_instances`:meth:
+    :param str ssh_address: if given, report this (``HOST`` or
+        ``HOST:PORT``) as the IP address of every VM, so that SSH
+        probes reach a real stand-in server; otherwise, fake private
+        IP addresses are used and SSH connections must be simulated
+        as well (see `connect_stub`:func:)
+    :param seed: seed for the random number generator, to make runs
+        reproducible
+    """
+
+    def __init__(self, api_latency='0', boot_time='uniform:20,60',
+                 ssh_delay='0', stop_time='0', failure_rate=0.0,
+                 boot_failure_rate=0.0, quota=0, throttle_rate=0.0,
+                 throttle_burst=10, max_instances_per_request=1,
+                 ssh_address=None, seed=None, storage_path=None, **extra):
+        self._rng = random.Random(seed)
+        self._api_latency = make_distribution(api_latency, self._rng)
+        self._boot_time = make_distribution(boot_time, self._rng)
+        self._ssh_delay = make_distribution(ssh_delay, self._rng)
+        self._stop_time = make_distribution(stop_time, self._rng)
+        self.failure_rate = float(failure_rate)
+        self.boot_failure_rate = float(boot_failure_rate)
+        self.quota = int(quota)
+        self.max_instances_per_request = max(1, int(max_instances_per_request))
+        self.ssh_address = ssh_address
+        self._throttle = (TokenBucket(float(throttle_rate), int(throttle_burst))
+                          if float(throttle_rate) > 0 else None)
+
+        # all state below is protected by `self._lock`
+        self._lock = threading.Lock()
+        self._instances = {}
+        self._serial = 0
+        #: number of calls to each API method (including rejected ones)
+        self.api_calls = defaultdict(int)
+        #: number of API calls rejected because of throttling
+        self.throttled_calls = 0
+
+    def _api_call(self, name):
+        """
+        Account for a call to API method `name`, and simulate its latency.
+        """
+        with self._lock:
+            self.api_calls[name] += 1
+            throttled = (self._throttle is not None
+                         and not self._throttle.try_acquire())
+            if throttled:
+                self.throttled_calls += 1
+            latency = self._api_latency()
+        if latency > 0:
+            time.sleep(latency)
+        if throttled:
+            raise SimulatedCloudError(
+                "Request limit exceeded.", 'RequestLimitExceeded', 429,
+                retry_after=1.0 / self._throttle.rate)
+
+    def _create_instance(self, node_name):
+        # must be called while holding `self._lock`
+        if self._rng.random() < self.failure_rate:
+            raise SimulatedCloudError(
+                "Simulated failure starting VM `{0}`".format(node_name),
+                'InternalError', 500)
+        if self.quota and self._count_instances() >= self.quota:
+            raise SimulatedCloudError(
+                "Quota of {0} instances exceeded".format(self.quota),
+                'InstanceLimitExceeded', 403)
+        self._serial += 1
+        instance_id = 'sim-{0:08x}'.format(self._serial)
+        now = time.time()
+        running_at = now + self._boot_time()
+        self._instances[instance_id] = {
+            'name': node_name,
+            'ips': [self.ssh_address or '10.{0}.{1}.{2}'.format(
+                (self._serial >> 16) & 0xff,
+                (self._serial >> 8) & 0xff,
+                self._serial & 0xff)],
+            'running_at': (None if self._rng.random() < self.boot_failure_rate
+                           else running_at),
+            'reachable_at': running_at + self._ssh_delay(),
+            'stopped_at': None,
+        }
+        log.debug("Simulated VM `%s` created with ID %s", node_name, instance_id)
+        return instance_id
+
+    def _count_instances(self):
+        now = time.time()
+        return sum(1 for vm in self._instances.itervalues()
+                   if vm['stopped_at'] is None or vm['stopped_at'] > now)
+
+    def _get_instance(self, instance_id):
+        with self._lock:
+            try:
+                return self._instances[instance_id]
+            except KeyError:
+                raise InstanceNotFoundError(
+                    "No simulated VM with ID {0}".format(instance_id))
+
+    @staticmethod
+    def _is_running(vm, now):
+        if vm['stopped_at'] is not None and vm['stopped_at'] <= now:
+            return False
+        return vm['running_at'] is not None and vm['running_at'] <= now
+
+    def start_instance(self, key_name, public_key_path, private_key_path,
+                       security_group, flavor, image_id, image_userdata,
+                       username=None, node_name=None, **kwargs):
+        self._retry_throttled(self._api_call, 'start_instance')
+        with self._lock:
+            return self._create_instance(node_name)
+
+    def start_instances(self, count, key_name, public_key_path,
+                        private_key_path, security_group, flavor, image_id,
+                        image_userdata, username=None, node_names=None,
+                        **kwargs):
+        self._retry_throttled(self._api_call, 'start_instances')
+        if node_names is None:
+            node_names = [None] * count
+        instance_ids = []
+        last_error = None
+        with self._lock:
+            for node_name in node_names:
+                try:
+                    instance_ids.append(self._create_instance(node_name))
+                except SimulatedCloudError as err:
+                    log.debug("Could not start simulated VM `%s`: %s",
+                              node_name, err)
+                    instance_ids.append(None)
+                    last_error = err
+        if last_error and not any(instance_ids):
+            raise last_error
+        return instance_ids
+
+    def stop_instance(self, instance_id):
+        self._api_call('stop_instance')
+        vm = self._get_instance(instance_id)
+        with self._lock:
+            # `self._rng` is shared among threads: hold the lock
+            if vm['stopped_at'] is None:
+                vm['stopped_at'] = time.time() + self._stop_time()
+
+    def get_ips(self, instance_id):
+        self._api_call('get_ips')
+        return list(self._get_instance(instance_id)['ips'])
+
+    def is_instance_running(self, instance_id):
+        self._api_call('is_instance_running')
+        return self._is_running(self._get_instance(instance_id), time.time())
+
+    def get_instances_status(self, instance_ids):
+        self._api_call('get_instances_status')
+        now = time.time()
+        result = []
+        with self._lock:
+            for instance_id in instance_ids:
+                vm = self._instances.get(instance_id)
+                if vm and self._is_running(vm, now):
+                    result.append((True, list(vm['ips'])))
+                else:
+                    result.append((False, None))
+        return result
+
+    def preflight(self, node_specs):
+        self._api_call('preflight')
+
+    def is_reachable(self, instance_id):
+        """
+        Return ``True`` if the VM would accept SSH connections now.
+
+        This is not an API call, but a stand-in for network
+        connectivity; see `connect_stub`:func:.
+        """
+        vm = self._get_instance(instance_id)
+        now = time.time()
+        return self._is_running(vm, now) and vm['reachable_at'] <= now
+
+
+class _StubSSHClient(object):
+    """
+    Stand-in for the `paramiko.SSHClient` returned by `Node.connect`.
+    """
+
+    def get_host_keys(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def connect_stub(node, keyfile=None, timeout=5):
+    """
+    Replacement for `elasticluster.cluster.Node.connect` on simulated VMs.
+
+    Succeed if the node's simulated VM accepts SSH connections, without
+    any network traffic; e.g.::
+
+      with patch.object(Node, 'connect', connect_stub):
+          cluster.start()
+    """
+    try:
+        reachable = node._cloud_provider.is_reachable(node.instance_id)
+    except InstanceNotFoundError:
+        return None
+    if not reachable:
+        return None
+    if not node.preferred_ip and node.ips:
+        node.preferred_ip = node.ips[0]
+    node.record_event('reachable')
+    return _StubSSHClient()
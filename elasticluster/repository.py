@@ -21,12 +21,23 @@ import os
 import pickle
 from abc import ABCMeta, abstractmethod
 import glob
+import hashlib
 import json
+import sqlite3
 import yaml
 
+# use the C-accelerated parser and emitter, when available
+try:
+    from yaml import CSafeDumper as _YamlDumper, CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeDumper as _YamlDumper, SafeLoader as _YamlLoader
+
 # Elasticluster imports
 from elasticluster import log
 from elasticluster.exceptions import ClusterNotFound
+from elasticluster.utils import Struct
+
+from StringIO import StringIO
 
 def migrate_cluster(cluster):
     """Called when loading a cluster when it comes from an older version
@@ -95,6 +106,16 @@ class AbstractClusterRepository:
         """
         pass
 
+    def compact(self, cluster):
+        """Ensure the whole state of the cluster is in a single file.
+
+        Repositories that save changes incrementally should override
+        this; the default implementation does nothing.
+
+        :param cluster: cluster to compact
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        """
+        pass
 
 
 class MemRepository(AbstractClusterRepository):
@@ -143,16 +164,137 @@ class MemRepository(AbstractClusterRepository):
         del self.clusters[cluster.name]
 
 
+class ClusterIndex(object):
+    """
+    Summary of the clusters saved in a storage directory.
+
+    For each cluster, the index records its name, template, number
+    of nodes of each kind, storage format and the time its storage
+    files were last modified; this is enough for listing clusters
+    without loading them.  The index is kept in file
+    ``clusters.index`` in the storage directory, and updated by
+    `DiskRepository`:class: when a cluster is deleted, or saved with
+    a different template or number of nodes.  Saves that change
+    nothing else do not touch the index, so modification times
+    recorded there are usually out of date; they, and any entry
+    that has become stale otherwise (e.g., if a cluster file is
+    copied over by hand, or two processes update the index at the
+    same time), are refreshed by `MultiDiskRepository.get_summaries`.
+    """
+
+    filename = 'clusters.index'
+
+    def __init__(self, storage_path):
+        self.path = os.path.join(storage_path, self.filename)
+
+    @staticmethod
+    def summarize(cluster, file_format, mtime):
+        """Return the index entry for `cluster`."""
+        return {
+            'name': cluster.name,
+            'template': cluster.template,
+            'nodes': dict((kind, len(nodes))
+                          for kind, nodes in cluster.nodes.items()),
+            'format': file_format,
+            'mtime': mtime,
+        }
+
+    def load(self):
+        """
+        Return dictionary mapping cluster names to index entries.
+
+        Return ``None`` if the index file is missing or unreadable.
+        """
+        try:
+            with open(self.path, 'r') as index:
+                return json.load(index)['clusters']
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, entries):
+        """Replace the index contents with `entries`."""
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as index:
+            json.dump({'clusters': entries}, index, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def update(self, cluster, file_format, mtime):
+        """Add or update the entry for `cluster`."""
+        entries = self.load() or {}
+        entry = self.summarize(cluster, file_format, mtime)
+        if entries.get(cluster.name) != entry:
+            entries[cluster.name] = entry
+            self.save(entries)
+
+    def remove(self, name):
+        """Remove the entry for cluster `name`, if any."""
+        entries = self.load()
+        if entries and name in entries:
+            del entries[name]
+            self.save(entries)
+
+
 class DiskRepository(AbstractClusterRepository):
     """This is a generic repository class that assumes each cluster is
 saved on a file on disk. It only defines a few methods, to avoid
 duplication of code.
+
+    If `journal` is true, and the storage format supports it (see
+    `can_journal`), `save_or_update` does not rewrite the whole
+    cluster file each time; instead, it appends a record for each
+    node that changed since the last save to a "journal" file
+    (the cluster file name with ``.journal`` appended).  The
+    journal is merged back ("compacted") into the cluster file when
+    it grows larger than the cluster file itself, or when `compact`
+    is called.  Loading a cluster always replays its journal, if
+    there is one.
+
+    The first record of a journal holds the checksum of the cluster
+    file it applies to: if ElastiCluster is interrupted after a new
+    cluster file is written but before the old journal is removed,
+    the stale journal is ignored on the next load.
     """
 
-    def __init__(self, storage_path):
+    #: whether changes to clusters can be saved to a journal; journal
+    #: records are JSON, so the cluster state must be serializable
+    #: as such
+    can_journal = True
+
+    #: do not compact a journal smaller than this (in bytes)
+    journal_min_size = 64 * 1024
+
+    # cluster attributes not saved to the journal
+    _JOURNAL_OMIT = (
+        '_cloud_provider',
+        '_lock',
+        '_naming_policy',
+        '_nodes_by_name',
+        '_setup_provider',
+        '_startup_pipeline',
+        'nodes',
+        'repository',
+        'storage_file',
+    )
+
+    def __init__(self, storage_path, journal=False):
         storage_path = os.path.expanduser(storage_path)
         storage_path = os.path.expandvars(storage_path)
         self.storage_path = storage_path
+        self.journal = journal and self.can_journal
+        # cluster name -> state last written to disk, see `_remember`
+        self._saved = {}
+        # cluster name -> summary last written to the index, see `_update_index`
+        self._indexed = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_saved'] = {}
+        state['_indexed'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_indexed', {})
 
     def get_all(self):
         """Retrieves all clusters from the persistent state.
@@ -175,6 +317,9 @@ duplication of code.
         cluster_file = '%s.%s' % (name, self.file_ending)
         return os.path.join(self.storage_path, cluster_file)
 
+    def _get_journal_path(self, name):
+        return self._get_cluster_storage_path(name) + '.journal'
+
     def get(self, name):
         """Retrieves the cluster with the given name.
 
@@ -185,17 +330,24 @@ duplication of code.
 
         try:
             with open(path, 'r') as storage:
-                cluster = self.load(storage)
+                data = storage.read()
+                cluster = self.load(StringIO(data))
                 # Compatibility with previous version of Node
-                for node in sum(cluster.nodes.values(), []):
+                for node in cluster.iter_nodes():
                     if not hasattr(node, 'ips'):
                         log.debug("Monkey patching old version of `Node` class: %s", node.name)
                         node.ips = [node.ip_public, node.ip_private]
                         node.preferred_ip = None
                 cluster.storage_file = path
-                return cluster
         except IOError as ex:
             raise ClusterNotFound("Error accessing storage file %s: %s" % (path, ex))
+        journal_size = 0
+        if self.can_journal:
+            checksum = self._checksum(data)
+            journal_size = self._replay_journal(cluster, checksum)
+            if self.journal:
+                self._remember(cluster, len(data), journal_size, checksum)
+        return cluster
 
     def save_or_update(self, cluster):
         """Save or update the cluster to persistent state.
@@ -208,8 +360,20 @@ duplication of code.
 
         path = self._get_cluster_storage_path(cluster.name)
         cluster.storage_file = path
-        with open(path, 'wb') as storage:
-            self.dump(cluster, storage)
+        if not (self.journal and cluster.name in self._saved
+                and os.path.exists(path)
+                and self._append_journal(cluster)):
+            self._write_snapshot(cluster)
+        self._update_index(cluster)
+
+    def compact(self, cluster):
+        """Save the whole cluster state and remove its journal, if any.
+
+        :param cluster: cluster to save
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        """
+        self._write_snapshot(cluster)
+        self._update_index(cluster)
 
     def delete(self, cluster):
         """Deletes the cluster from persistent state.
@@ -217,9 +381,207 @@ duplication of code.
         :param cluster: cluster to delete from persistent state
         :type cluster: :py:class:`elasticluster.cluster.Cluster`
         """
+        self._saved.pop(cluster.name, None)
+        self._indexed.pop(cluster.name, None)
+        for path in (self._get_cluster_storage_path(cluster.name),
+                     self._get_journal_path(cluster.name)):
+            if os.path.exists(path):
+                os.unlink(path)
+        ClusterIndex(self.storage_path).remove(cluster.name)
+
+    def get_mtime(self, name):
+        """Return time the storage files of cluster `name` were last modified."""
+        paths = [self._get_cluster_storage_path(name)]
+        if self.can_journal:
+            paths.append(self._get_journal_path(name))
+        return max(os.path.getmtime(path)
+                   for path in paths if os.path.exists(path))
+
+    def _update_index(self, cluster):
+        """
+        Update the index entry of `cluster`, if its summary changed
+        since this store last wrote it.
+
+        The modification time is left out of the comparison, so that
+        checkpoints which only change node attributes do not read and
+        rewrite the index file.
+        """
+        summary = ClusterIndex.summarize(cluster, self.file_ending, None)
+        if self._indexed.get(cluster.name) != summary:
+            ClusterIndex(self.storage_path).update(
+                cluster, self.file_ending, self.get_mtime(cluster.name))
+            self._indexed[cluster.name] = summary
+
+    def _write_snapshot(self, cluster):
+        """Write the whole cluster state to its storage file."""
         path = self._get_cluster_storage_path(cluster.name)
-        if os.path.exists(path):
+        cluster.storage_file = path
+        # write to a temporary file and rename it, so that the
+        # cluster file is never left half-written
+        tmp_path = path + '.tmp'
+        buf = StringIO()
+        self.dump(cluster, buf)
+        data = buf.getvalue()
+        with open(tmp_path, 'wb') as storage:
+            storage.write(data)
+        os.rename(tmp_path, path)
+        # journal records are all contained in the new cluster file;
+        # should we be interrupted before removing it, the journal
+        # will be ignored as its checksum does not match
+        journal_path = self._get_journal_path(cluster.name)
+        if os.path.exists(journal_path):
+            os.unlink(journal_path)
+        if self.journal:
+            self._remember(cluster, len(data), 0, self._checksum(data))
+
+    @staticmethod
+    def _checksum(data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        return hashlib.sha1(data).hexdigest()
+
+    @classmethod
+    def _encode_cluster(cls, cluster):
+        state = cluster.to_dict(omit=cls._JOURNAL_OMIT)
+        return json.dumps(state, default=dict, sort_keys=True)
+
+    @staticmethod
+    def _encode_node(node):
+        return json.dumps(dict(node), default=dict, sort_keys=True)
+
+    def _encode_nodes(self, cluster, saved_nodes):
+        """
+        Return the encoded state of the nodes of `cluster`.
+
+        The return value is a pair: a dictionary mapping each node's
+        ``(kind, name)`` to a ``(revision, state)`` pair, and the list
+        of nodes whose state differs from the one in `saved_nodes`
+        (a dictionary like the first one).  Only the nodes whose
+        revision changed since they were saved are encoded again.
+        """
+        nodes = {}
+        changed = []
+        for node in cluster.get_all_nodes():
+            key = (node.kind, node.name)
+            # read the revision before encoding: if the node is
+            # modified meanwhile, it will be encoded again next time
+            revision = node._revision
+            saved = saved_nodes.get(key)
+            if saved is not None and saved[0] == revision:
+                nodes[key] = saved
+                continue
+            nodes[key] = (revision, self._encode_node(node))
+            if saved is None or saved[1] != nodes[key][1]:
+                changed.append(node)
+        return nodes, changed
+
+    def _remember(self, cluster, size, journal_size, checksum=None):
+        """Record the state of `cluster` as it is saved on disk."""
+        self._saved[cluster.name] = {
+            'cluster': self._encode_cluster(cluster),
+            'nodes': self._encode_nodes(cluster, {})[0],
+            'size': size,
+            'journal_size': journal_size,
+            'checksum': checksum,
+        }
+
+    def _append_journal(self, cluster):
+        """
+        Append the changes to `cluster` since last save to its journal.
+
+        Return ``False`` if the journal has grown too large and the
+        cluster file should be rewritten instead.
+        """
+        saved = self._saved[cluster.name]
+        records = []
+        cluster_state = self._encode_cluster(cluster)
+        if cluster_state != saved['cluster']:
+            records.append('{"cluster": %s}\n' % cluster_state)
+        nodes, changed = self._encode_nodes(cluster, saved['nodes'])
+        for node in changed:
+            records.append('{"node": %s}\n' % nodes[node.kind, node.name][1])
+        for key in saved['nodes']:
+            if key not in nodes:
+                records.append('{"removed": %s}\n' % json.dumps(list(key)))
+        if not records:
+            saved['nodes'] = nodes
+            return True
+
+        if not saved['journal_size']:
+            records.insert(0, '{"snapshot": %s}\n'
+                           % json.dumps(saved['checksum']))
+        data = ''.join(records)
+        journal_size = saved['journal_size'] + len(data)
+        if journal_size > max(saved['size'], self.journal_min_size):
+            return False
+        with open(self._get_journal_path(cluster.name), 'ab') as journal:
+            journal.write(data)
+        saved['cluster'] = cluster_state
+        saved['nodes'] = nodes
+        saved['journal_size'] = journal_size
+        return True
+
+    def _replay_journal(self, cluster, checksum):
+        """
+        Apply the changes recorded in the journal of `cluster`.
+
+        Argument `checksum` is the checksum of the cluster file
+        `cluster` was loaded from; a journal written for a different
+        cluster file is removed instead.
+
+        Return the size of the journal file, in bytes.
+        """
+        path = self._get_journal_path(cluster.name)
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as journal:
+            try:
+                header = json.loads(journal.readline())
+            except ValueError:
+                header = None
+            if not (isinstance(header, dict)
+                    and header.get('snapshot') == checksum):
+                log.warning("Ignoring journal file `%s`:"
+                            " it does not match cluster file `%s`",
+                            path, cluster.storage_file)
+                header = None
+            else:
+                for lineno, line in enumerate(journal, 2):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # most likely, ElastiCluster was interrupted
+                        # while writing the last record
+                        log.warning("Ignoring invalid record at line %d"
+                                    " of journal file `%s`", lineno, path)
+                        continue
+                    self._apply_journal_record(cluster, record)
+        if header is None:
+            # a newer cluster file has been written, which already
+            # contains the journal records
             os.unlink(path)
+            return 0
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _apply_journal_record(cluster, record):
+        if 'cluster' in record:
+            cluster.__dict__.update(record['cluster'])
+        elif 'node' in record:
+            state = record['node']
+            for node in cluster.nodes.get(state['kind'], []):
+                if node.name == state['name']:
+                    node.update(state)
+                    break
+            else:
+                cluster.add_node(**state)
+        elif 'removed' in record:
+            kind, name = record['removed']
+            for node in cluster.nodes.get(kind, []):
+                if node.name == name:
+                    cluster._remove_nodes([node])
+                    cluster._naming_policy.free(kind, name)
+                    break
 
 
 class PickleRepository(DiskRepository):
@@ -232,8 +594,12 @@ class PickleRepository(DiskRepository):
     """
 
     file_ending = 'pickle'
-    def __init__(self, storage_path):
-        DiskRepository.__init__(self, storage_path)
+
+    # pickled clusters may hold objects that cannot be saved as JSON
+    can_journal = False
+
+    def __init__(self, storage_path, journal=False):
+        DiskRepository.__init__(self, storage_path, journal)
         self.repository_types = [PickleRepository]
 
     def load(self, fp):
@@ -267,8 +633,11 @@ class JsonRepository(DiskRepository):
     def dump(cluster, fp):
         state = cluster.to_dict(omit=(
             '_cloud_provider',
+            '_lock',
             '_naming_policy',
+            '_nodes_by_name',
             '_setup_provider',
+            '_startup_pipeline',
             'repository',
             'storage_file',
         ))
@@ -285,7 +654,7 @@ class YamlRepository(DiskRepository):
     file_ending = 'yaml'
 
     def load(self, fp):
-        data = yaml.load(fp)
+        data = yaml.load(fp, Loader=_YamlLoader)
         from elasticluster import Cluster
         cluster = Cluster(**data)
         cluster.repository = self
@@ -293,21 +662,241 @@ class YamlRepository(DiskRepository):
 
     @staticmethod
     def dump(cluster, fp):
-        state = cluster.to_dict(omit=(
-            '_cloud_provider',
-            '_naming_policy',
-            '_setup_provider',
-            'repository',
-            'storage_file',
-        ))
-        # FIXME: This round-trip to JSON and back is used to
-        # deep-convert the contents of `state` into basic Python
-        # types, so that PyYAML can handle serialization without
-        # additional hints. It should be rewritten to use PyYAML's
-        # native "representers" mechanism, see:
-        # http://pyyaml.org/wiki/PyYAMLDocumentation#Constructorsrepresentersresolvers
-        state = json.loads(json.dumps(state, default=dict))
-        yaml.safe_dump(state, fp, default_flow_style=False, indent=4)
+        yaml.dump(cluster, fp, Dumper=_ClusterDumper,
+                  default_flow_style=False, indent=4)
+
+
+class _ClusterDumper(_YamlDumper):
+    """
+    YAML dumper that can represent `Cluster`, `Node` and other `Struct`
+    objects.
+
+    Only "safe" YAML tags are emitted: `Struct` and `Node` objects
+    are written as plain mappings, so they are loaded back as `dict`.
+    Any other object that the safe dumper cannot represent raises a
+    `yaml.representer.RepresenterError`.
+    """
+
+# attributes of `Cluster` objects that are not saved to YAML files
+_YAML_OMIT = frozenset([
+    '_cloud_provider',
+    '_lock',
+    '_naming_policy',
+    '_nodes_by_name',
+    '_setup_provider',
+    '_startup_pipeline',
+    'repository',
+    'storage_file',
+])
+
+def _represent_struct(dumper, data):
+    return dumper.represent_dict(dict(
+        (key, data[key]) for key in data.keys() if key not in _YAML_OMIT))
+
+def _represent_node(dumper, data):
+    # `Node` cannot be imported at the top of this module, which
+    # `elasticluster.cluster` itself imports
+    from elasticluster.cluster import Node
+    if not isinstance(data, Node):
+        return dumper.represent_undefined(data)
+    return dumper.represent_dict(dict(data))
+
+def _represent_dict_subclass(dumper, data):
+    return dumper.represent_dict(dict(data))
+
+_ClusterDumper.add_multi_representer(Struct, _represent_struct)
+# `Node` is not a `Struct`; any other object is rejected
+_ClusterDumper.add_multi_representer(object, _represent_node)
+_ClusterDumper.add_multi_representer(dict, _represent_dict_subclass)
+_ClusterDumper.add_representer(
+    tuple, (lambda dumper, data: dumper.represent_list(list(data))))
+
+
+class SqliteRepository(DiskRepository):
+    """This implementation of :py:class:`AbstractClusterRepository` stores
+    each cluster in an SQLite database, with one row for the cluster
+    attributes and one row for each node.
+
+    Only the rows of nodes that changed since the cluster was last
+    loaded or saved are written, each save being a single
+    transaction; concurrent processes can thus safely work on
+    different clusters.
+
+    :param str storage_path: path to the folder to store the cluster
+                             information
+    """
+    file_ending = 'sqlite'
+
+    # changes are saved incrementally anyway
+    can_journal = False
+
+    #: seconds to wait for another process to release a lock on the database
+    lock_timeout = 30
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS clusters ('
+        ' name TEXT PRIMARY KEY,'
+        ' state TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS nodes ('
+        ' id INTEGER PRIMARY KEY,'
+        ' cluster TEXT NOT NULL,'
+        ' kind TEXT NOT NULL,'
+        ' name TEXT NOT NULL,'
+        ' state TEXT NOT NULL,'
+        ' UNIQUE (cluster, name))',
+    )
+
+    def _connect(self, path):
+        conn = sqlite3.connect(path, timeout=self.lock_timeout)
+        with conn:
+            for statement in self._SCHEMA:
+                conn.execute(statement)
+        return conn
+
+    def get(self, name):
+        """Retrieves the cluster with the given name.
+
+        :param str name: name of the cluster (identifier)
+        :return: :py:class:`elasticluster.cluster.Cluster`
+        """
+        path = self._get_cluster_storage_path(name)
+        if not os.path.exists(path):
+            raise ClusterNotFound("Storage file %s does not exist" % path)
+        name = os.path.basename(name)
+        conn = self._connect(path)
+        try:
+            row = conn.execute(
+                'SELECT state FROM clusters WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                raise ClusterNotFound(
+                    "No cluster %s in storage file %s" % (name, path))
+            data = json.loads(row[0])
+            data['nodes'] = {}
+            for kind, state in conn.execute(
+                    'SELECT kind, state FROM nodes WHERE cluster = ?'
+                    ' ORDER BY id', (name,)):
+                data['nodes'].setdefault(kind, []).append(json.loads(state))
+        finally:
+            conn.close()
+
+        from elasticluster import Cluster
+        cluster = Cluster(**data)
+        cluster.repository = self
+        cluster.storage_file = path
+        self._remember(cluster, 0, 0)
+        return cluster
+
+    def save_or_update(self, cluster):
+        """Save or update the cluster to persistent state.
+
+        :param cluster: cluster to save or update
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        """
+        if not os.path.exists(self.storage_path):
+            os.makedirs(self.storage_path)
+
+        path = self._get_cluster_storage_path(cluster.name)
+        cluster.storage_file = path
+        cluster_state = self._encode_cluster(cluster)
+        conn = self._connect(path)
+        try:
+            saved = self._saved.get(cluster.name)
+            if saved is None:
+                saved = self._read_saved(conn, cluster.name)
+            nodes, changed = self._encode_nodes(cluster, saved['nodes'])
+            with conn:
+                if cluster_state != saved['cluster']:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO clusters (name, state)'
+                        ' VALUES (?, ?)', (cluster.name, cluster_state))
+                for node in changed:
+                    state = nodes[node.kind, node.name][1]
+                    # use UPDATE when possible, so that the node keeps
+                    # its position in the list of nodes of its kind
+                    updated = conn.execute(
+                        'UPDATE nodes SET kind = ?, state = ?'
+                        ' WHERE cluster = ? AND name = ?',
+                        (node.kind, state, cluster.name, node.name))
+                    if not updated.rowcount:
+                        conn.execute(
+                            'INSERT INTO nodes (cluster, kind, name, state)'
+                            ' VALUES (?, ?, ?, ?)',
+                            (cluster.name, node.kind, node.name, state))
+                for kind, name in saved['nodes']:
+                    if (kind, name) not in nodes:
+                        conn.execute(
+                            'DELETE FROM nodes WHERE cluster = ? AND name = ?',
+                            (cluster.name, name))
+        finally:
+            conn.close()
+        self._saved[cluster.name] = {
+            'cluster': cluster_state,
+            'nodes': nodes,
+        }
+        self._update_index(cluster)
+
+    @staticmethod
+    def _read_saved(conn, name):
+        """Return the encoded state of cluster `name` as saved in the database."""
+        row = conn.execute(
+            'SELECT state FROM clusters WHERE name = ?', (name,)).fetchone()
+        return {
+            'cluster': (row[0] if row else None),
+            'nodes': dict(((kind, node_name), (None, state))
+                          for kind, node_name, state in conn.execute(
+                              'SELECT kind, name, state FROM nodes'
+                              ' WHERE cluster = ?', (name,))),
+        }
+
+    def compact(self, cluster):
+        # nothing to do: the database is always up-to-date
+        pass
+
+    def delete(self, cluster):
+        """Deletes the cluster from persistent state.
+
+        :param cluster: cluster to delete from persistent state
+        :type cluster: :py:class:`elasticluster.cluster.Cluster`
+        """
+        self._saved.pop(cluster.name, None)
+        self._indexed.pop(cluster.name, None)
+        path = self._get_cluster_storage_path(cluster.name)
+        for suffix in ('', '-journal'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+        ClusterIndex(self.storage_path).remove(cluster.name)
+
+
+class ClusterHandle(object):
+    """
+    Reference to a cluster saved in a storage directory.
+
+    The cluster is loaded from file `path` (through `store`, an
+    instance of `DiskRepository`:class:) the first time attribute
+    `cluster` is accessed.
+
+    :ivar name: name of the cluster
+    :ivar format: storage format, i.e., the storage file extension
+    :ivar path: path to the storage file
+    """
+
+    def __init__(self, name, format, path, store):
+        self.name = name
+        self.format = format
+        self.path = path
+        self.store = store
+        self._cluster = None
+
+    @property
+    def cluster(self):
+        """The `Cluster` object, loaded on first access."""
+        if self._cluster is None:
+            self._cluster = migrate_cluster(self.store.get(self.name))
+        return self._cluster
+
+    def __repr__(self):
+        return ('ClusterHandle({0!r}, {1!r}, {2!r})'
+                .format(self.name, self.format, self.path))
 
 
 class MultiDiskRepository(AbstractClusterRepository):
@@ -316,12 +905,19 @@ class MultiDiskRepository(AbstractClusterRepository):
     """
     storage_type_map = {'pickle': PickleRepository,
                         'json': JsonRepository,
+                        'sqlite': SqliteRepository,
                         'yaml': YamlRepository}
 
-    def __init__(self, storage_path, default_store='yaml'):
+    def __init__(self, storage_path, default_store='yaml', journal=False):
         storage_path = os.path.expanduser(storage_path)
         storage_path = os.path.expandvars(storage_path)
         self.storage_path = storage_path
+        self.journal = journal
+        # storage class -> instance; stores are reused so that they
+        # can keep track of what has already been saved
+        self._stores = {}
+        # cluster name -> storage class, see `_get_store_by_name`
+        self._store_by_name = {}
         try:
             self.default_store = self.storage_type_map[default_store]
         except KeyError:
@@ -329,34 +925,97 @@ class MultiDiskRepository(AbstractClusterRepository):
                 "Invalid storage type %s. Allowed values: %s" % (
                     default_store, str.join(', ', self.storage_type_map)))
 
-    def get_all(self):
-        clusters = []
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # pickled by older versions of ElastiCluster
+        self.__dict__.setdefault('journal', False)
+        self.__dict__.setdefault('_stores', {})
+        self.__dict__.setdefault('_store_by_name', {})
+
+    def iter_clusters(self):
+        """
+        Iterate over the clusters in the storage directory.
+
+        Yield a `ClusterHandle`:class: for each cluster file found;
+        cluster files are only read when the handle's ``cluster``
+        attribute is accessed, so listing names is cheap.
+        """
         for cls in self.storage_type_map.values():
+            store = self._get_store(cls)
             cluster_files = glob.glob(
                 '%s/*.%s' % (self.storage_path, cls.file_ending))
-
             for fname in cluster_files:
+                name = os.path.basename(fname)[:-len(cls.file_ending)-1]
+                self._store_by_name.setdefault(name, cls)
+                yield ClusterHandle(name, cls.file_ending, fname, store)
+
+    def get_all(self):
+        clusters = []
+        for handle in self.iter_clusters():
+            try:
+                clusters.append(handle.cluster)
+            except (ImportError, AttributeError) as ex:
+                log.error("Unable to load cluster %s: `%s`", handle.path, ex)
+                log.error("If cluster %s was created with a previous version of elasticluster, you may need to run `elasticluster migrate %s %s` to update it.", handle.path, self.storage_path, handle.path)
+        return clusters
+
+    def get_summaries(self):
+        """
+        Return list of summaries of all stored clusters, sorted by name.
+
+        Each item is a dictionary with keys ``name``, ``template``,
+        ``nodes`` (mapping node kind to number of nodes), ``format``
+        and ``mtime``, as read from the `ClusterIndex`:class:; only
+        clusters whose index entry is missing or older than their
+        storage files are loaded, and the index is updated with them.
+        """
+        index = ClusterIndex(self.storage_path)
+        entries = index.load() or {}
+        current = {}
+        changed = False
+        for handle in self.iter_clusters():
+            if handle.name in current:
+                continue
+            mtime = handle.store.get_mtime(handle.name)
+            entry = entries.get(handle.name)
+            if (entry is None or entry.get('mtime') != mtime
+                    or entry.get('format') != handle.format):
                 try:
-                    store = cls(self.storage_path)
-                    name = fname[:-len(store.file_ending)-1]
-                    cluster = store.get(name)
-                    cluster = migrate_cluster(cluster)
-                    clusters.append(cluster)
+                    cluster = handle.cluster
                 except (ImportError, AttributeError) as ex:
-                    log.error("Unable to load cluster %s: `%s`", fname, ex)
-                    log.error("If cluster %s was created with a previous version of elasticluster, you may need to run `elasticluster migrate %s %s` to update it.", fname, self.storage_path, fname)
-        return clusters
+                    log.error("Unable to load cluster %s: `%s`", handle.path, ex)
+                    continue
+                entry = index.summarize(cluster, handle.format, mtime)
+                changed = True
+            current[handle.name] = entry
+        if changed or set(current) != set(entries):
+            index.save(current)
+        return [current[key] for key in sorted(current)]
+
+    def _get_store(self, cls):
+        """Return the instance of storage class `cls` for this repository."""
+        if cls not in self._stores:
+            self._stores[cls] = cls(self.storage_path, journal=self.journal)
+        return self._stores[cls]
 
     def _get_store_by_name(self, name):
-        """Return an instance of the correct DiskRepository based on the *first* file that matches the standard syntax for repository files"""
+        """Return an instance of the correct DiskRepository based on the *first* file that matches the standard syntax for repository files
+
+        The result is cached for the lifetime of this repository
+        object, until the cluster is deleted.
+        """
+        if name in self._store_by_name:
+            return self._get_store(self._store_by_name[name])
         for cls in self.storage_type_map.values():
             cluster_files = glob.glob(
                 '%s/%s.%s' % (self.storage_path, name, cls.file_ending))
             if cluster_files:
                 try:
-                    return cls(self.storage_path)
+                    store = self._get_store(cls)
                 except:
                     continue
+                self._store_by_name[name] = cls
+                return store
         raise ClusterNotFound("No cluster %s was found" % name)
 
 
@@ -371,9 +1030,15 @@ class MultiDiskRepository(AbstractClusterRepository):
                 store = self._get_store_by_name(cluster.name)
             except ClusterNotFound:
                 # Use one of the substores
-                store = self.default_store(self.storage_path)
+                store = self._get_store(self.default_store)
+                self._store_by_name[cluster.name] = self.default_store
             store.save_or_update(cluster)
 
     def delete(self, cluster):
-        store = self._get_store_by_name(name)
+        store = self._get_store_by_name(cluster.name)
+        del self._store_by_name[cluster.name]
         store.delete(cluster)
+
+    def compact(self, cluster):
+        store = self._get_store_by_name(cluster.name)
+        store.compact(cluster)
@@ -34,7 +34,7 @@ import re
 
 
 # Elasticluster imports
-from elasticluster import log
+from elasticluster import log, timeline
 from elasticluster.conf import make_creator
 from elasticluster.exceptions import ClusterNotFound, ConfigurationError, \
     ImageError, SecurityGroupError, NodeNotFound, ClusterError
@@ -135,6 +135,11 @@ class Start(AbstractCommand):
                                  'N2 of GROUP2 etc...')
         parser.add_argument('--no-setup', action="store_true", default=False,
                             help="Only start the cluster, do not configure it")
+        parser.add_argument(
+            '--early-setup', action="store_true", default=False,
+            help=("Start configuring the cluster as soon as the minimum"
+                  " number of nodes of each kind is up, and configure"
+                  " the whole cluster again once all nodes are up."))
         parser.add_argument(
             '-p', '--max-concurrent-requests', default=0,
             dest='max_concurrent_requests', type=int, metavar='NUM',
@@ -206,13 +211,21 @@ class Start(AbstractCommand):
             print("(This may take a while...)")
             min_nodes = dict((kind, cluster_nodes_conf[kind]['min_num'])
                              for kind in cluster_nodes_conf)
-            cluster.start(min_nodes, self.params.max_concurrent_requests)
+            early_setup = (self.params.early_setup
+                           and not self.params.no_setup)
+            cluster.start(min_nodes, self.params.max_concurrent_requests,
+                          bootstrap=(not self.params.no_setup),
+                          early_quorum=early_setup)
             if self.params.no_setup:
                 print("NOT configuring the cluster as requested.")
             else:
                 print("Configuring the cluster ...")
                 print("(this too may take a while)")
                 ok = cluster.setup()
+                if early_setup:
+                    # if any node started late, the whole cluster is
+                    # configured again and only that run counts
+                    ok = cluster.setup_late_nodes()
                 if ok:
                     print(
                         "\nYour cluster `{0}` is ready!"
@@ -246,6 +259,13 @@ class Stop(AbstractCommand):
                                  " have been terminated properly.")
         parser.add_argument('--wait', action="store_true", default=False,
                             help="Wait for all nodes to be properly terminated.")
+        parser.add_argument(
+            '-p', '--max-concurrent-requests', default=0,
+            dest='max_concurrent_requests', type=int, metavar='NUM',
+            help=("Try to terminate at most NUM nodes at the same time."
+                  " Set to 1 to terminate nodes sequentially."
+                  " The special value `0` (default) means: issue up to"
+                  " 4 independent requests per CPU core."))
         parser.add_argument('--yes', '-y', action="store_true", default=False,
                             help="Assume `yes` to all queries and "
                                  "do not prompt.")
@@ -269,7 +289,8 @@ class Stop(AbstractCommand):
                 .format(cluster_name=cluster_name),
                 msg="Aborting upon user request.")
         print("Destroying cluster `%s` ..." % cluster_name)
-        cluster.stop(force=self.params.force, wait=self.params.wait)
+        cluster.stop(force=self.params.force, wait=self.params.wait,
+                     max_concurrent_requests=self.params.max_concurrent_requests)
 
 
 class ResizeCluster(AbstractCommand):
@@ -397,8 +418,8 @@ class ResizeCluster(AbstractCommand):
                 confirm_or_abort("Do you really want to remove them?",
                                  msg="Aborting upon user request.")
 
+            cluster._remove_nodes(to_remove)
             for node in to_remove:
-                cluster.nodes[grp].remove(node)
                 node.stop()
 
         cluster.start()
@@ -481,7 +502,8 @@ class ListClusters(AbstractCommand):
         creator = make_creator(self.params.config,
                                storage_path=self.params.storage)
         repository = creator.create_repository()
-        clusters = repository.get_all()
+        # only read the summary index, not the cluster files
+        clusters = repository.get_summaries()
 
         if not clusters:
             print("No clusters found.")
@@ -490,14 +512,14 @@ class ListClusters(AbstractCommand):
 The following clusters have been started.
 Please note that there's no guarantee that they are fully configured:
 """)
-            for cluster in sorted(clusters):
-                print("%s " % cluster.name)
-                print("-" * len(cluster.name))
-                print("  name:           %s" % cluster.name)
-                if cluster.name != cluster.template:
-                    print("  template:       %s" % cluster.template)
-                for cls in cluster.nodes:
-                    print("  - %s nodes: %d" % (cls, len(cluster.nodes[cls])))
+            for cluster in clusters:
+                print("%s " % cluster['name'])
+                print("-" * len(cluster['name']))
+                print("  name:           %s" % cluster['name'])
+                if cluster['name'] != cluster['template']:
+                    print("  template:       %s" % cluster['template'])
+                for cls, count in sorted(cluster['nodes'].items()):
+                    print("  - %s nodes: %d" % (cls, count))
                 print("")
 
 
@@ -596,6 +618,55 @@ class ListNodes(AbstractCommand):
                     print("")
 
 
+class Timeline(AbstractCommand):
+    """
+    Show how long each startup phase took on the nodes of a cluster.
+    """
+
+    def setup(self, subparsers):
+        parser = subparsers.add_parser(
+            "timeline", help="Show the time taken by each phase of the"
+                             " nodes startup", description=self.__doc__)
+        parser.set_defaults(func=self)
+        parser.add_argument('cluster', help='name of the cluster')
+        parser.add_argument('--json', action='store_true',
+                            help="Produce JSON output")
+        parser.add_argument(
+            '--trace', metavar='FILE', default=None,
+            help=("Also write node timelines to FILE in Chrome's"
+                  " trace event format, for viewing with"
+                  " `chrome://tracing` or https://ui.perfetto.dev"))
+
+    def execute(self):
+        creator = make_creator(self.params.config,
+                               storage_path=self.params.storage)
+        cluster_name = self.params.cluster
+        try:
+            cluster = creator.load_cluster(cluster_name)
+        except (ClusterNotFound, ConfigurationError) as ex:
+            log.error("Showing timeline of cluster %s: %s", cluster_name, ex)
+            return
+
+        if self.params.trace:
+            with open(self.params.trace, 'w') as trace_file:
+                json.dump(timeline.make_trace(cluster), trace_file)
+
+        stats = timeline.summarize(cluster)
+        if self.params.json:
+            print(json.dumps(stats, indent=4))
+        elif not stats:
+            print("No timing information recorded for cluster `%s`."
+                  % cluster_name)
+        else:
+            row = "{kind:<15} {phase:<10} {count:>6} {p50:>9} {p90:>9} {p99:>9} {max:>9}"
+            print(row.format(kind='KIND', phase='PHASE', count='NODES',
+                             p50='P50', p90='P90', p99='P99', max='MAX'))
+            for item in stats:
+                print(row.format(**dict(item, **dict(
+                    (key, '%.1fs' % item[key])
+                    for key in ('p50', 'p90', 'p99', 'max')))))
+
+
 class SetupCluster(AbstractCommand):
     """
     Setup the given cluster by calling the setup provider defined for
@@ -850,6 +921,9 @@ class ExportCluster(AbstractCommand):
             log.error("ZIP file `%s` already exists.", self.params.zipfile)
             sys.exit(1)
 
+        # ensure the storage file holds all changes saved to the journal
+        cluster.repository.compact(cluster)
+
         with ZipFile(self.params.zipfile, 'w') as zipfile:
             # The root of the zip file will contain:
             # * the storage file
@@ -962,9 +1036,9 @@ class ImportCluster(AbstractCommand):
                 log.debug("ZIP file %s opened", self.params.file)
                 cluster = None
                 zipfile.extractall(tmpdir)
-                newclusters = tmprepo.get_all()
-                cluster = newclusters[0]
-                cur_clusternames = [c.name for c in repo.get_all()]
+                newclusters = list(tmprepo.iter_clusters())
+                cluster = newclusters[0].cluster
+                cur_clusternames = [c.name for c in repo.iter_clusters()]
                 oldname = cluster.name
                 newname = self.params.rename
                 if self.params.rename:
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018 University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Analyze the lifecycle timestamps recorded on cluster nodes.
+
+Each node records when it went through the events listed in
+`Node.TIMELINE_EVENTS`; the time between two consecutive events is
+a "phase" of the node startup (e.g., the time taken by the VM to
+boot, or by SSH to become available).
+"""
+
+# stdlib imports
+from collections import defaultdict
+
+# ElastiCluster imports
+from elasticluster.utils import percentile
+
+
+#: startup phases, as ``(name, start events, end event)`` triples;
+#: a phase starts at the first of its start events that was recorded
+PHASES = (
+    ('submit', ('start_requested',), 'started'),
+    ('boot', ('started',), 'running'),
+    ('ssh', ('running',), 'reachable'),
+    ('bootstrap', ('reachable',), 'bootstrapped'),
+    ('setup', ('bootstrapped', 'reachable'), 'configured'),
+)
+
+
+def node_phases(node):
+    """
+    Return list of ``(phase, start, end)`` triples for `node`.
+
+    Only phases whose start and end events have both been recorded
+    are listed.
+    """
+    timeline = node.timeline
+    phases = []
+    for name, start_events, end_event in PHASES:
+        if end_event not in timeline:
+            continue
+        for start_event in start_events:
+            if start_event in timeline:
+                phases.append(
+                    (name, timeline[start_event], timeline[end_event]))
+                break
+    return phases
+
+
+def summarize(cluster, pcts=(50, 90, 99)):
+    """
+    Return statistics of the duration of startup phases, per node kind.
+
+    The result is a list of dictionaries, one per (kind, phase) pair,
+    with keys ``kind``, ``phase``, ``count``, ``max`` and ``p<N>``
+    for each percentile *N* in `pcts`.  Phase ``total`` spans from
+    the first to the last event recorded on each node.
+    """
+    durations = defaultdict(list)  # (kind, phase) -> list of seconds
+    for node in cluster.get_all_nodes():
+        for name, start, end in node_phases(node):
+            durations[node.kind, name].append(end - start)
+        if len(node.timeline) > 1:
+            times = node.timeline.values()
+            durations[node.kind, 'total'].append(max(times) - min(times))
+
+    order = [name for name, _, _ in PHASES] + ['total']
+    result = []
+    for (kind, name), values in sorted(
+            durations.items(),
+            key=(lambda item: (item[0][0], order.index(item[0][1])))):
+        stats = {
+            'kind': kind,
+            'phase': name,
+            'count': len(values),
+            'max': max(values),
+        }
+        for pct in pcts:
+            stats['p{0}'.format(pct)] = percentile(values, pct)
+        result.append(stats)
+    return result
+
+
+def make_trace(cluster):
+    """
+    Return the node timelines of `cluster` in Chrome's "trace event" format.
+
+    The returned dictionary can be saved as JSON and loaded into
+    ``chrome://tracing`` or https://ui.perfetto.dev; each node kind
+    is shown as a process, and each node as a thread in it.
+    """
+    nodes = [node for node in cluster.get_all_nodes() if node.timeline]
+    if not nodes:
+        return {'traceEvents': []}
+    origin = min(min(node.timeline.values()) for node in nodes)
+
+    def usecs(when):
+        return int(round((when - origin) * 1e6))
+
+    events = []
+    kinds = sorted(set(node.kind for node in nodes))
+    for pid, kind in enumerate(kinds, 1):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': kind}})
+    for tid, node in enumerate(sorted(nodes, key=(lambda node: node.name)), 1):
+        pid = kinds.index(node.kind) + 1
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                       'tid': tid, 'args': {'name': node.name}})
+        for name, start, end in node_phases(node):
+            events.append({
+                'name': name, 'cat': node.kind, 'ph': 'X',
+                'ts': usecs(start), 'dur': usecs(end) - usecs(start),
+                'pid': pid, 'tid': tid,
+                'args': {'instance_id': node.instance_id},
+            })
+        for event, when in node.timeline.items():
+            events.append({
+                'name': event, 'cat': node.kind, 'ph': 'i', 's': 't',
+                'ts': usecs(when), 'pid': pid, 'tid': tid,
+            })
+    return {
+        'traceEvents': events,
+        'displayTimeUnit': 'ms',
+        'otherData': {'cluster': cluster.name, 'origin': origin},
+    }
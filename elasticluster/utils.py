@@ -21,21 +21,105 @@ __docformat__ = 'reStructuredText'
 __author__ = 'Riccardo Murri <riccardo.murri@gmail.com>'
 
 # stdlib imports
+import bisect
 from contextlib import contextmanager
+import email.utils
 import functools
+import json
 import os
+import random
 import re
 import signal
 import shutil
 import sys
 import tempfile
+import threading
 import time
 import UserDict
+import weakref
 
 # 3rd party imports
 import click
 import netaddr
 
+# ElastiCluster imports
+from elasticluster import log
+from elasticluster.exceptions import TimeoutError
+
+
+class Backoff(object):
+    """
+    Compute the delays between successive polls of a slowly-changing state.
+
+    The first delay is `initial` seconds; each following one is
+    `factor` times longer than the previous, up to a maximum of `cap`
+    seconds.  Each delay is then randomly shortened by up to a
+    fraction `jitter` of it, so that concurrent pollers do not fall
+    into lockstep.  If `deadline` (an absolute time, as returned by
+    `time.time()`) is given, no delay extends past it.
+
+    A delay suggested by the polled service (e.g., the value of an
+    HTTP ``Retry-After`` header, see `get_retry_after`:func:) can be
+    passed as `hint` and takes precedence over the computed delay,
+    but is still bounded by the deadline::
+
+      >>> backoff = Backoff(initial=1, factor=2, cap=5, jitter=0)
+      >>> [backoff.next_delay() for _ in range(5)]
+      [1, 2, 4, 5, 5]
+      >>> backoff.next_delay(hint=20)
+      20
+      >>> backoff.reset()
+      >>> backoff.next_delay()
+      1
+    """
+
+    def __init__(self, initial=1, factor=2, cap=30, jitter=0.25, deadline=None):
+        self.initial = initial
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.deadline = deadline
+        self._attempt = 0
+
+    def reset(self):
+        """
+        Restart from the initial delay.
+        """
+        self._attempt = 0
+
+    def expired(self):
+        """
+        Return ``True`` if the deadline has passed.
+        """
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def next_delay(self, hint=None):
+        """
+        Return the number of seconds to wait before the next poll.
+        """
+        if hint is not None:
+            delay = hint
+        else:
+            delay = min(self.cap, self.initial * self.factor ** self._attempt)
+            if self.jitter:
+                delay *= 1 - self.jitter * random.random()
+            self._attempt += 1
+        if self.deadline is not None:
+            delay = max(0, min(delay, self.deadline - time.time()))
+        return delay
+
+    def sleep(self, hint=None):
+        """
+        Wait until the next poll is due.
+
+        Return ``False`` (without waiting) if the deadline has
+        already passed, ``True`` otherwise.
+        """
+        if self.expired():
+            return False
+        time.sleep(self.next_delay(hint))
+        return True
+
 
 def confirm_or_abort(prompt, exitcode=os.EX_TEMPFAIL, msg=None, **extra_args):
     """
@@ -129,6 +213,50 @@ def get_num_processors():
     raise RuntimeError("Cannot determine number of processors")
 
 
+def get_retry_after(err):
+    """
+    Return delay (in seconds) suggested by the "retry after" hint in `err`.
+
+    The hint is taken from the ``retry_after`` attribute of exception
+    `err` (as set, e.g., by ``novaclient`` for rate-limit errors) or
+    from the ``Retry-After`` header of the HTTP response attached to
+    it (as done by ``requests`` and ``googleapiclient``).  Both the
+    number-of-seconds and the HTTP-date forms are understood::
+
+      >>> err = RuntimeError()
+      >>> err.retry_after = '5'
+      >>> get_retry_after(err)
+      5.0
+
+    Return ``None`` if no hint is found::
+
+      >>> get_retry_after(ValueError()) is None
+      True
+    """
+    value = getattr(err, 'retry_after', None)
+    if value is None:
+        for attr in ('response', 'resp'):
+            headers = getattr(err, attr, None)
+            headers = getattr(headers, 'headers', headers)
+            try:
+                value = (headers.get('Retry-After')
+                         or headers.get('retry-after'))
+            except AttributeError:
+                continue
+            if value is not None:
+                break
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    date = email.utils.parsedate_tz(str(value))
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
 def has_nested_keys(mapping, k1, *more):
     """
     Return ``True`` if `mapping[k1][k2]...[kN]` is valid.
@@ -166,6 +294,245 @@ def has_nested_keys(mapping, k1, *more):
         return False
 
 
+class Histogram(object):
+    """
+    Count how many values fall into each of a fixed set of buckets.
+
+    Bucket *i* holds values ``v`` such that ``bounds[i-1] < v <=
+    bounds[i]``; an additional last bucket holds values larger than
+    all the bounds.  Percentiles are estimated as the upper bound of
+    the bucket they fall into, so memory use does not depend on the
+    number of values recorded::
+
+      >>> hist = Histogram([1, 10, 100])
+      >>> for value in 0.5, 2, 3, 50:
+      ...     hist.add(value)
+      >>> hist.counts
+      [1, 2, 1, 0]
+      >>> hist.percentile(50)
+      10
+      >>> hist.percentile(100)
+      50
+
+    Instances are not thread-safe.
+    """
+
+    #: default bucket bounds, suited to the latency (in seconds) of
+    #: calls to a cloud API
+    DEFAULT_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                      1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def add(self, value):
+        """Record `value`."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """Average of the recorded values, or ``None`` if there are none."""
+        if not self.count:
+            return None
+        return float(self.total) / self.count
+
+    def percentile(self, pct):
+        """
+        Return an upper bound for the `pct`-th percentile of recorded values.
+
+        :raise ValueError: if no value has been recorded.
+        """
+        if not self.count:
+            raise ValueError("Cannot compute percentile of an empty histogram")
+        rank = self.count * pct / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                break
+        if index < len(self.bounds):
+            return min(self.bounds[index], self.max)
+        return self.max
+
+
+class Cache(object):
+    """
+    Thread-safe key/value cache with LRU eviction and TTL expiration.
+
+    At most `maxsize` items are kept (``0`` means no limit); when
+    a new item is stored in a full cache, the least-recently used
+    one is evicted.  If `ttl` is positive, items expire that many
+    seconds after they were stored.
+
+    Values are looked up with `get`:meth:, which calls the given
+    `load` function on a cache miss.  Loading is "single-flight":
+    if several threads look up the same missing key concurrently,
+    only one of them runs `load`, and the others wait for its
+    result (or exception, which is not cached)::
+
+      >>> cache = Cache(maxsize=2)
+      >>> cache.get('a', lambda: 1)
+      1
+      >>> cache.get('a', lambda: 2)
+      1
+      >>> cache.get('b', lambda: 2)
+      2
+      >>> cache.get('c', lambda: 3)
+      3
+      >>> 'a' in cache
+      False
+
+    Attributes `hits` and `misses` count the lookups that were
+    answered from the cache and those that ran `load`, respectively::
+
+      >>> cache.hits, cache.misses
+      (1, 3)
+
+    Items can be dropped with `invalidate`:meth:, or all at once
+    with `clear`:meth:::
+
+      >>> cache.invalidate('b')
+      >>> len(cache)
+      1
+      >>> cache.clear()
+      >>> len(cache)
+      0
+    """
+
+    _MISSING = object()  # returned by `_lookup` when no value is stored
+
+    def __init__(self, maxsize=128, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = {}  # key -> (value, expiration time or None)
+        self._used = {}  # key -> value of `_clock` at last use
+        self._clock = 0
+        self._loading = {}  # key -> `_Flight` computing its value
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key, time.time()) is not self._MISSING
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, load):
+        """
+        Return value stored for `key`, calling `load()` to compute it if needed.
+        """
+        with self._lock:
+            value = self._lookup(key, time.time())
+            if value is not self._MISSING:
+                self.hits += 1
+                return value
+            flight = self._loading.get(key)
+            if flight is not None:
+                self.hits += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self._loading[key] = _Flight()
+                generation = self._generation
+                leader = True
+        if not leader:
+            return flight.wait()
+        try:
+            value = load()
+        except Exception as err:
+            with self._lock:
+                del self._loading[key]
+            flight.fail(err)
+            raise
+        with self._lock:
+            del self._loading[key]
+            # do not store values that were invalidated while loading
+            if generation == self._generation:
+                self._store(key, value, time.time())
+        flight.succeed(value)
+        return value
+
+    def invalidate(self, key):
+        """
+        Drop the value stored for `key`, if any.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._used.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        """
+        Drop all stored values.
+        """
+        with self._lock:
+            self._data.clear()
+            self._used.clear()
+            self._generation += 1
+
+    # the following methods must be called with `self._lock` held
+
+    def _lookup(self, key, now):
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            return self._MISSING
+        if expires is not None and now >= expires:
+            del self._data[key]
+            del self._used[key]
+            return self._MISSING
+        self._clock += 1
+        self._used[key] = self._clock
+        return value
+
+    def _store(self, key, value, now):
+        if (self.maxsize > 0 and key not in self._data
+                and len(self._data) >= self.maxsize):
+            lru = min(self._used, key=self._used.get)
+            del self._data[lru]
+            del self._used[lru]
+        self._clock += 1
+        self._used[key] = self._clock
+        self._data[key] = (value, (now + self.ttl if self.ttl > 0 else None))
+
+
+class _Flight(object):
+    """
+    Outcome of a computation, on which other threads can wait.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def succeed(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, err):
+        self._error = err
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
 class memoize(object):
     """
     Cache a function's return value each time it is called within a TTL.
@@ -174,34 +541,193 @@ class memoize(object):
     returned, If called outside the TTL or a different value, a fresh value is
     returned (and cached for future occurrences).
 
-    .. warning::
-
-      Only works on functions that take *no keyword arguments*.
+    Values are kept in a `Cache`:class: of at most `maxsize` items,
+    so concurrent calls with the same arguments compute the value
+    only once.  When decorating a method, each object gets a cache
+    of its own, which is discarded together with the object; it can
+    be reached as attribute ``cache`` of the bound method::
+
+      >>> class Cloud(object):
+      ...     @memoize(120)
+      ...     def flavors(self, region):
+      ...         print("listing flavors in region %s" % region)
+      ...         return ['small', 'large']
+      >>> cloud = Cloud()
+      >>> cloud.flavors('north')
+      listing flavors in region north
+      ['small', 'large']
+      >>> cloud.flavors('north')
+      ['small', 'large']
+      >>> cloud.flavors.cache.hits
+      1
+      >>> cloud.flavors.cache.clear()
+      >>> cloud.flavors('north')
+      listing flavors in region north
+      ['small', 'large']
 
-    Originally taken from: http://jonebird.com/2012/02/07/python-memoize-decorator-with-ttl-argument/
+    Calls with unhashable arguments (e.g., a list) are not cached.
     """
-    def __init__(self, ttl):
-        self.cache = {}
+    def __init__(self, ttl, maxsize=128):
         self.ttl = ttl
+        self.maxsize = maxsize
 
     def __call__(self, f):
-        @functools.wraps(f)
-        def wrapped_f(*args):
-            now = time.time()
+        return _Memoized(f, self.ttl, self.maxsize)
+
+
+class _Memoized(object):
+    """
+    Function wrapper created by `memoize`:class:.
+    """
+
+    def __init__(self, func, ttl, maxsize):
+        self.func = func
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.cache = Cache(maxsize, ttl)
+        self._caches = weakref.WeakKeyDictionary()  # object -> `Cache`
+        self._lock = threading.Lock()
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        return self._call(self.cache, self.func, args, kwargs)
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        with self._lock:
             try:
-                value, last_update = self.cache[args]
-                if self.ttl > 0 and now - last_update > self.ttl:
-                    raise AttributeError
-                return value
-            except (KeyError, AttributeError):
-                value = f(*args)
-                self.cache[args] = (value, now)
-                return value
-            except TypeError:
-                # uncachable -- for instance, passing a list as an argument.
-                # Better to not cache than to blow up entirely.
-                return f(*args)
-        return wrapped_f
+                cache = self._caches[obj]
+            except KeyError:
+                cache = self._caches[obj] = Cache(self.maxsize, self.ttl)
+        return _BoundMemoized(self, obj, cache)
+
+    @staticmethod
+    def _call(cache, func, args, kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # uncachable -- for instance, passing a list as an argument.
+            # Better to not cache than to blow up entirely.
+            return func(*args, **kwargs)
+        return cache.get(key, lambda: func(*args, **kwargs))
+
+
+class _BoundMemoized(object):
+    """
+    A `memoize`:class:-d method bound to an object.
+    """
+
+    def __init__(self, memoized, obj, cache):
+        self.__func__ = memoized.func
+        self.__self__ = obj
+        self.cache = cache
+
+    def __call__(self, *args, **kwargs):
+        return _Memoized._call(
+            self.cache, functools.partial(self.__func__, self.__self__),
+            args, kwargs)
+
+
+class DiskCache(object):
+    """
+    Key/value cache persisted to a JSON file, with TTL expiration.
+
+    Values must be serializable to JSON, and keys must be strings.
+    The file is re-read on every cache miss and written atomically,
+    so that several processes can share it: the last writer wins,
+    but no item is lost unless two processes store it at the same
+    time.  A missing, unreadable or corrupt file is treated as an
+    empty cache::
+
+      >>> path = os.path.join(tempfile.mkdtemp(), 'cache.json')
+      >>> cache = DiskCache(path, ttl=60)
+      >>> cache.get('answer', lambda: 42)
+      42
+      >>> DiskCache(path, ttl=60).get('answer', lambda: 0)
+      42
+
+    If `check` is given to `get`:meth:, a cached value for which
+    ``check(value)`` is false is considered stale and loaded anew::
+
+      >>> cache.get('answer', lambda: 43, check=(lambda value: value > 42))
+      43
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._data = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key, load, check=None):
+        """
+        Return value stored for `key`, calling `load()` to compute it if needed.
+        """
+        now = time.time()
+        with self._lock:
+            if self._data is None:
+                self._data = self._read()
+            entry = self._data.get(key)
+            if (entry is None or entry[1] <= now
+                    or (check is not None and not check(entry[0]))):
+                # maybe another process has stored a fresher value
+                self._data = self._read()
+                entry = self._data.get(key)
+            if (entry is not None and entry[1] > now
+                    and (check is None or check(entry[0]))):
+                return entry[0]
+        value = load()
+        with self._lock:
+            self._data = self._read()
+            self._data[key] = (value, now + self.ttl)
+            self._write(self._data)
+        return value
+
+    def invalidate(self, key):
+        """
+        Drop the value stored for `key`, if any.
+        """
+        with self._lock:
+            self._data = self._read()
+            if self._data.pop(key, None) is not None:
+                self._write(self._data)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as stream:
+                data = json.load(stream)
+            if not isinstance(data, dict):
+                raise ValueError("not a JSON object")
+            return data
+        except (IOError, OSError):
+            return {}
+        except ValueError as err:
+            log.debug("Ignoring corrupt cache file `%s`: %s", self.path, err)
+            return {}
+
+    def _write(self, data):
+        dirname = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+            with os.fdopen(fd, 'w') as stream:
+                json.dump(data, stream)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as err:
+            # the cache is just an optimization: keep going
+            log.debug("Could not write cache file `%s`: %s", self.path, err)
 
 
 # this is very liberal, in that it will accept malformed address
@@ -307,6 +833,30 @@ def parse_ip_address_and_port(addr, default_port=22):
         .format(addr))
 
 
+def percentile(values, pct):
+    """
+    Return the `pct`-th percentile of the sequence of numbers `values`.
+
+    Values between two data points are linearly interpolated::
+
+      >>> percentile([1, 2, 3, 4], 50)
+      2.5
+      >>> percentile([3, 1, 2], 50)
+      2.0
+      >>> percentile([1, 2, 3, 4, 5], 90)
+      4.6
+
+    :raise ValueError: if `values` is empty.
+    """
+    data = sorted(values)
+    if not data:
+        raise ValueError("Cannot compute percentile of an empty sequence")
+    rank = (len(data) - 1) * pct / 100.0
+    lo = int(rank)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (rank - lo)
+
+
 # copied over from GC3Pie's `utils.py`
 def string_to_boolean(word):
     """
@@ -483,6 +1033,92 @@ def timeout(delay, handler=None):
     signal.signal(signal.SIGALRM, prev_sigalrm_handler)
 
 
+class TokenBucket(object):
+    """
+    Limit the rate of some operation, allowing short bursts.
+
+    Tokens are added to the bucket at `rate` tokens per second, up to
+    a maximum of `burst` tokens; each call to `acquire`:meth: takes
+    one token, and waits until it becomes available if the bucket is
+    empty.  Instances can be shared among threads.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self._last:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+    def acquire(self):
+        """
+        Take one token from the bucket, waiting for it if needed.
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self._tokens -= 1
+            delay = (max(0, self._last - now)
+                     + max(0, -self._tokens) / self.rate)
+        if delay > 0:
+            time.sleep(delay)
+
+    def try_acquire(self):
+        """
+        Take one token from the bucket if one is available right now.
+
+        Return ``True`` if a token was taken, ``False`` otherwise.
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if self._tokens < 1 or self._last > now:
+                return False
+            self._tokens -= 1
+            return True
+
+    def pause(self, delay):
+        """
+        Hand out no more tokens for the next `delay` seconds.
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self._tokens = min(0, self._tokens)
+            self._last = max(self._last, now + delay)
+
+
+def wait_until(condition, timeout=None, **backoff_args):
+    """
+    Poll `condition()` until it returns a true value, and return it.
+
+    Successive calls are spaced according to a `Backoff`:class:
+    instance, constructed with the given keyword arguments.  If
+    `condition()` is still false after `timeout` seconds, raise
+    `elasticluster.exceptions.TimeoutError`; wait forever if
+    `timeout` is ``None``.
+
+    Unlike `timeout`:func:, this function can also be used in
+    threads other than the main one.
+    """
+    if timeout is not None:
+        backoff_args['deadline'] = time.time() + timeout
+    backoff = Backoff(**backoff_args)
+    while True:
+        result = condition()
+        if result:
+            return result
+        if not backoff.sleep():
+            raise TimeoutError(
+                "Condition not met within {0} seconds".format(timeout))
+
+
 ## Warnings redirection
 #
 # This is a modified version of the `logging.captureWarnings()` code from
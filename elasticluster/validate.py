@@ -148,6 +148,14 @@ def nonnegative_int(v):
     return converted
 
 
+@validator
+def nonnegative_float(v):
+    converted = float(v)
+    if converted < 0:
+        raise ValueError("value must be a non-negative number")
+    return converted
+
+
 @validator
 def nova_api_version(version):
     """
@@ -22,7 +22,7 @@ from __future__ import (absolute_import, division, print_function)
 from string import Template
 
 # 3rd party imports
-from mock import Mock
+from mock import MagicMock, Mock
 
 # ElastiCLuster imports
 from elasticluster.conf import Creator
@@ -308,6 +308,35 @@ def make_cluster(tmpdir, template='example_openstack', config=_CONFIG_KV, cloud=
     return cluster
 
 
+def make_slow_cloud(tmpdir, slow=(), template='example_openstack'):
+    """
+    Return a cluster on a mock cloud where some VMs never come up.
+
+    The VM of each node gets instance ID ``<cluster name>-<node name>``,
+    and the cloud reports it running, except if its instance ID is in
+    a set of "slow" instance IDs; this set initially holds the IDs of
+    the nodes named in `slow`, and tests can modify it to let the
+    corresponding VMs come up.  The cluster is saved to a mock
+    repository.
+
+    Return a triple (cluster, cloud provider, set of slow instance IDs).
+    """
+    cloud = MagicMock()
+    cloud.start_instance.side_effect = (
+        lambda *args, **kwargs: kwargs['node_name'])
+    cluster = make_cluster(tmpdir, template=template, cloud=cloud)
+    cluster.polling_interval = 0.05
+    cluster.repository = MagicMock()
+    cluster.repository.storage_path = '/unused/path'
+
+    slow_ids = set(cluster.name + '-' + name for name in slow)
+    cloud.get_instances_status.side_effect = (
+        lambda ids: [((False, None) if instance_id in slow_ids
+                      else (True, ['127.0.0.1']))
+                     for instance_id in ids])
+    return cluster, cloud, slow_ids
+
+
 class Configuration(object):
 
     def get_config(self, path):
@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018  University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import
+
+# stdlib imports
+import time
+
+# 3rd-party imports
+from mock import MagicMock, patch
+from pytest import raises
+
+# ElastiCluster imports
+from elasticluster.providers import (
+    CallStats,
+    instrument_calls,
+    is_throttling_error,
+    limit_api_calls,
+)
+from elasticluster.providers.simulated import (
+    SimulatedCloudError,
+    SimulatedCloudProvider,
+)
+from elasticluster.utils import TokenBucket
+
+
+class ThrottlingError(Exception):
+    error_code = 'RequestLimitExceeded'
+
+
+def test_is_throttling_error():
+    assert is_throttling_error(ThrottlingError())
+    err = RuntimeError()
+    err.http_status = 429
+    assert is_throttling_error(err)
+    assert not is_throttling_error(RuntimeError("Invalid image ID"))
+
+
+def test_limit_api_calls_retries_throttled_calls():
+    provider = MagicMock()
+    provider.get_ips.side_effect = [
+        ThrottlingError(), ThrottlingError(), ['1.2.3.4']]
+    limit_api_calls(provider, api_rate_limit=0, api_max_retries=2)
+
+    with patch('time.sleep') as sleep:
+        assert provider.get_ips('test-id') == ['1.2.3.4']
+    assert sleep.call_count == 2
+
+
+def test_limit_api_calls_does_not_retry_start_instances():
+    provider = MagicMock()
+    start_instances = provider.start_instances
+    start_instances.side_effect = ThrottlingError()
+    limit_api_calls(provider, api_rate_limit=0)
+
+    with raises(ThrottlingError):
+        provider.start_instances(1, 'key')
+    assert start_instances.call_count == 1
+
+
+def test_limit_api_calls_retries_create_request():
+    provider = MagicMock()
+    limit_api_calls(provider, api_rate_limit=0, api_max_retries=2)
+    create = MagicMock(side_effect=[ThrottlingError(), ['test-id']])
+
+    with patch('time.sleep') as sleep:
+        assert provider._retry_throttled(create, 1, name='test') == ['test-id']
+    assert sleep.call_count == 1
+    create.assert_called_with(1, name='test')
+
+
+def test_limit_api_calls_gives_up():
+    provider = MagicMock()
+    stop_instance = provider.stop_instance
+    stop_instance.side_effect = ThrottlingError()
+    limit_api_calls(provider, api_rate_limit=0, api_max_retries=1)
+
+    with patch('time.sleep'):
+        with raises(ThrottlingError):
+            provider.stop_instance('test-id')
+    assert stop_instance.call_count == 2
+
+
+def test_limit_api_calls_does_not_retry_other_errors():
+    provider = MagicMock()
+    get_ips = provider.get_ips
+    get_ips.side_effect = ValueError()
+    limit_api_calls(provider)
+
+    with raises(ValueError):
+        provider.get_ips('test-id')
+    assert get_ips.call_count == 1
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, burst=5)
+    start = time.time()
+    for _ in range(15):
+        bucket.acquire()
+    # first 5 tokens are immediately available, then 10 more at 100/s
+    assert 0.09 <= time.time() - start < 0.5
+
+
+def test_instrument_calls():
+    stats = CallStats()
+    provider = instrument_calls(
+        SimulatedCloudProvider(boot_time='0', throttle_rate=0.1, throttle_burst=1),
+        'sim', stats)
+    instance_id = provider.start_instance(
+        'key', '/pub', '/priv', 'default', 'flavor', 'image', '')
+    with raises(SimulatedCloudError):
+        provider.get_ips(instance_id)
+    summary = dict((item['method'], item) for item in stats.summary())
+    assert summary['start_instance']['calls'] == 1
+    assert summary['start_instance']['errors'] == 0
+    assert summary['get_ips']['errors'] == 1
+    assert summary['get_ips']['throttled'] == 1
+    # private helpers are instrumented too
+    assert summary['_api_call']['calls'] == 2
+    assert sum(count for _, count in summary['_api_call']['histogram']) == 2
+    assert all(item['provider'] == 'sim' for item in summary.values())
+    assert 'get_ips' in stats.format()
@@ -24,6 +24,7 @@ import unittest
 from mock import MagicMock, PropertyMock
 
 from elasticluster.exceptions import (
+    ClusterError,
     KeypairError,
     InstanceError,
     InstanceNotFoundError,
@@ -32,6 +33,7 @@ from elasticluster.exceptions import (
     ImageError
 )
 from elasticluster.providers.ec2_boto import BotoCloudProvider
+from elasticluster.utils import DiskCache
 
 import pytest
 
@@ -132,6 +134,13 @@ class TestBotoCloudProvider(unittest.TestCase):
                 user_data=image_userdata,
             )
 
+            # checks are not repeated for further instances
+            provider.start_instance(key_name, key_pub, key_prv,
+                                    security_group, flavor, image_id,
+                                    image_userdata)
+            assert con.run_instances.call_count == 2
+            assert con.get_all_key_pairs.call_count == 1
+            assert con.get_all_security_groups.call_count == 1
 
         except:
             # cleanup
@@ -141,6 +150,140 @@ class TestBotoCloudProvider(unittest.TestCase):
         os.unlink(key_prv)
         os.unlink(key_pub)
 
+    def test_start_instances(self):
+        """
+        BotoCloudProvider: start many instances with a single request
+        """
+        provider = self._create_provider()
+        con = MagicMock()
+        provider._ec2_connection = con
+        # pretend keypair and security group have been checked already
+        provider._start_params_cache[('key', 'secgroup', None)] = ('sg-1', [])
+
+        # only 2 out of 3 instances can be started
+        vms = [MagicMock(id='i-1'), MagicMock(id='i-2')]
+        con.run_instances.return_value = MagicMock(instances=vms)
+
+        instance_ids = provider.start_instances(
+            3, 'key', '/unused/key.pub', '/unused/key', 'secgroup',
+            'm1.tiny', 'image-id', '',
+            node_names=['test-node1', 'test-node2', 'test-node3'])
+
+        assert instance_ids == ['i-1', 'i-2', None]
+        con.run_instances.assert_called_once_with(
+            'image-id',
+            min_count=1,
+            max_count=3,
+            block_device_map=None,
+            instance_profile_name=None,
+            instance_type='m1.tiny',
+            key_name='key',
+            network_interfaces=None,
+            placement_group=None,
+            security_groups=['secgroup'],
+            user_data='',
+        )
+        vms[0].add_tag.assert_called_once_with('Name', 'test-node1')
+        vms[1].add_tag.assert_called_once_with('Name', 'test-node2')
+        assert provider._instances['i-2'] is vms[1]
+
+    def test_start_instances_tag_error(self):
+        """
+        BotoCloudProvider: errors in tagging started instances are not fatal
+        """
+        provider = self._create_provider()
+        con = MagicMock()
+        provider._ec2_connection = con
+        provider._start_params_cache[('key', 'secgroup', None)] = ('sg-1', [])
+
+        vms = [MagicMock(id='i-1'), MagicMock(id='i-2')]
+        vms[0].add_tag.side_effect = RuntimeError('RequestLimitExceeded')
+        con.run_instances.return_value = MagicMock(instances=vms)
+
+        instance_ids = provider.start_instances(
+            2, 'key', '/unused/key.pub', '/unused/key', 'secgroup',
+            'm1.tiny', 'image-id', '',
+            node_names=['test-node1', 'test-node2'])
+
+        assert instance_ids == ['i-1', 'i-2']
+        vms[1].add_tag.assert_called_once_with('Name', 'test-node2')
+        assert provider._instances['i-1'] is vms[0]
+
+    def test_start_instances_quota_error(self):
+        """
+        BotoCloudProvider: instance quota errors are cluster errors
+        """
+        from boto.exception import EC2ResponseError
+        provider = self._create_provider()
+        con = MagicMock()
+        provider._ec2_connection = con
+        # pretend keypair and security group have been checked already
+        provider._start_params_cache[('key', 'secgroup', None)] = ('sg-1', [])
+        con.run_instances.side_effect = EC2ResponseError(
+            400, 'Bad Request',
+            '<Response><Errors><Error><Code>TooManyInstances</Code>'
+            '<Message>quota exceeded</Message></Error></Errors></Response>')
+
+        with pytest.raises(ClusterError):
+            provider.start_instances(
+                2, 'key', '/unused/key.pub', '/unused/key', 'secgroup',
+                'm1.tiny', 'image-id', '')
+        with pytest.raises(ClusterError):
+            provider.start_instance(
+                'key', '/unused/key.pub', '/unused/key', 'secgroup',
+                'm1.tiny', 'image-id', '')
+
+    def test_get_instances_status(self):
+        """
+        BotoCloudProvider: query the state of many instances in chunks
+        """
+        provider = self._create_provider()
+        con = MagicMock()
+        provider._ec2_connection = con
+        provider.max_instances_per_request = 2
+
+        def get_only_instances(filters):
+            return [MagicMock(id=instance_id, state='running',
+                              private_ip_address='10.0.0.1', ip_address=None)
+                    for instance_id in filters['instance-id']
+                    if instance_id != 'i-3']
+        con.get_only_instances.side_effect = get_only_instances
+
+        status = provider.get_instances_status(['i-1', 'i-2', 'i-3', 'i-4', 'i-5'])
+
+        assert con.get_only_instances.call_count == 3
+        assert status == [
+            (True, ['10.0.0.1']),
+            (True, ['10.0.0.1']),
+            (False, None),
+            (True, ['10.0.0.1']),
+            (True, ['10.0.0.1']),
+        ]
+
+    def test_find_image_id_cached(self):
+        """
+        BotoCloudProvider: image lookups are shared via the metadata cache
+        """
+        cache = DiskCache(os.path.join(tempfile.mkdtemp(), 'cache.json'))
+
+        image = MagicMock(id='ami-1')
+        image.name = 'my-image'
+        provider = self._create_provider()
+        provider.metadata_cache = cache
+        provider._ec2_connection = MagicMock()
+        provider._ec2_connection.get_all_images.return_value = [image]
+        assert provider._find_image_id('my-image') == 'ami-1'
+
+        # another provider instance (e.g., in a later ElastiCluster run)
+        # does not query the cloud
+        provider = self._create_provider()
+        provider.metadata_cache = DiskCache(cache.path)
+        provider._ec2_connection = MagicMock()
+        assert provider._find_image_id('my-image') == 'ami-1'
+        assert provider._ec2_connection.get_all_images.call_count == 0
+
+        os.unlink(cache.path)
+
     def test_stop_instance(self):
         """
         BotoCloudProvider: stop instance
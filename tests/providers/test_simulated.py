@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018  University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import
+
+# 3rd-party imports
+from pytest import raises
+
+# ElastiCluster imports
+from elasticluster.exceptions import ConfigurationError
+from elasticluster.providers import is_throttling_error
+from elasticluster.providers.simulated import (
+    SimulatedCloudError,
+    SimulatedCloudProvider,
+    make_distribution,
+)
+
+
+def _start_args():
+    return ('key', '/pub', '/priv', 'default', 'flavor', 'image', '')
+
+
+def test_make_distribution_errors():
+    with raises(ConfigurationError):
+        make_distribution('gamma:1,2')
+    with raises(ConfigurationError):
+        make_distribution('uniform:1')
+    with raises(ConfigurationError):
+        make_distribution('normal:a,b')
+
+
+def test_quota_fills_batch_partially():
+    provider = SimulatedCloudProvider(boot_time='0', quota=3)
+    ids = provider.start_instances(
+        5, *_start_args(), node_names=['n1', 'n2', 'n3', 'n4', 'n5'])
+    assert len([i for i in ids if i]) == 3
+    assert ids[3:] == [None, None]
+    with raises(SimulatedCloudError):
+        provider.start_instance(*_start_args(), node_name='n6')
+    assert provider.api_calls == {'start_instances': 1, 'start_instance': 1}
+
+
+def test_throttling():
+    provider = SimulatedCloudProvider(throttle_rate=0.1, throttle_burst=1)
+    provider.preflight([])
+    with raises(SimulatedCloudError) as err:
+        provider.preflight([])
+    assert is_throttling_error(err.value)
+    assert provider.throttled_calls == 1
+
@@ -19,6 +19,11 @@
 
 from __future__ import absolute_import
 
+# stdlib imports
+import pickle
+import threading
+import time
+
 # this is needed to get logging info in `py.test` when something fails
 import logging
 logging.basicConfig()
@@ -29,10 +34,15 @@ import pytest
 from pytest import raises
 
 # ElastiCluster imports
-from elasticluster.exceptions import ClusterError
+from elasticluster.cluster import Node, NodeStartupPipeline
+from elasticluster.exceptions import ClusterError, NodeNotFound
+from elasticluster.providers import limit_api_calls
+from elasticluster.providers.simulated import (
+    SimulatedCloudProvider, connect_stub)
+from elasticluster.repository import JsonRepository
 
 # local test imports
-from _helpers.config import make_cluster
+from _helpers.config import make_cluster, make_slow_cloud
 from _helpers.environ import clean_os_environ_openstack
 
 
@@ -101,8 +111,11 @@ def test_start(tmpdir):
     cloud_provider.start_instance.return_value = u'test-id'
     cloud_provider.get_ips.return_value = ['127.0.0.1']
     cloud_provider.is_instance_running.return_value = True
+    cloud_provider.get_instances_status.side_effect = (
+        lambda ids: [(True, ['127.0.0.1']) for _ in ids])
 
     cluster = make_cluster(tmpdir, template='example_ec2', cloud=cloud_provider)
+    cluster.polling_interval = 0.1
     cluster.repository = MagicMock()
     cluster.repository.storage_path = '/unused/path'
 
@@ -110,10 +123,298 @@ def test_start(tmpdir):
         cluster.start()
 
     cluster.repository.save_or_update.assert_called_with(cluster)
+    # start parameters are checked once, with one spec per node kind
+    assert cloud_provider.preflight.call_count == 1
+    (specs,), _ = cloud_provider.preflight.call_args
+    assert (sorted(spec['flavor'] for spec in specs)
+            == sorted(nodes[0].flavor for nodes in cluster.nodes.values()))
+    # nodes are polled in batches, and each node only until it's running
+    polled = sum(len(args[0]) for args, _ in
+                 cloud_provider.get_instances_status.call_args_list)
+    assert polled == len(cluster.get_all_nodes())
 
     for node in cluster.get_all_nodes():
         assert node.instance_id == u'test-id'
         assert node.ips == ['127.0.0.1']
+        # lifecycle events are recorded in order
+        times = [node.timeline[event] for event in (
+            'start_requested', 'started', 'running', 'reachable')]
+        assert times == sorted(times)
+
+
+def test_start_batched(tmpdir):
+    """
+    Start nodes of the same kind with a single request.
+    """
+    cloud_provider = MagicMock()
+    cloud_provider.max_instances_per_request = 10
+    cloud_provider.start_instance.side_effect = (
+        lambda *args, **kwargs: kwargs['node_name'])
+    # the last node of each batch cannot be started
+    cloud_provider.start_instances.side_effect = (
+        lambda count, **kwargs: kwargs['node_names'][:-1] + [None])
+    cloud_provider.get_instances_status.side_effect = (
+        lambda ids: [(True, ['127.0.0.1']) for _ in ids])
+    cluster = make_cluster(tmpdir, cloud=cloud_provider)
+    cluster.polling_interval = 0.05
+    cluster.repository = MagicMock()
+    cluster.repository.storage_path = '/unused/path'
+
+    with patch('paramiko.SSHClient'):
+        cluster.start()
+
+    # one request for the two compute nodes ...
+    assert cloud_provider.start_instances.call_count == 1
+    (count,), kwargs = cloud_provider.start_instances.call_args
+    assert count == 2
+    assert kwargs['node_names'] == [
+        cluster.name + '-compute001', cluster.name + '-compute002']
+    assert kwargs['flavor'] == cluster.nodes['compute'][0].flavor
+    # ... and single-node requests for the frontend and the node
+    # that could not be started in the batch
+    started = sorted(kwargs['node_name'] for _, kwargs
+                     in cloud_provider.start_instance.call_args_list)
+    assert started == [
+        cluster.name + '-compute002', cluster.name + '-frontend001']
+    for node in cluster.get_all_nodes():
+        assert node.instance_id == cluster.name + '-' + node.name
+
+
+def test_start_pipeline(tmpdir):
+    """
+    Check that nodes are bootstrapped without waiting for slower nodes.
+    """
+    cluster, _, slow = make_slow_cloud(tmpdir, ['compute001'])
+
+    batches = []
+    def bootstrap_nodes(cluster, nodes):  # pylint: disable=missing-docstring,unused-argument
+        batches.append(set(node.name for node in nodes))
+        # let the slow node run only after the others are bootstrapped
+        if 'compute001' not in batches[-1]:
+            slow.clear()
+        return True
+    cluster._setup_provider.bootstrap_nodes.side_effect = bootstrap_nodes
+
+    with patch('paramiko.SSHClient'):
+        cluster.start()
+
+    assert 'compute001' not in batches[0]
+    assert set.union(*batches) == set(['frontend001', 'compute001', 'compute002'])
+
+
+def test_start_early_quorum(tmpdir):
+    """
+    Check that setup starts once the minimum number of nodes is up.
+    """
+    cluster, _, slow = make_slow_cloud(tmpdir, ['compute001'])
+
+    configured = []
+    def setup_cluster(cluster, extra_args, nodes=None):  # pylint: disable=missing-docstring,unused-argument
+        if nodes is None:
+            nodes = cluster.get_all_nodes()
+        configured.append(set(node.name for node in nodes))
+        # let the slow node come up only after the first setup
+        slow.clear()
+        return True
+    cluster._setup_provider.setup_cluster.side_effect = setup_cluster
+
+    with patch('paramiko.SSHClient'):
+        cluster.start({'frontend': 1, 'compute': 1}, early_quorum=True)
+        assert cluster.setup()
+        assert cluster.setup_late_nodes()
+
+    # late nodes are configured together with the rest of the cluster
+    assert configured == [
+        set(['frontend001', 'compute002']),
+        set(['frontend001', 'compute001', 'compute002']),
+    ]
+
+
+def test_start_early_quorum_setup_result(tmpdir):
+    """
+    Check that the outcome of the last (whole cluster) setup is reported.
+    """
+    cluster, _, slow = make_slow_cloud(tmpdir, ['compute001'])
+    # the early setup fails, the one including the late node succeeds
+    cluster._setup_provider.setup_cluster.side_effect = [False, True]
+
+    with patch('paramiko.SSHClient'):
+        cluster.start({'frontend': 1, 'compute': 1}, early_quorum=True)
+        assert not cluster.setup()
+        slow.clear()
+        assert cluster.setup_late_nodes()
+
+
+def test_start_early_quorum_saves_cluster(tmpdir):
+    """
+    Check that the cluster can be saved while nodes are still starting.
+    """
+    cluster, _, slow = make_slow_cloud(tmpdir, ['compute001'])
+    cluster.repository = JsonRepository(str(tmpdir))
+    cluster._setup_provider.setup_cluster.return_value = True
+
+    with patch('paramiko.SSHClient'):
+        cluster.start({'frontend': 1, 'compute': 1}, early_quorum=True)
+        assert cluster._startup_pipeline is not None
+        cluster.repository.save_or_update(cluster)
+        assert cluster.setup()
+        slow.clear()
+        assert cluster.setup_late_nodes()
+
+    saved = cluster.repository.get(cluster.name)
+    assert (sorted(node.instance_id for node in saved.get_all_nodes())
+            == sorted(node.instance_id for node in cluster.get_all_nodes()))
+
+
+def test_start_early_quorum_error(tmpdir):
+    """
+    Check that errors in the background startup thread are not lost.
+    """
+    cluster, _, _ = make_slow_cloud(
+        tmpdir, ['frontend001', 'compute001', 'compute002'])
+    cluster.repository.save_or_update.side_effect = IOError('disk full')
+
+    with raises(IOError):
+        cluster.start({'frontend': 1, 'compute': 1}, early_quorum=True)
+
+
+def test_start_replace_stragglers(tmpdir):
+    """
+    Check that a node much slower than the others is started anew.
+    """
+    cluster, cloud_provider, _ = make_slow_cloud(tmpdir, ['compute001'])
+    cluster.straggler_factor = 2
+    # the replacement VM gets a different instance ID, which is not slow
+    started = set()
+    def start_instance(*args, **kwargs):  # pylint: disable=missing-docstring,unused-argument
+        name = kwargs['node_name']
+        instance_id = (name + '-new' if name in started else name)
+        started.add(name)
+        return instance_id
+    cloud_provider.start_instance.side_effect = start_instance
+    slow = cluster.name + '-compute001'
+
+    with patch('paramiko.SSHClient'):
+        with patch.object(NodeStartupPipeline, 'straggler_min_samples', 2):
+            cluster.start()
+
+    cloud_provider.stop_instance.assert_called_once_with(slow)
+    compute001 = cluster.get_node_by_name('compute001')
+    assert compute001.instance_id == slow + '-new'
+
+
+def test_start_overprovision(tmpdir):
+    """
+    Check that spare nodes are started, and the slowest ones released.
+    """
+    cluster, cloud_provider, slow = make_slow_cloud(
+        tmpdir, ['frontend001', 'compute002'])
+    cluster.overprovision = 1
+
+    with patch('paramiko.SSHClient'):
+        cluster.start()
+
+    assert cloud_provider.start_instance.call_count == 5
+    assert (sorted(node.name for node in cluster.get_all_nodes())
+            == ['compute001', 'compute003', 'frontend002'])
+    assert (sorted(call[0][0] for call in cloud_provider.stop_instance.call_args_list)
+            == sorted(slow))
+
+
+def test_start_overprovision_failed_spare(tmpdir):
+    """
+    Check that a spare node that could not be started is removed.
+    """
+    cluster, cloud_provider, _ = make_slow_cloud(tmpdir)
+    cluster.overprovision = 1
+    failing = cluster.name + '-compute003'
+    def start_instance(*args, **kwargs):  # pylint: disable=missing-docstring,unused-argument
+        if kwargs['node_name'] == failing:
+            raise RuntimeError("Quota exceeded")
+        return kwargs['node_name']
+    cloud_provider.start_instance.side_effect = start_instance
+
+    with patch('paramiko.SSHClient'):
+        cluster.start()
+
+    assert 'compute003' not in [node.name for node in cluster.get_all_nodes()]
+    assert len(cluster.nodes['compute']) == 2
+    assert len(cluster.nodes['frontend']) == 1
+    for node in cluster.get_all_nodes():
+        assert node.instance_id
+
+
+def test_start_simulated(tmpdir):
+    """
+    Start and stop a cluster on the simulated cloud.
+    """
+    cloud_provider = limit_api_calls(SimulatedCloudProvider(
+        boot_time='uniform:0.05,0.1', ssh_delay='0.05', seed=1))
+    cluster = make_cluster(tmpdir, cloud=cloud_provider)
+    cluster.polling_interval = 0.05
+    cluster.bootstrap_max_concurrency = 0
+
+    with patch.object(Node, 'connect', connect_stub):
+        cluster.start()
+
+    nodes = cluster.get_all_nodes()
+    assert len(nodes) == 3
+    for node in nodes:
+        assert node.instance_id.startswith('sim-')
+        assert node.preferred_ip.startswith('10.')
+    assert cloud_provider.api_calls['start_instance'] == 3
+
+    cluster.stop(wait=True)
+    assert cloud_provider.get_instances_status(
+        [node.instance_id for node in nodes]) == [(False, None)] * 3
+
+
+def test_gather_node_ip_addresses_concurrently(tmpdir):
+    """
+    Check that SSH probes run concurrently and within the given bound.
+    """
+    # pylint: disable=protected-access
+    cluster = make_cluster(tmpdir)
+    cluster.ssh_probe_max_concurrency = 2
+    nodes = cluster.get_all_nodes()
+
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    def connect(**kwargs):  # pylint: disable=unused-argument,missing-docstring
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.1)
+        with lock:
+            running[0] -= 1
+        ssh = MagicMock()
+        ssh.get_host_keys.return_value = {}
+        return ssh
+    for node in nodes:
+        node.connect = connect
+
+    unreachable = cluster._gather_node_ip_addresses(nodes, 10, 1)
+    assert not unreachable
+    assert max_running[0] == 2
+
+
+def test_gather_node_ip_addresses_timeout(tmpdir):
+    """
+    Check that unreachable nodes are reported after the timeout expires.
+    """
+    # pylint: disable=protected-access
+    cluster = make_cluster(tmpdir)
+    cluster.polling_interval = 0.1
+    nodes = cluster.get_all_nodes()
+    for node in nodes:
+        node.connect = MagicMock(return_value=None)
+    ok_node = nodes[0]
+    ok_node.connect = MagicMock()
+    ok_node.connect.return_value.get_host_keys.return_value = {}
+
+    unreachable = cluster._gather_node_ip_addresses(nodes, 1, 1)
+    assert unreachable == set(nodes[1:])
 
 
 def test_check_cluster_size_ok(tmpdir):
@@ -151,6 +452,32 @@ def test_get_all_nodes(tmpdir):
     assert len([node for node in all_nodes if node.name.startswith('compute')]) == 2
 
 
+def test_get_node_by_name(tmpdir):
+    """
+    Check that the node name index follows changes to the cluster.
+    """
+    # pylint: disable=protected-access
+    cluster = make_cluster(tmpdir)
+    node = cluster.add_node('compute', 'image_id', 'image_user', 'flavor',
+                            'security_group', name='compute009')
+    assert cluster.get_node_by_name('compute009') is node
+    cluster._remove_nodes([node])
+    assert node not in cluster.nodes['compute']
+    with raises(NodeNotFound):
+        cluster.get_node_by_name('compute009')
+    # index is rebuilt if node lists are modified directly ...
+    other = cluster.nodes['compute'].pop()
+    cluster.nodes['compute'].append(node)
+    cluster.nodes['compute'].remove(cluster.nodes['compute'][0])
+    assert cluster.get_node_by_name('compute009') is node
+    with raises(NodeNotFound):
+        cluster.get_node_by_name(other.name)
+    # ... and after unpickling
+    cluster.repository = None
+    state = pickle.loads(pickle.dumps(cluster, pickle.HIGHEST_PROTOCOL))
+    assert state.get_node_by_name('compute009').name == 'compute009'
+
+
 def test_stop(tmpdir):
     """
     Test `Cluster.stop()`
@@ -181,6 +508,38 @@ def test_stop(tmpdir):
     cluster.repository.delete.assert_called_once_with(cluster)
 
 
+def test_stop_wait(tmpdir):
+    """
+    Test `Cluster.stop(wait=True)` with concurrent requests.
+    """
+    cloud_provider = MagicMock()
+    cluster = make_cluster(tmpdir, cloud=cloud_provider)
+    cluster.polling_interval = 0.01
+    for node in cluster.get_all_nodes():
+        node.instance_id = node.name
+    cluster.repository = MagicMock()
+    cluster.repository.storage_path = '/unused/path'
+
+    # each VM is reported as running once after termination
+    polled = []
+    def get_instances_status(ids):  # pylint: disable=missing-docstring
+        polled.append(sorted(ids))
+        return [(len(polled) == 1, None) for _ in ids]
+    cloud_provider.get_instances_status.side_effect = get_instances_status
+    # `MagicMock.call_count` is not updated atomically, so concurrent
+    # calls could be lost; `list.append` is thread-safe instead
+    stopped = []
+    cloud_provider.stop_instance.side_effect = stopped.append
+
+    cluster.stop(wait=True, max_concurrent_requests=3)
+
+    assert sorted(stopped) == ['compute001', 'compute002', 'frontend001']
+    assert polled == [['compute001', 'compute002', 'frontend001']] * 2
+    assert not cloud_provider.is_instance_running.called
+    assert cluster.get_all_nodes() == []
+    cluster.repository.delete.assert_called_once_with(cluster)
+
+
 def test_get_ssh_to_node_with_class(tmpdir):
     """
     Get frontend node
@@ -230,11 +589,15 @@ def test_update(tmpdir):
     cloud_provider = MagicMock()
     ip_addr = '127.0.0.1'
     cloud_provider.get_ips.return_value = (ip_addr, ip_addr)
+    cloud_provider.get_instances_status.side_effect = (
+        lambda ids: [(True, [ip_addr, ip_addr]) for _ in ids])
 
     storage = MagicMock()
 
     cluster = make_cluster(tmpdir, cloud=cloud_provider)
     cluster.repository = storage
+    for node in cluster.get_all_nodes():
+        node.instance_id = u'test-id'
 
     with patch('paramiko.SSHClient'):
         cluster.update()
@@ -243,6 +606,39 @@ def test_update(tmpdir):
         assert ip_addr == node.ips[0]
 
 
+def test_update_concurrently(tmpdir):
+    """
+    Check that `Cluster.update()` connects to nodes concurrently.
+    """
+    cloud_provider = MagicMock()
+    cloud_provider.get_instances_status.side_effect = (
+        lambda ids: [(True, ['127.0.0.1']) for _ in ids])
+    cluster = make_cluster(tmpdir, cloud=cloud_provider)
+    cluster.repository = MagicMock()
+    for node in cluster.get_all_nodes():
+        node.instance_id = node.name
+
+    lock = threading.Lock()
+    active = [0, 0]  # current, max
+    def connect(*args, **kwargs):  # pylint: disable=missing-docstring,unused-argument
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.2)
+        with lock:
+            active[0] -= 1
+    with patch('paramiko.SSHClient') as ssh_client:
+        ssh_client.return_value.connect.side_effect = connect
+        cluster.update()
+
+    assert active[1] == 3
+    assert cloud_provider.get_instances_status.call_count == 1
+    (ids,), _ = cloud_provider.get_instances_status.call_args
+    assert sorted(ids) == ['compute001', 'compute002', 'frontend001']
+    for node in cluster.get_all_nodes():
+        assert node.preferred_ip == '127.0.0.1'
+
+
 def test_dict_mixin(tmpdir):
     """Check that instances of the `Cluster` class can be recast as Python dictionary."""
     cluster = make_cluster(tmpdir, template='example_ec2')
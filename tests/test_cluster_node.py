@@ -27,6 +27,7 @@ import logging
 logging.basicConfig()
 
 # stdlib imports
+import pickle
 from tempfile import NamedTemporaryFile
 
 # 3rd-party imports
@@ -105,6 +106,26 @@ def test_stop(node):
     node._cloud_provider.stop_instance.assert_called_once_with(INSTANCE_ID)
 
 
+def test_stop_wait(node):
+    """
+    Test `Node.stop(wait=True)` polls until the VM is no longer running.
+    """
+    INSTANCE_ID = 'test-id'
+    node.instance_id = INSTANCE_ID
+    node._cloud_provider.is_instance_running.side_effect = [True, True, False]
+
+    with patch('time.sleep') as sleep:
+        node.stop(wait=True)
+
+    assert node._cloud_provider.is_instance_running.call_count == 3
+    assert sleep.call_count == 2
+    # delays grow between successive polls
+    (first,), _ = sleep.call_args_list[0]
+    (second,), _ = sleep.call_args_list[1]
+    assert first < second
+    assert node.instance_id is None
+
+
 def test_stop_with_no_id(node):
     """
     Test `Node.stop()` when the node has ID ``None``
@@ -187,5 +208,20 @@ def test_dict_mixin(node):
     assert node['_cloud_provider'] == node._cloud_provider
 
 
+def test_pickle(node):
+    """Check that only the attributes in `Node.ATTRIBUTES` are saved"""
+    # pylint: disable=protected-access
+    node.extra['foo'] = 'bar'
+    assert 'extra' in node
+    assert 'foo' not in node
+    with pytest.raises(KeyError):
+        node['foo'] = 'bar'
+
+    state = pickle.loads(pickle.dumps(node, pickle.HIGHEST_PROTOCOL))
+    assert state == node
+    assert state._cloud_provider is None
+    assert state.extra == {'foo': 'bar'}
+
+
 if __name__ == "__main__":
     pytest.main(['-v', __file__])
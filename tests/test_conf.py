@@ -315,6 +315,87 @@ project_name = test
     assert isinstance(cloud, OpenStackCloudProvider)
 
 
+def test_cloud_provider_metadata_cache(tmpdir):
+    wd = tmpdir.strpath
+    ssh_key_path = os.path.join(wd, 'id_rsa.pem')
+    with open(ssh_key_path, 'w+') as ssh_key_file:
+        # don't really care about SSH key, just that the file exists
+        ssh_key_file.write('')
+        ssh_key_file.flush()
+    config_path = os.path.join(wd, 'config.ini')
+    with open(config_path, 'w+') as config_file:
+        config_file.write(
+            """
+[cloud/openstack]
+provider = openstack
+auth_url = http://openstack.example.com:5000/v2.0
+username = ${USER}
+password = XXXXXX
+project_name = test
+metadata_cache_ttl = 600
+    """
+            + make_config_snippet("cluster", "example_openstack")
+            + make_config_snippet("login", "ubuntu", keyname='test', valid_path=ssh_key_path)
+            + make_config_snippet("setup", "slurm_setup_old")
+        )
+    storage_path = os.path.join(wd, 'storage')
+    creator = make_creator(config_path, storage_path=storage_path)
+    cloud = creator.create_cloud_provider('example_openstack')
+    assert cloud.metadata_cache.ttl == 600
+    cache_path = cloud.metadata_cache.path
+    assert os.path.dirname(cache_path) == os.path.join(storage_path, 'cache')
+    # the credentials are not part of the file name
+    assert 'XXXXXX' not in cache_path
+
+    # a different cloud section gets a different cache
+    creator.cluster_conf['example_openstack']['cloud']['password'] = 'YYYYYY'
+    cloud = creator.create_cloud_provider('example_openstack')
+    assert cloud.metadata_cache.path != cache_path
+
+    # caching can be disabled
+    creator.cluster_conf['example_openstack']['cloud']['metadata_cache_ttl'] = 0
+    cloud = creator.create_cloud_provider('example_openstack')
+    assert cloud.metadata_cache is None
+
+
+def test_storage_section(tmpdir):
+    wd = tmpdir.strpath
+    ssh_key_path = os.path.join(wd, 'id_rsa.pem')
+    with open(ssh_key_path, 'w+') as ssh_key_file:
+        # don't really care about SSH key, just that the file exists
+        ssh_key_file.write('')
+        ssh_key_file.flush()
+    snippets = (
+        make_config_snippet("cloud", "openstack")
+        + make_config_snippet("cluster", "example_openstack")
+        + make_config_snippet("login", "ubuntu", keyname='test', valid_path=ssh_key_path)
+        + make_config_snippet("setup", "slurm_setup_old")
+    )
+    storage_path = os.path.join(wd, 'storage')
+
+    # journaling is off by default
+    config_path = os.path.join(wd, 'config.ini')
+    with open(config_path, 'w+') as config_file:
+        config_file.write(snippets)
+    creator = make_creator(config_path, storage_path=storage_path)
+    assert not creator.storage_journal
+    assert not creator.create_repository().journal
+
+    config_path = os.path.join(wd, 'config-journal.ini')
+    with open(config_path, 'w+') as config_file:
+        config_file.write(
+            """
+[storage]
+storage_type = json
+storage_journal = yes
+    """
+            + snippets)
+    creator = make_creator(config_path, storage_path=storage_path)
+    assert creator.storage_type == 'json'
+    assert creator.storage_journal
+    assert creator.create_repository().journal
+
+
 def test_get_cloud_provider_invalid(tmpdir):
     wd = tmpdir.strpath
     ssh_key_path = os.path.join(wd, 'id_rsa.pem')
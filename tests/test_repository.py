@@ -28,16 +28,22 @@ logging.basicConfig()
 
 import json
 import os
+import pickle
 import shutil
 import tempfile
 import unittest
 
+import yaml
+
 from elasticluster import Cluster
 from elasticluster.cluster import Struct, Node
+from elasticluster.exceptions import ClusterNotFound
 from elasticluster.repository import PickleRepository, MemRepository, \
-    JsonRepository, YamlRepository, MultiDiskRepository
+    JsonRepository, YamlRepository, MultiDiskRepository, SqliteRepository, \
+    ClusterIndex, _ClusterDumper
 
 import pytest
+from mock import patch
 
 
 __docformat__ = 'reStructuredText'
@@ -234,6 +240,282 @@ class YamlRepositoryTests(unittest.TestCase):
         assert isinstance(cluster.nodes['foo'][0], Node)
         assert cluster.nodes['foo'][0].name == 'foo123'
 
+    def test_saving_node_timeline(self):
+        cluster = Cluster(name='test1', repository=self.storage)
+        node = cluster.add_node(kind='foo', image_id='123',
+                                image_user='s3it', flavor='m1.tiny',
+                                security_group='default', name='foo123')
+        node.record_event('start_requested', 1000.0)
+        node.record_event('started', 1002.5)
+        self.storage.save_or_update(cluster)
+        new = self.storage.get(cluster.name)
+        assert new.nodes['foo'][0].timeline == {
+            'start_requested': 1000.0, 'started': 1002.5}
+        assert 'timeline' not in new.nodes['foo'][0].extra
+
+    def _check_round_trip(self):
+        cluster = Cluster(name='test1', template='tmpl', ssh_to='foo',
+                          user_key_name='key', repository=self.storage)
+        for name in 'foo001', 'foo002':
+            node = cluster.add_node(kind='foo', image_id='123',
+                                    image_user='s3it', flavor='m1.tiny',
+                                    security_group='default', name=name,
+                                    network_ids=('net1', 'net2'))
+            node.instance_id = 'i-' + name
+            node.ips = ['10.0.0.1', '192.0.2.1']
+            node.preferred_ip = '10.0.0.1'
+            node.record_event('started', 1002.5)
+        self.storage.save_or_update(cluster)
+
+        # the file only holds plain mappings, without the omitted fields
+        with open(os.path.join(self.path, 'test1.yaml')) as storage:
+            data = yaml.safe_load(storage)
+        for key in ('_cloud_provider', '_lock', '_naming_policy',
+                    '_nodes_by_name', '_setup_provider', '_startup_pipeline',
+                    'repository', 'storage_file'):
+            assert key not in data
+        assert sorted(data['nodes']['foo'][0].keys()) == sorted(Node.ATTRIBUTES)
+
+        new = YamlRepository(self.path).get('test1')
+        assert new.template == 'tmpl'
+        assert new.ssh_to == 'foo'
+        assert new.repository is not None
+        assert [dict(node) for node in new.nodes['foo']] == [
+            dict(node, extra={'network_ids': ['net1', 'net2']})
+            for node in cluster.nodes['foo']]
+        assert isinstance(new.nodes['foo'][0], Node)
+
+    def test_round_trip(self):
+        self._check_round_trip()
+
+    def test_round_trip_without_libyaml(self):
+        class PureDumper(yaml.SafeDumper):
+            yaml_representers = _ClusterDumper.yaml_representers
+            yaml_multi_representers = _ClusterDumper.yaml_multi_representers
+        with patch('elasticluster.repository._ClusterDumper', PureDumper):
+            with patch('elasticluster.repository._YamlLoader',
+                       yaml.SafeLoader):
+                self._check_round_trip()
+
+    def test_load_old_file(self):
+        # as written by ElastiCluster before nodes had a timeline
+        with open(os.path.join(self.path, 'old.yaml'), 'w') as storage:
+            storage.write("""\
+extra: {}
+name: old
+nodes:
+    foo:
+    -   cluster_name: old
+        extra: {}
+        flavor: m1.tiny
+        image_id: '123'
+        image_user: s3it
+        image_userdata: ''
+        instance_id: i-123
+        ips:
+        - 10.0.0.1
+        kind: foo
+        name: foo001
+        preferred_ip: 10.0.0.1
+        security_group: default
+        ssh_proxy_command: ''
+        user_key_name: key
+        user_key_private: ~/.ssh/id_rsa
+        user_key_public: ~/.ssh/id_rsa.pub
+ssh_probe_timeout: 5
+ssh_proxy_command: ''
+ssh_to: null
+start_timeout: 600
+template: tmpl
+thread_pool_max_size: 10
+user_key_name: key
+user_key_private: ~/.ssh/id_rsa
+user_key_public: ~/.ssh/id_rsa.pub
+""")
+        cluster = self.storage.get('old')
+        node = cluster.get_node_by_name('foo001')
+        assert node.instance_id == 'i-123'
+        assert node.ips == ['10.0.0.1']
+        assert node.timeline == {}
+        # the cluster can be saved again in the current format
+        node.record_event('running', 1000.0)
+        self.storage.save_or_update(cluster)
+        new = YamlRepository(self.path).get('old')
+        assert new.get_node_by_name('foo001').timeline == {'running': 1000.0}
+
+    def test_unknown_objects_are_rejected(self):
+        class Unknown(object):
+            def keys(self):
+                return ['x']
+            def __getitem__(self, key):
+                return 1
+        cluster = Cluster(name='test1', repository=self.storage)
+        cluster.extra['unknown'] = Unknown()
+        with pytest.raises(yaml.representer.RepresenterError):
+            self.storage.save_or_update(cluster)
+
+
+class SqliteRepositoryTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.storage = SqliteRepository(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        del self.storage
+
+    def test_get_all(self):
+        clusters = [Cluster('test_%d' % i) for i in range(10)]
+        for cluster in clusters:
+            self.storage.save_or_update(cluster)
+
+        new_clusters = self.storage.get_all()
+        assert sorted(c.name for c in new_clusters) == sorted(
+            c.name for c in clusters)
+
+    def test_save_and_delete(self):
+        cluster = Cluster('test1')
+        self.storage.save_or_update(cluster)
+
+        clusterpath = os.path.join(self.path, 'test1.sqlite')
+        assert os.path.exists(clusterpath)
+
+        self.storage.delete(cluster)
+        assert not os.path.exists(clusterpath)
+
+    def test_saving_node_changes(self):
+        cluster = Cluster(name='test1', repository=self.storage)
+        for _ in range(3):
+            cluster.add_node(kind='foo', image_id='123',
+                             image_user='s3it', flavor='m1.tiny',
+                             security_group='default')
+        self.storage.save_or_update(cluster)
+
+        cluster.get_node_by_name('foo001').instance_id = 'test-id'
+        del cluster.nodes['foo'][1]
+        cluster.add_node(kind='foo', image_id='123',
+                         image_user='s3it', flavor='m1.tiny',
+                         security_group='default', name='foo004')
+        # changes are saved by another process
+        SqliteRepository(self.path).save_or_update(cluster)
+
+        new = self.storage.get('test1')
+        assert [node.name for node in new.nodes['foo']] == [
+            'foo001', 'foo003', 'foo004']
+        assert isinstance(new.nodes['foo'][0], Node)
+        assert new.get_node_by_name('foo001').instance_id == 'test-id'
+        assert new.repository is self.storage
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.storage = YamlRepository(self.path, journal=True)
+        self.cluster = Cluster(name='test1', repository=self.storage)
+        for _ in range(3):
+            self.cluster.add_node(kind='foo', image_id='123',
+                                  image_user='s3it', flavor='m1.tiny',
+                                  security_group='default')
+        self.storage.save_or_update(self.cluster)
+        self.cluster_path = os.path.join(self.path, 'test1.yaml')
+        self.journal_path = self.cluster_path + '.journal'
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_only_changes_are_saved(self):
+        with open(self.cluster_path) as storage:
+            snapshot = storage.read()
+        foo001 = self.cluster.get_node_by_name('foo001')
+        foo001.instance_id = 'test-id'
+        # `Cluster.remove_node` would try to connect to the other nodes
+        del self.cluster.nodes['foo'][1]
+        self.cluster.add_node(kind='bar', image_id='456',
+                              image_user='s3it', flavor='m1.tiny',
+                              security_group='default', name='bar001')
+        self.cluster.ssh_to = 'bar'
+        self.storage.save_or_update(self.cluster)
+
+        with open(self.cluster_path) as storage:
+            assert storage.read() == snapshot
+        with open(self.journal_path) as journal:
+            records = [json.loads(line) for line in journal]
+        assert len(records) == 5
+        assert set(record.keys()[0] for record in records) == set(
+            ['snapshot', 'cluster', 'node', 'removed'])
+
+        new = YamlRepository(self.path).get('test1')
+        assert [node.name for node in new.nodes['foo']] == ['foo001', 'foo003']
+        assert new.get_node_by_name('foo001').instance_id == 'test-id'
+        assert new.get_node_by_name('bar001').image_id == '456'
+        assert new.ssh_to == 'bar'
+
+    def test_compaction(self):
+        self.storage.journal_min_size = 0
+        node = self.cluster.get_node_by_name('foo001')
+        for index in range(20):
+            node.instance_id = 'test-id-%d' % index
+            self.storage.save_or_update(self.cluster)
+            # the journal is merged into the cluster file once it is larger
+            if os.path.exists(self.journal_path):
+                assert (os.path.getsize(self.journal_path)
+                        <= os.path.getsize(self.cluster_path))
+        with open(self.cluster_path) as storage:
+            assert 'test-id-' in storage.read()
+
+        self.storage.compact(self.cluster)
+        assert not os.path.exists(self.journal_path)
+        new = YamlRepository(self.path).get('test1')
+        assert new.get_node_by_name('foo001').instance_id == 'test-id-19'
+
+    def test_truncated_journal(self):
+        self.cluster.get_node_by_name('foo001').instance_id = 'test-id'
+        self.storage.save_or_update(self.cluster)
+        with open(self.journal_path, 'a') as journal:
+            journal.write('{"node": {"kind": "foo", "na')
+        new = YamlRepository(self.path).get('test1')
+        assert new.get_node_by_name('foo001').instance_id == 'test-id'
+
+    def test_stale_journal(self):
+        self.cluster.get_node_by_name('foo001').instance_id = 'test-id'
+        self.storage.save_or_update(self.cluster)
+        with open(self.journal_path) as journal:
+            stale = journal.read()
+        self.cluster.get_node_by_name('foo001').instance_id = 'new-id'
+        self.storage.compact(self.cluster)
+        # simulate an interruption between writing the new cluster
+        # file and removing the journal
+        with open(self.journal_path, 'w') as journal:
+            journal.write(stale)
+
+        new = YamlRepository(self.path, journal=True).get('test1')
+        assert new.get_node_by_name('foo001').instance_id == 'new-id'
+        assert not os.path.exists(self.journal_path)
+
+    def test_only_changed_nodes_are_encoded(self):
+        self.cluster.get_node_by_name('foo001').instance_id = 'test-id'
+        with patch.object(YamlRepository, '_encode_node',
+                          wraps=YamlRepository._encode_node) as encode:
+            self.storage.save_or_update(self.cluster)
+            assert encode.call_count == 1
+            self.storage.save_or_update(self.cluster)
+            assert encode.call_count == 1
+            self.cluster.get_node_by_name('foo002').record_event('started')
+            self.storage.save_or_update(self.cluster)
+            assert encode.call_count == 2
+
+        new = YamlRepository(self.path).get('test1')
+        assert new.get_node_by_name('foo001').instance_id == 'test-id'
+        assert 'started' in new.get_node_by_name('foo002').timeline
+
+    def test_delete(self):
+        self.cluster.get_node_by_name('foo001').instance_id = 'test-id'
+        self.storage.save_or_update(self.cluster)
+        assert os.path.exists(self.journal_path)
+        self.storage.delete(self.cluster)
+        assert not os.path.exists(self.journal_path)
+        assert not os.path.exists(self.cluster_path)
+
 
 class TestMultiDiskRepository(unittest.TestCase):
     def setUp(self):
@@ -261,8 +543,108 @@ class TestMultiDiskRepository(unittest.TestCase):
         assert os.path.exists(
             os.path.join(self.path, cluster.name + '.' + store_type))
 
+    def test_store_cache(self):
+        storage = MultiDiskRepository(self.path, default_store='json')
+        cluster = Cluster(name='test1', repository=storage)
+        storage.save_or_update(cluster)
+
+        # the store of a known cluster is not looked up again, even
+        # after pickling and unpickling the cluster
+        cluster = pickle.loads(pickle.dumps(cluster))
+        with patch('glob.glob', side_effect=AssertionError):
+            cluster.repository.save_or_update(cluster)
+            assert cluster.repository.get('test1').name == 'test1'
+
+        cluster.repository.delete(cluster)
+        with pytest.raises(ClusterNotFound):
+            cluster.repository.get('test1')
+
+    def test_iter_clusters(self):
+        storage = MultiDiskRepository(self.path)
+        for name in 'test1', 'test2':
+            storage.save_or_update(Cluster(name=name, repository=storage))
+
+        with patch.object(YamlRepository, 'get', side_effect=AssertionError):
+            handles = sorted(storage.iter_clusters(), key=lambda h: h.name)
+            assert [(h.name, h.format) for h in handles] == [
+                ('test1', 'yaml'), ('test2', 'yaml')]
+        assert handles[0].path == os.path.join(self.path, 'test1.yaml')
+        # clusters are loaded on first access
+        assert handles[1].cluster.name == 'test2'
+        assert handles[1].cluster is handles[1].cluster
+
+    def test_summary_index(self):
+        storage = MultiDiskRepository(self.path)
+        for name, size in ('test1', 2), ('test2', 0):
+            cluster = Cluster(name=name, template='tmpl', repository=storage)
+            for _ in range(size):
+                cluster.add_node(kind='foo', image_id='123',
+                                 image_user='s3it', flavor='m1.tiny',
+                                 security_group='default')
+            storage.save_or_update(cluster)
+        index_path = os.path.join(self.path, 'clusters.index')
+        assert os.path.exists(index_path)
+
+        # cluster files are not read if the index is up-to-date
+        with patch.object(YamlRepository, 'get', side_effect=AssertionError):
+            summaries = MultiDiskRepository(self.path).get_summaries()
+        assert [(s['name'], s['template'], s['nodes']) for s in summaries] == [
+            ('test1', 'tmpl', {'foo': 2}),
+            ('test2', 'tmpl', {}),
+        ]
+
+        # index is rebuilt if missing
+        os.unlink(index_path)
+        assert MultiDiskRepository(self.path).get_summaries() == summaries
+        assert os.path.exists(index_path)
+
+        # stale entries are refreshed, and deleted clusters dropped
+        cluster = storage.get('test2')
+        cluster.add_node(kind='bar', image_id='123',
+                         image_user='s3it', flavor='m1.tiny',
+                         security_group='default')
+        with open(os.path.join(self.path, 'test2.yaml'), 'w') as fp:
+            YamlRepository.dump(cluster, fp)
+        os.unlink(os.path.join(self.path, 'test1.yaml'))
+        summaries = MultiDiskRepository(self.path).get_summaries()
+        assert [(s['name'], s['nodes']) for s in summaries] == [
+            ('test2', {'bar': 1})]
+
+        storage.delete(cluster)
+        assert MultiDiskRepository(self.path).get_summaries() == []
+
+    def test_summary_index_not_rewritten(self):
+        storage = MultiDiskRepository(self.path)
+        cluster = Cluster(name='test1', template='tmpl', repository=storage)
+        node = cluster.add_node(kind='foo', image_id='123',
+                                image_user='s3it', flavor='m1.tiny',
+                                security_group='default')
+        storage.save_or_update(cluster)
+
+        # saves that do not change the summary leave the index alone
+        node.instance_id = 'test-id'
+        with patch.object(ClusterIndex, 'load', side_effect=AssertionError):
+            with patch.object(ClusterIndex, 'save', side_effect=AssertionError):
+                storage.save_or_update(cluster)
+
+        # ... and the modification time is refreshed when reading
+        summaries = MultiDiskRepository(self.path).get_summaries()
+        assert summaries[0]['mtime'] == os.path.getmtime(
+            os.path.join(self.path, 'test1.yaml'))
+        with patch.object(YamlRepository, 'get', side_effect=AssertionError):
+            assert MultiDiskRepository(self.path).get_summaries() == summaries
+
+        # adding a node updates the index
+        cluster.add_node(kind='foo', image_id='123',
+                         image_user='s3it', flavor='m1.tiny',
+                         security_group='default')
+        storage.save_or_update(cluster)
+        with patch.object(YamlRepository, 'get', side_effect=AssertionError):
+            summaries = MultiDiskRepository(self.path).get_summaries()
+        assert summaries[0]['nodes'] == {'foo': 2}
+
     def test_repository_default_type(self):
-        for store_type in ['yaml', 'json', 'pickle']:
+        for store_type in ['yaml', 'json', 'pickle', 'sqlite']:
             yield self.store_is_of_type, store_type
 
 
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018 University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import
+
+# stdlib imports
+import json
+
+# ElastiCluster imports
+from elasticluster import Cluster
+from elasticluster.timeline import make_trace, summarize
+
+
+def _make_cluster():
+    cluster = Cluster('test')
+    for index in range(3):
+        node = cluster.add_node('compute', 'image', 'user', 'flavor', 'default')
+        # node N boots in N+1 seconds; setup ends for all at the same time
+        node.record_event('start_requested', 100.0)
+        node.record_event('started', 101.0)
+        node.record_event('running', 102.0 + index)
+        node.record_event('reachable', 103.0 + index)
+        node.record_event('configured', 110.0)
+    cluster.add_node('frontend', 'image', 'user', 'flavor', 'default')
+    return cluster
+
+
+def test_summarize():
+    stats = dict(((item['kind'], item['phase']), item)
+                 for item in summarize(_make_cluster()))
+    # nodes with no events recorded are ignored
+    assert sorted(stats) == [('compute', phase) for phase in
+                             ('boot', 'setup', 'ssh', 'submit', 'total')]
+    boot = stats['compute', 'boot']
+    assert boot['count'] == 3
+    assert boot['p50'] == 2.0
+    assert boot['max'] == 3.0
+    # `setup` starts when the node is reachable if not bootstrapped
+    assert stats['compute', 'setup']['max'] == 7.0
+    assert stats['compute', 'total']['p50'] == 10.0
+
+
+def test_make_trace():
+    trace = make_trace(_make_cluster())
+    # must be serializable to JSON
+    json.dumps(trace)
+    phases = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert len(phases) == 3 * 4
+    boot = [event for event in phases if event['name'] == 'boot']
+    assert sorted(event['dur'] for event in boot) == [1000000, 2000000, 3000000]
+    assert min(event['ts'] for event in phases) == 0
+
+
+def test_record_event_replaces_timeline():
+    node = Cluster('test').add_node(
+        'compute', 'image', 'user', 'flavor', 'default')
+    node.record_event('start_requested', 100.0)
+    timeline = node.timeline
+    node.record_event('started', 101.0)
+    # a concurrent reader of the old timeline is not disturbed
+    assert timeline == {'start_requested': 100.0}
+    assert node.timeline == {'start_requested': 100.0, 'started': 101.0}
+    # only the first occurrence of an event is recorded
+    node.record_event('started', 102.0)
+    assert node.timeline['started'] == 101.0
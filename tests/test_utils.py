@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+#
+#   Copyright (C) 2018 University of Zurich
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import
+
+# stdlib imports
+import gc
+import threading
+import time
+
+# 3rd-party imports
+from pytest import raises
+
+# ElastiCluster imports
+from elasticluster.utils import Cache, memoize
+
+
+def test_cache_single_flight():
+    """
+    Concurrent lookups of a missing key only load its value once.
+    """
+    cache = Cache()
+    calls = []
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get('k', load)))
+        for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [42] * 20
+    assert cache.misses == 1
+    assert cache.hits == 19
+
+
+def test_cache_errors_not_cached():
+    cache = Cache()
+    def fail():
+        raise RuntimeError('boom')
+    with raises(RuntimeError):
+        cache.get('k', fail)
+    assert cache.get('k', lambda: 1) == 1
+
+
+def test_cache_ttl():
+    cache = Cache(ttl=0.05)
+    assert cache.get('k', lambda: 1) == 1
+    assert cache.get('k', lambda: 2) == 1
+    time.sleep(0.1)
+    assert cache.get('k', lambda: 3) == 3
+
+
+def test_cache_lru():
+    cache = Cache(maxsize=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    # use `a` so that `b` is the least-recently used item
+    cache.get('a', lambda: None)
+    cache.get('c', lambda: 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_memoize_per_object():
+    class Provider(object):
+        def __init__(self, name):
+            self.name = name
+        @memoize(120)
+        def get_images(self):
+            return [self.name]
+
+    first = Provider('first')
+    second = Provider('second')
+    assert first.get_images() == ['first']
+    assert second.get_images() == ['second']
+    assert first.get_images.cache.hits == 0
+    first.get_images()
+    assert first.get_images.cache.hits == 1
+
+    # caches do not keep objects alive
+    del first, second
+    gc.collect()
+    assert len(Provider.get_images._caches) == 0